@@ -0,0 +1,55 @@
+"""
+Measures selling many units at once with `sell --quantity`, where the
+units are taken from hundreds or thousands of lots, and planning the same
+sale with the SQLite backend. The order the lots are used in is tested in
+test_superpy.py.
+
+Usage:
+    python benchmarks/bench_allocate.py
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from ledger import START_DATE, generate_bought, ledger_directory
+
+from command_functions import sell
+from data_operations import CsvBackend, SqliteBackend
+
+LOT_COUNTS = [100, 1_000, 10_000]
+MAX_QUANTITY = 10
+
+
+if __name__ == '__main__':
+    for lot_count in LOT_COUNTS:
+        with ledger_directory():
+            generate_bought('bought.csv', lot_count, products=['Apples'], days=1, quantity=MAX_QUANTITY)
+            with open('current_date.txt', 'w') as file:
+                file.write(START_DATE.isoformat())
+            today = START_DATE.toordinal()
+
+            backend = CsvBackend()
+            lots = backend.read_bought()
+            # Sell most of the stock, so the units come from most of the lots
+            quantity = sum(lot.quantity for lot in lots) * 3 // 4
+
+            sqlite_backend = SqliteBackend('bench.db')
+            sqlite_backend.write_bought(lots)
+            sqlite_start = time.perf_counter()
+            sqlite_portions = sqlite_backend.allocate('Apples', today, quantity)
+            sqlite_time = time.perf_counter() - sqlite_start
+            sqlite_backend.close()
+
+            args = argparse.Namespace(product_name='Apples', price=0.75, quantity=quantity,
+                                      bought_file='bought.csv', sold_file='sold.csv')
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                sell(args)
+            sell_time = time.perf_counter() - start
+
+            sales = backend.read_sold()
+            assert sum(sale.quantity for sale in sales) == sum(units for _, units in sqlite_portions) == quantity
+
+            print(f'{lot_count:>6} lots: sold {quantity} units from {len(sales)} lots in {sell_time * 1000:.1f} ms, '
+                  f'SQLite plans them in {sqlite_time * 1000:.1f} ms')
@@ -0,0 +1,43 @@
+"""
+Times `buy_batch` and `sell_batch` on a nightly intake of LINES lines.
+
+Usage:
+    python benchmarks/bench_batch.py
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from ledger import PRODUCTS, generate_bought, ledger_directory
+
+from command_functions import buy_batch, sell_batch
+
+LINES = 50_000
+EXISTING_LOTS = 100_000
+
+
+def timed(function, args):
+    """Runs the command with its output discarded and returns its duration in seconds."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    with ledger_directory():
+        generate_bought('bought.csv', EXISTING_LOTS)
+        with open('purchases.csv', 'w') as file:
+            file.write('product_name;price;expiration_date\n')
+            for line in range(LINES):
+                file.write(f'{PRODUCTS[line % len(PRODUCTS)]};1.25;2021-01-01\n')
+        with open('sales.jsonl', 'w') as file:
+            for line in range(LINES):
+                file.write(f'{{"product_name": "{PRODUCTS[line % len(PRODUCTS)]}", "price": 2.5}}\n')
+
+        buy_time = timed(buy_batch, argparse.Namespace(file='purchases.csv', bought_file='bought.csv'))
+        sell_time = timed(sell_batch, argparse.Namespace(file='sales.jsonl', bought_file='bought.csv', sold_file='sold.csv'))
+
+    print(f'buy_batch:  {LINES} lines in {buy_time:.2f} s ({LINES / buy_time:,.0f} lines per second)')
+    print(f'sell_batch: {LINES} lines in {sell_time:.2f} s ({LINES / sell_time:,.0f} lines per second)')
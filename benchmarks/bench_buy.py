@@ -0,0 +1,56 @@
+"""
+Measures the cost of a single `buy` as the bought file grows.
+
+With the append-only write path the per-buy cost should stay flat, no
+matter how many rows are already in the file.
+
+Usage:
+    python benchmarks/bench_buy.py
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from ledger import generate_bought, ledger_directory
+
+from command_functions import buy
+from data_operations import next_id
+
+SIZES = [1_000, 10_000, 100_000]
+BUYS = 200
+
+
+def time_buys(rows):
+    """
+    Times BUYS purchases against a bought file with the given number of rows.
+
+    Parameters:
+    ----------
+    rows : int
+        The number of rows in the bought file before buying.
+
+    Returns:
+    -------
+    float
+        The average time per buy in milliseconds.
+    """
+    with ledger_directory():
+        generate_bought('bought.csv', rows)
+        # The generated file has no sequence file yet, scan its IDs once before timing
+        next_id('bought.csv')
+        args = argparse.Namespace(product_name='Apples', price=0.5, expiration_date='2020-02-01', quantity=1,
+                                  bought_file='bought.csv')
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(BUYS):
+                buy(args)
+        elapsed = time.perf_counter() - start
+
+    return elapsed / BUYS * 1000
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        print(f'{rows:>9} rows: {time_buys(rows):.3f} ms per buy')
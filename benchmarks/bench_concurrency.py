@@ -0,0 +1,93 @@
+"""
+Stress test for parallel SuperPy processes writing to the same ledger.
+
+Every worker process buys and sells OPERATIONS products through the CSV
+backend. Afterwards the ledgers are checked for lost rows, duplicate
+IDs and lots that were sold twice, and the throughput is reported for
+each level of concurrency.
+
+Usage:
+    python benchmarks/bench_concurrency.py
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+from ledger import generate_bought, ledger_directory
+
+from command_functions import buy, sell
+from data_operations import read_bought, read_sold
+
+WORKERS = [1, 2, 4, 8]
+OPERATIONS = 100
+INITIAL_LOTS = 1_000
+
+
+def worker(directory, operations):
+    """Buys and sells OPERATIONS times in the ledger directory."""
+    os.chdir(directory)
+    buy_args = argparse.Namespace(product_name='Apples', price=0.5, expiration_date='2030-01-01', quantity=1,
+                                  bought_file='bought.csv')
+    sell_args = argparse.Namespace(product_name='Apples', price=0.75, quantity=1,
+                                   bought_file='bought.csv', sold_file='sold.csv')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(operations):
+            buy(buy_args)
+            sell(sell_args)
+
+
+def run(workers):
+    """
+    Runs the given number of workers in parallel and checks the ledgers.
+
+    Returns:
+    -------
+    float
+        The number of buy and sell operations per second.
+    """
+    with ledger_directory() as directory:
+        generate_bought('bought.csv', INITIAL_LOTS, products=['Apples'], days=1)
+
+        processes = [multiprocessing.Process(target=worker, args=(directory, OPERATIONS)) for _ in range(workers)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        bought_data = read_bought('bought.csv')
+        sold_data = read_sold('sold.csv')
+
+    expected = workers * OPERATIONS
+    bought_ids = [lot.id for lot in bought_data]
+    sold_ids = [sale.id for sale in sold_data]
+    lot_ids = [sale.bought_id for sale in sold_data]
+
+    problems = []
+    if len(bought_data) != INITIAL_LOTS + expected:
+        problems.append(f'{INITIAL_LOTS + expected - len(bought_data)} bought rows lost')
+    if len(sold_data) != expected:
+        problems.append(f'{expected - len(sold_data)} sold rows lost')
+    if len(set(bought_ids)) != len(bought_ids) or len(set(sold_ids)) != len(sold_ids):
+        problems.append('duplicate IDs')
+    if len(set(lot_ids)) != len(lot_ids):
+        problems.append('lots sold twice')
+    if problems:
+        raise AssertionError(f'{workers} workers: ' + ', '.join(problems))
+
+    return 2 * expected / elapsed
+
+
+if __name__ == '__main__':
+    for workers in WORKERS:
+        try:
+            throughput = run(workers)
+        except AssertionError as error:
+            print(f'FAILED: {error}')
+            sys.exit(1)
+        print(f'{workers:>2} workers: {throughput:,.0f} operations per second, no rows lost')
@@ -0,0 +1,89 @@
+"""
+Compares deleting sales by rewriting the sold file, as every delete used
+to do, with appending tombstones after a binary search for the rows. Then
+compares finding the sales of deleted lots by reading the whole sold file
+with the index of the sales of every lot, and checks the rollups against
+a rebuild.
+
+Usage:
+    python benchmarks/bench_delete.py
+"""
+import random
+import time
+
+from ledger import generate_bought, generate_sold, ledger_directory
+
+from data_operations import CsvBackend, read_bought, read_sold, write_sold
+from rollups import Rollups
+
+SIZES = [100_000, 1_000_000]
+DELETES = 1000
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows)
+            generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+            backend = CsvBackend()
+            backend.rebuild_rollups()
+            # The generated files have no sequence files yet, scan their IDs once before timing
+            backend.next_bought_id()
+            backend.next_sold_id()
+            ids = random.Random(0).sample(range(1, int(rows * 0.7)), DELETES + 1)
+
+            # One rewrite of the file, the old cost of every single delete
+            start = time.perf_counter()
+            sold_data = read_sold()
+            write_sold([sale for sale in sold_data if sale.id != ids[0]])
+            rewrite_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with backend.transaction():
+                deleted = backend.delete_sold([ids[1]])
+            single_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with backend.transaction():
+                deleted |= backend.delete_sold(ids[2:])
+            bulk_time = time.perf_counter() - start
+
+            assert len(deleted) == DELETES
+            assert not {sale.id for sale in read_sold()} & set(ids)
+            print(f'{rows:>9} rows: rewrite {rewrite_time * 1000:.0f} ms per delete, '
+                  f'tombstone {single_time * 1000:.1f} ms per delete, '
+                  f'{DELETES - 1} deletes in one call {bulk_time * 1000:.0f} ms (incl. compaction)')
+
+            # The rewrite above bypassed the rollups
+            backend.rebuild_rollups()
+            lot_ids = random.Random(1).sample(range(1, int(rows * 0.7)), DELETES + 2)
+
+            # Every delete of a lot used to read the whole sold file for its sales
+            start = time.perf_counter()
+            sales = [sale for sale in backend.iter_sold() if sale.bought_id == lot_ids[0]]
+            scan_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with backend.transaction():
+                deleted = backend.delete_bought([lot_ids[0]])
+            first_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with backend.transaction():
+                deleted |= backend.delete_bought([lot_ids[1]])
+            lot_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with backend.transaction():
+                deleted |= backend.delete_bought(lot_ids[2:])
+            bulk_lot_time = time.perf_counter() - start
+
+            assert len(deleted) == DELETES + 2
+            assert not {lot.id for lot in read_bought('bought.csv')} & set(lot_ids)
+            # The rollup file itself, so a rebuild by read_rollups does not hide a wrong update
+            rollups = Rollups.load('sold.csv.rollup').rows()
+            expected = Rollups.from_data(backend.iter_bought(), backend.iter_sold()).rows()
+            assert [rollup.to_fields() for rollup in rollups] == [rollup.to_fields() for rollup in expected]
+            print(f'{rows:>9} rows: sold file scan {scan_time * 1000:.0f} ms per deleted lot, '
+                  f'indexed {lot_time * 1000:.1f} ms per deleted lot ({first_time * 1000:.0f} ms building the index), '
+                  f'{DELETES} lots in one call {bulk_lot_time * 1000:.0f} ms')
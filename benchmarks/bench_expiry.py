@@ -0,0 +1,44 @@
+"""
+Compares finding the lots that expire in the next week with a full scan
+of the ledgers against the stored expiry queue, after a purchase was
+appended to the bought file.
+
+Usage:
+    python benchmarks/bench_expiry.py
+"""
+import time
+
+from ledger import START_DATE, generate_bought, generate_sold, ledger_directory
+
+from data_operations import CsvBackend
+from inventory import ExpiryQueue
+from records import BoughtLot
+
+SIZES = [100_000, 1_000_000]
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows)
+            generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+            backend = CsvBackend()
+            today = START_DATE.toordinal() + 180
+
+            start = time.perf_counter()
+            backend.expiry_queue()
+            build_time = time.perf_counter() - start
+
+            backend.append_bought(BoughtLot(rows + 1, 'Kiwi', 100, today + 3, today))
+
+            start = time.perf_counter()
+            expected = ExpiryQueue.from_data(backend.read_bought(), backend.read_sold()).expiring(today, today + 7)
+            scan_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            lots = backend.expiring_lots(today, today + 7)
+            queue_time = time.perf_counter() - start
+
+            assert [(lot.id, remaining) for lot, remaining in lots] == [(lot.id, remaining) for lot, remaining in expected]
+            print(f'{rows:>9} rows: full scan {scan_time * 1000:.0f} ms, expiry queue {queue_time * 1000:.1f} ms '
+                  f'for {len(lots)} lots, built in {build_time:.2f} s')
@@ -0,0 +1,67 @@
+"""
+Compares the old nested-loop join with the buy price index that the
+report joins the sales to.
+
+The nested loop is only timed at the smallest size; at larger sizes it
+would run for hours.
+
+Usage:
+    python benchmarks/bench_join.py
+"""
+import time
+
+from ledger import generate_bought, generate_sold, ledger_directory
+
+from data_operations import read_bought, read_sold
+
+SIZES = [10_000, 100_000, 1_000_000]
+NESTED_LOOP_LIMIT = 10_000
+
+
+def nested_loop_profit(bought_data, sold_data):
+    """Computes the profit the way the old calculate_profit did."""
+    profit = 0
+    for sale in sold_data:
+        lot = next((b for b in bought_data if b.id == sale.bought_id), None)
+        if lot is not None:
+            profit += sale.quantity * (sale.sell_price - lot.buy_price)
+    return profit
+
+
+def hash_join_profit(bought_data, sold_data):
+    """Computes the profit by joining each sale to an index of the buy prices."""
+    buy_prices = {}
+    for lot in bought_data:
+        buy_prices.setdefault(lot.id, lot.buy_price)
+    profit = 0
+    for sale in sold_data:
+        buy_price = buy_prices.get(sale.bought_id)
+        if buy_price is not None:
+            profit += sale.quantity * (sale.sell_price - buy_price)
+    return profit
+
+
+def time_call(function, *args):
+    """Returns the result of the call and its duration in seconds."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows)
+            generate_sold('sold.csv', 'bought.csv')
+            bought_data = read_bought('bought.csv')
+            sold_data = read_sold()
+
+        profit, hash_time = time_call(hash_join_profit, bought_data, sold_data)
+        line = f'{rows:>9} rows: hash join {hash_time:.3f} s'
+
+        if rows <= NESTED_LOOP_LIMIT:
+            nested_profit, nested_time = time_call(nested_loop_profit, bought_data, sold_data)
+            assert nested_profit == profit
+            line += f', nested loop {nested_time:.3f} s ({nested_time / hash_time:.0f}x slower)'
+
+        print(line)
@@ -0,0 +1,61 @@
+"""
+Compares the time to print a full listing as a PrettyTable with the
+streaming csv, tsv and jsonl formats, and checks that every format holds
+the same rows. Each command runs as a `superpy.py` process that writes to
+a pipe, like a listing piped into another tool.
+
+Usage:
+    python benchmarks/bench_output.py
+"""
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+from ledger import START_DATE, generate_bought, generate_sold, ledger_directory
+
+SUPERPY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'superpy.py')
+SIZES = [10_000, 100_000]
+FORMATS = ['table', 'csv', 'tsv', 'jsonl']
+
+
+def run(*arguments):
+    """Runs a SuperPy command and returns its output and wall-clock time."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, SUPERPY, *arguments], check=True, capture_output=True, text=True)
+    return result.stdout, time.perf_counter() - start
+
+
+def ids(output_format, text):
+    """Returns the lot IDs of a listing in one of the formats."""
+    if output_format == 'table':
+        return [line.split('|')[1].strip() for line in text.splitlines()[3:-1]]
+    if output_format == 'jsonl':
+        return [str(json.loads(line)['id']) for line in text.splitlines()]
+    delimiter = ',' if output_format == 'csv' else '\t'
+    return [row['id'] for row in csv.DictReader(io.StringIO(text), delimiter=delimiter)]
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows)
+            generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+            with open('current_date.txt', 'w') as file:
+                file.write(START_DATE.isoformat())
+            # Build the sidecar files before timing
+            run('list', '--format', 'csv', '--limit', '1')
+
+            expected = [str(number) for number in range(1, rows + 1)]
+            times = {}
+            for output_format in FORMATS:
+                text, times[output_format] = run('list', '--format', output_format)
+                assert ids(output_format, text) == expected
+
+            page, _ = run('list', '--format', 'csv', '--offset', '100', '--limit', '10')
+            assert ids('csv', page) == expected[100:110]
+
+            print(f'{rows:>7} rows: ' + ', '.join(f'{name} {seconds:.2f} s' for name, seconds in times.items()))
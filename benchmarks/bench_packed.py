@@ -0,0 +1,92 @@
+"""
+Compares loading the ledgers from CSV with the memory-mapped packed files,
+for reading every sale and for summing the daily totals of one month.
+Each measurement runs in a fresh process, so the peak RSS is its own.
+
+Usage:
+    python benchmarks/bench_packed.py
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from ledger import START_DATE, generate_bought, generate_sold, ledger_directory
+
+from data_operations import CsvBackend, PackedBackend
+from rollups import Rollups
+
+SIZES = [100_000, 1_000_000]
+BACKENDS = {'csv': CsvBackend, 'packed': PackedBackend}
+
+
+def measure(backend_name, task):
+    """Runs one task on one backend and returns its time and peak RSS."""
+    backend = BACKENDS[backend_name]()
+    start_date = START_DATE.toordinal() + 180
+    start = time.perf_counter()
+    if task == 'load':
+        result = len(backend.read_sold())
+    elif backend_name == 'csv':
+        # Sum from the raw sales, like the packed backend, instead of the rollup file
+        sales = backend.iter_sold(start_date, start_date + 29)
+        result = sum(rollup.profit for rollup in Rollups.from_data(backend.iter_bought(), sales).rows())
+    else:
+        result = sum(rollup.profit for rollup in backend.read_rollups(start_date, start_date + 29))
+    elapsed = time.perf_counter() - start
+    return {'result': result, 'time': elapsed, 'rss': peak_rss()}
+
+
+def peak_rss():
+    """Returns the peak RSS of this process in MB."""
+    try:
+        # ru_maxrss is inherited over exec on Linux, VmHWM is not
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def run(backend_name, task):
+    """Measures a task in a new process."""
+    output = subprocess.run(
+        [sys.executable, __file__, '--measure', backend_name, task],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--measure', nargs=2, metavar=('BACKEND', 'TASK'))
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(*args.measure)))
+        sys.exit()
+
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows)
+            generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+            csv_backend = CsvBackend()
+            packed_backend = PackedBackend()
+
+            start = time.perf_counter()
+            packed_backend.write_bought(csv_backend.read_bought())
+            packed_backend.write_sold(csv_backend.read_sold())
+            convert_time = time.perf_counter() - start
+
+            for task in ['load', 'month']:
+                csv_result, packed_result = run('csv', task), run('packed', task)
+                assert csv_result['result'] == packed_result['result']
+                print(f'{rows:>9} rows, {task:>5}: csv {csv_result["time"] * 1000:.0f} ms / {csv_result["rss"]:.0f} MB, '
+                      f'packed {packed_result["time"] * 1000:.0f} ms / {packed_result["rss"]:.0f} MB '
+                      f'({csv_result["time"] / packed_result["time"]:.1f}x)')
+            print(f'{rows:>9} rows: converted in {convert_time:.2f} s')
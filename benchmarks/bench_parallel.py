@@ -0,0 +1,57 @@
+"""
+Compares summing the sales per product and day in this process with
+splitting the files over several worker processes, and checks that every
+number of workers gives exactly the same totals, also for a date range
+and with deleted rows.
+
+Usage:
+    python benchmarks/bench_parallel.py [--workers 1 2 4 8]
+"""
+import argparse
+import os
+import time
+
+from ledger import START_DATE, generate_bought, generate_sold, ledger_directory
+
+from data_operations import CsvBackend
+from rollups import Rollups
+
+SIZES = [100_000, 1_000_000]
+
+
+def totals(rollups):
+    """Returns the rollups as comparable tuples."""
+    return [(rollup.day, rollup.product_name, rollup.revenue, rollup.cost, rollup.units, rollup.profit)
+            for rollup in rollups.rows()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    args = parser.parse_args()
+    print(f'{os.cpu_count()} CPUs')
+
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows)
+            generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+            backend = CsvBackend()
+            backend.delete_bought(range(1, rows, 97))
+            backend.delete_sold(range(1, rows, 89))
+
+            start = time.perf_counter()
+            expected = totals(Rollups.from_data(backend.iter_bought(), backend.iter_sold()))
+            serial_time = time.perf_counter() - start
+
+            start_date, end_date = START_DATE.toordinal() + 100, START_DATE.toordinal() + 200
+            expected_range = totals(Rollups.from_data(backend.iter_bought(), backend.iter_sold(start_date, end_date)))
+
+            for workers in args.workers:
+                start = time.perf_counter()
+                result = totals(backend.parallel_rollups(workers))
+                parallel_time = time.perf_counter() - start
+
+                assert result == expected
+                assert totals(backend.parallel_rollups(workers, start_date, end_date)) == expected_range
+                print(f'{rows:>9} rows: serial {serial_time:.2f} s, {workers} workers {parallel_time:.2f} s '
+                      f'({serial_time / parallel_time:.1f}x)')
@@ -0,0 +1,52 @@
+"""
+Measures saving a revenue plot without a display, per bucket size, and
+serving the same plot again from the image cache. Checks that a cached
+image is identical to the rendered one and that changing the data
+renders a new image.
+
+Usage:
+    python benchmarks/bench_plot.py
+"""
+import argparse
+import contextlib
+import filecmp
+import io
+import time
+
+from ledger import generate_bought, generate_sold, ledger_directory
+
+from command_functions import plot_revenue
+from data_operations import CsvBackend
+
+ROWS = 1_000_000
+DAYS = 3 * 365
+BUCKETS = ['daily', 'weekly', 'monthly']
+
+
+def timed_plot(output, bucket):
+    """Saves a plot and returns the time it took in milliseconds."""
+    args = argparse.Namespace(start_date=None, end_date=None, engine='auto', workers=1, output=output, bucket=bucket,
+                              bought_file='bought.csv', sold_file='sold.csv')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        plot_revenue(args)
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == '__main__':
+    with ledger_directory():
+        generate_bought('bought.csv', ROWS, days=DAYS)
+        generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+        # Build the rollups first, so only the plotting is timed
+        CsvBackend().read_rollups()
+
+        for bucket in BUCKETS:
+            rendered = timed_plot(f'{bucket}.png', bucket)
+            cached = timed_plot(f'{bucket}_again.png', bucket)
+            assert filecmp.cmp(f'{bucket}.png', f'{bucket}_again.png', shallow=False)
+            print(f'{bucket:>8}: rendered in {rendered:.0f} ms, from the cache in {cached:.1f} ms')
+
+        CsvBackend().delete_sold([1])
+        changed = timed_plot('changed.png', 'daily')
+        assert not filecmp.cmp('daily.png', 'changed.png', shallow=False)
+        print(f'after a change: rendered in {changed:.0f} ms')
@@ -0,0 +1,50 @@
+"""
+Compares a full scan with the date index for a one-week range query on
+five years of sales, and checks that both return the same sales.
+
+Usage:
+    python benchmarks/bench_range.py
+"""
+import os
+import time
+
+from ledger import generate_bought, generate_sold, ledger_directory
+
+from data_operations import iter_records, load_date_index
+from records import Sale
+
+SIZES = [100_000, 1_000_000]
+DAYS = 5 * 365
+
+
+def full_scan(start_date, end_date):
+    """Streams the sales in the range without the date index."""
+    return [sale for sale in iter_records('sold.csv', Sale) if start_date <= sale.sell_date <= end_date]
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows, days=DAYS)
+            generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+
+            start = time.perf_counter()
+            index = load_date_index('sold.csv', 'SELL_DATE')
+            build_time = time.perf_counter() - start
+
+            start_date = Sale.from_fields('0', '', '', '0', index.dates[len(index.dates) // 2]).sell_date
+            end_date = start_date + 6
+
+            start = time.perf_counter()
+            expected = full_scan(start_date, end_date)
+            scan_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            sales = list(iter_records('sold.csv', Sale, 'SELL_DATE', start_date, end_date))
+            index_time = time.perf_counter() - start
+
+            assert [sale.id for sale in sales] == [sale.id for sale in expected]
+            size = os.path.getsize('sold.csv')
+            print(f'{rows:>9} rows ({size / 1e6:.0f} MB): full scan {scan_time * 1000:.1f} ms, '
+                  f'index {index_time * 1000:.2f} ms for {len(sales)} sales '
+                  f'({index_time and scan_time / index_time:.0f}x), index built in {build_time:.2f} s')
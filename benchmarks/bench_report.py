@@ -0,0 +1,51 @@
+"""
+Times the one-pass report aggregation for each grouping on a large
+ledger, and checks its totals against the daily rollups and its top-N
+ranking against a full sort.
+
+Usage:
+    python benchmarks/bench_report.py
+"""
+import time
+
+from ledger import generate_bought, generate_sold, ledger_directory
+
+import report
+from data_operations import CsvBackend
+from rollups import Rollups
+
+ROWS = 1_000_000
+DAYS = 3 * 365
+GROUPINGS = [['product'], ['month'], ['product', 'month'], ['product', 'day']]
+TOP = 10
+
+if __name__ == '__main__':
+    with ledger_directory():
+        generate_bought('bought.csv', ROWS, days=DAYS, quantity=5)
+        generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+        backend = CsvBackend()
+        # Write off a few sales, so there is spoilage to sum
+        sales = backend.read_sold()
+        for sale in sales[::50]:
+            sale.sell_price = 0
+            sale.written_off = True
+        backend.write_sold(sales)
+
+        rollups = Rollups.from_data(backend.iter_bought(), backend.iter_sold()).rows()
+        expected = [sum(getattr(rollup, name) for rollup in rollups) for name in ('revenue', 'cost', 'profit', 'units')]
+
+        for group_by in GROUPINGS:
+            start = time.perf_counter()
+            totals = report.aggregate(backend.iter_bought(), backend.iter_sold(), group_by)
+            aggregate_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            top = report.ranked(totals, 'profit', TOP)
+            rank_time = time.perf_counter() - start
+
+            sums = [sum(group[index] for group in totals.values()) for index in range(6)]
+            revenue, cost, profit, units, _, _ = sums
+            assert [revenue, cost, profit, units] == expected
+            assert top == report.ranked(totals, 'profit')[:TOP]
+            print(f'{" ".join(group_by):>14}: {len(totals):>6} groups in {aggregate_time:.2f} s, '
+                  f'top {TOP} by profit in {rank_time * 1000:.1f} ms')
@@ -0,0 +1,51 @@
+"""
+Compares the row loop with the columnar NumPy engine for revenue per day,
+on data that is already loaded.
+
+Usage:
+    python benchmarks/bench_revenue.py
+"""
+import time
+
+from ledger import generate_bought, generate_sold, ledger_directory
+
+import columnar
+from data_operations import read_sold
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def python_revenue_per_day(sold_data, start_date, end_date):
+    """Groups the revenue per day with the row loop."""
+    revenue = {}
+    for sale in sold_data:
+        if start_date <= sale.sell_date <= end_date:
+            revenue[sale.sell_date] = revenue.get(sale.sell_date, 0) + sale.quantity * sale.sell_price
+    return revenue
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows, quantity=3)
+            generate_sold('sold.csv', 'bought.csv')
+            sold_data = read_sold()
+
+        start_date = min(sale.sell_date for sale in sold_data)
+        end_date = start_date + 180
+
+        start = time.perf_counter()
+        expected = python_revenue_per_day(sold_data, start_date, end_date)
+        python_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sold_columns = columnar.SoldColumns(sold_data)
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        revenue = sold_columns.revenue_per_day(start_date, end_date)
+        query_time = time.perf_counter() - start
+
+        assert revenue == expected
+        print(f'{rows:>9} rows: python {python_time:.3f} s, '
+              f'numpy {load_time:.3f} s to load + {query_time * 1000:.2f} ms per revenue query')
@@ -0,0 +1,42 @@
+"""
+Compares summing the revenue per day from the raw sales with reading the
+daily rollups, and checks that both give the same totals.
+
+Usage:
+    python benchmarks/bench_rollups.py
+"""
+import argparse
+import time
+
+from ledger import generate_bought, generate_sold, ledger_directory
+
+from command_functions import revenue_per_day
+from data_operations import CsvBackend
+
+SIZES = [100_000, 1_000_000]
+
+
+def timed(engine):
+    """Returns the revenue per day with the given engine and the time it took."""
+    args = argparse.Namespace(start_date=None, end_date=None, engine=engine)
+    start = time.perf_counter()
+    revenue = revenue_per_day(args)
+    return revenue, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    for rows in SIZES:
+        with ledger_directory():
+            generate_bought('bought.csv', rows, days=5 * 365)
+            generate_sold('sold.csv', 'bought.csv', in_date_order=True)
+
+            expected, scan_time = timed('python')
+
+            start = time.perf_counter()
+            CsvBackend().rebuild_rollups()
+            rebuild_time = time.perf_counter() - start
+
+            revenue, rollup_time = timed('auto')
+            assert revenue == expected
+            print(f'{rows:>9} rows: scanning the sales {scan_time * 1000:.0f} ms, '
+                  f'rollups {rollup_time * 1000:.1f} ms ({scan_time / rollup_time:.0f}x), rebuilt in {rebuild_time:.2f} s')
@@ -0,0 +1,83 @@
+"""
+Measures how the cost of `sell` depends on the number of lots of the
+product being sold, at a constant ledger size, how the cost of planning a
+sale from the snapshot of unsold lots grows with the ledger, and the cost
+of asking for the simulated current date.
+
+Usage:
+    python benchmarks/bench_sell.py
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import time
+
+from ledger import START_DATE, generate_bought, ledger_directory
+
+from command_functions import sell
+from data_operations import CsvBackend
+from utils import get_current_date
+
+LEDGER_ROWS = 20_000
+MATCHING_LOTS = [10, 1_000, 10_000]
+SELLS = 20
+LEDGER_SIZES = [10_000, 100_000, 400_000]
+DATE_CALLS = 100_000
+
+
+def read_date_from_file():
+    """Reads the current date the way get_current_date used to, on every call."""
+    with open('current_date.txt') as file:
+        return datetime.datetime.strptime(file.read().strip(), '%Y-%m-%d').date()
+
+
+def time_sells(matching_lots):
+    """Returns the average time per sell in milliseconds."""
+    with ledger_directory():
+        # Spread the same number of rows over more or fewer products
+        products = ['Apples'] + [f'Other{number}' for number in range(LEDGER_ROWS // matching_lots - 1)]
+        generate_bought('bought.csv', LEDGER_ROWS, products=products, days=1)
+        args = argparse.Namespace(product_name='Apples', price=0.75, quantity=1, bought_file='bought.csv', sold_file='sold.csv')
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(SELLS):
+                sell(args)
+        return (time.perf_counter() - start) / SELLS * 1000
+
+
+def time_allocate(rows):
+    """Returns the average time to plan a sell of one product in milliseconds."""
+    with ledger_directory():
+        generate_bought('bought.csv', rows, products=[f'Product{number}' for number in range(100)], days=365)
+        backend = CsvBackend()
+        # Write the snapshot first, so only loading it is timed
+        backend.expiry_queue(checkpoint=True)
+        today = START_DATE.toordinal() + 180
+
+        start = time.perf_counter()
+        for _ in range(SELLS):
+            portions = backend.allocate('Product0', today, 1)
+        assert portions and all(lot.expiration_date > today for lot, _ in portions)
+        return (time.perf_counter() - start) / SELLS * 1000
+
+
+def time_calls(function):
+    """Returns the average time per call in microseconds."""
+    start = time.perf_counter()
+    for _ in range(DATE_CALLS):
+        function()
+    return (time.perf_counter() - start) / DATE_CALLS * 1_000_000
+
+
+if __name__ == '__main__':
+    with ledger_directory():
+        print(f'current date from file:     {time_calls(read_date_from_file):.2f} us per call')
+        print(f'current date from provider: {time_calls(get_current_date):.2f} us per call')
+
+    for matching_lots in MATCHING_LOTS:
+        print(f'{matching_lots:>6} matching lots of {LEDGER_ROWS}: {time_sells(matching_lots):.2f} ms per sell')
+
+    for rows in LEDGER_SIZES:
+        print(f'{rows:>6} rows, 100 products: {time_allocate(rows):.2f} ms to plan a sell')
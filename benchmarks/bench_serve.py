@@ -0,0 +1,65 @@
+"""
+Compares sell latency through a running `superpy.py serve --socket`
+process with launching `superpy.py sell` for every sale.
+
+Usage:
+    python benchmarks/bench_serve.py
+"""
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from ledger import generate_bought, ledger_directory
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUPERPY = os.path.join(REPOSITORY, 'superpy.py')
+
+LOTS = 100_000
+SELLS = 500
+PROCESS_SELLS = 10
+
+
+def wait_for(path, timeout=30):
+    """Waits until the server created its socket."""
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{path} was not created')
+        time.sleep(0.05)
+
+
+if __name__ == '__main__':
+    with ledger_directory() as directory:
+        generate_bought('bought.csv', LOTS, products=['Apples'], days=1)
+        socket_path = os.path.join(directory, 'superpy.sock')
+        server = subprocess.Popen([sys.executable, SUPERPY, 'serve', '--socket', socket_path], stdout=subprocess.DEVNULL)
+        try:
+            wait_for(socket_path)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.connect(socket_path)
+                responses = connection.makefile('rb')
+
+                latencies = []
+                for _ in range(SELLS):
+                    start = time.perf_counter()
+                    connection.sendall(json.dumps(['sell', 'Apples', '0.75']).encode() + b'\n')
+                    output = json.loads(responses.readline())
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    assert output.strip() == 'OK', output
+        finally:
+            server.terminate()
+            server.wait()
+
+        process_latencies = []
+        for _ in range(PROCESS_SELLS):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, SUPERPY, 'sell', 'Apples', '0.75'], capture_output=True, check=True)
+            process_latencies.append((time.perf_counter() - start) * 1000)
+
+    print(f'{LOTS} lots, serve:   median {statistics.median(latencies):.2f} ms per sell '
+          f'(first {latencies[0]:.1f} ms loads the ledger)')
+    print(f'{LOTS} lots, process: median {statistics.median(process_latencies):.2f} ms per sell')
@@ -0,0 +1,85 @@
+"""
+Checks the cold start of SuperPy commands that do not plot.
+
+Importing superpy is timed with `python -X importtime`. The script fails
+with exit code 1 if the import takes longer than IMPORT_BUDGET_MS, or if
+one of the heavy optional dependencies is imported at startup. It also
+reports the wall-clock time of a few commands that print nothing heavy.
+
+Usage:
+    python benchmarks/bench_startup.py
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from ledger import ledger_directory
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUPERPY = os.path.join(REPOSITORY, 'superpy.py')
+
+IMPORT_BUDGET_MS = 150
+HEAVY_MODULES = ['matplotlib', 'prettytable', 'numpy']
+RUNS = 5
+COMMANDS = [
+    ['advance_time', '0'],
+    ['buy', 'Apples', '0.5', '2030-01-01'],
+    ['sell', 'Apples', '0.75'],
+]
+
+
+def import_times():
+    """
+    Imports superpy in a fresh interpreter with -X importtime.
+
+    Returns:
+    -------
+    dict
+        The cumulative import time in microseconds of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import superpy'],
+        cwd=REPOSITORY, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def command_time(command):
+    """Returns the median wall-clock time of a command in milliseconds."""
+    durations = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SUPERPY, *command], capture_output=True, check=True)
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+if __name__ == '__main__':
+    failures = []
+
+    runs = [import_times() for _ in range(RUNS)]
+    superpy_ms = statistics.median(times['superpy'] for times in runs) / 1000
+    times = runs[-1]
+    print(f'import superpy: {superpy_ms:.1f} ms (budget {IMPORT_BUDGET_MS} ms)')
+    if superpy_ms > IMPORT_BUDGET_MS:
+        failures.append(f'import superpy takes {superpy_ms:.1f} ms')
+
+    for module in HEAVY_MODULES:
+        if module in times:
+            failures.append(f'{module} is imported at startup ({times[module] / 1000:.1f} ms)')
+
+    with ledger_directory():
+        for command in COMMANDS:
+            print(f'superpy.py {" ".join(command)}: {command_time(command):.1f} ms')
+
+    if failures:
+        print('FAILED: ' + '; '.join(failures))
+        sys.exit(1)
@@ -0,0 +1,143 @@
+"""
+Helpers shared by the benchmark scripts.
+
+The benchmarks run against synthetic ledgers in a temporary directory, so
+the real bought.csv and sold.csv files are never touched.
+"""
+import contextlib
+import csv
+import datetime
+import os
+import random
+import sys
+import tempfile
+
+# Make the SuperPy modules importable when a benchmark is run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PRODUCTS = ['Apples', 'Oranges', 'Bananas', 'Pears', 'Milk', 'Bread', 'Eggs', 'Cheese']
+START_DATE = datetime.date(2020, 1, 1)
+
+
+def product_names(count):
+    """
+    Returns the given number of product names, starting with PRODUCTS.
+
+    Parameters:
+    ----------
+    count : int
+        The number of product names.
+
+    Returns:
+    -------
+    list of str
+        The product names.
+    """
+    return (PRODUCTS + [f'Product {number}' for number in range(len(PRODUCTS) + 1, count + 1)])[:count]
+
+
+def generate_bought(file_name, rows, products=PRODUCTS, days=365, seed=0, quantity=1):
+    """
+    Writes a synthetic bought file with the given number of rows.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to write.
+    rows : int
+        The number of rows to generate.
+    products : list of str
+        The product names to pick from.
+    days : int
+        The number of days the buy dates are spread over.
+    seed : int
+        The seed for the random generator.
+    quantity : int
+        The largest number of units in a lot. Lots hold a random number
+        of units up to it.
+
+    Returns:
+    -------
+    None
+    """
+    rng = random.Random(seed)
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(['ID', 'PRODUCT_NAME', 'BUY_PRICE', 'EXPIRATION_DATE', 'BUY_DATE', 'QUANTITY'])
+        for row_id in range(1, rows + 1):
+            buy_date = START_DATE + datetime.timedelta(days=row_id * days // max(rows, 1))
+            expiration_date = buy_date + datetime.timedelta(days=rng.randint(1, 30))
+            writer.writerow([
+                row_id,
+                rng.choice(products),
+                f'{rng.randint(10, 500) / 100:.2f}',
+                expiration_date.isoformat(),
+                buy_date.isoformat(),
+                rng.randint(1, quantity) if quantity > 1 else 1,
+            ])
+
+
+def generate_sold(file_name, bought_file, fraction=0.8, seed=1, in_date_order=False):
+    """
+    Writes a synthetic sold file that sells all units of a fraction of the
+    bought lots.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to write.
+    bought_file : str
+        The bought file whose lots are sold.
+    fraction : float
+        The fraction of lots that is sold.
+    seed : int
+        The seed for the random generator.
+    in_date_order : bool
+        Write the sales sorted by sell date, like a ledger that was
+        filled by selling day by day.
+
+    Returns:
+    -------
+    None
+    """
+    rng = random.Random(seed)
+    sales = []
+    with open(bought_file, newline='') as source:
+        for row in csv.DictReader(source, delimiter=';'):
+            if rng.random() >= fraction:
+                continue
+            buy_date = datetime.date.fromisoformat(row['BUY_DATE'])
+            expiration_date = datetime.date.fromisoformat(row['EXPIRATION_DATE'])
+            sell_date = buy_date + datetime.timedelta(days=rng.randint(0, (expiration_date - buy_date).days - 1))
+            sell_price = f'{float(row["BUY_PRICE"]) * 1.5:.2f}'
+            sales.append((sell_date.isoformat(), row['ID'], row['PRODUCT_NAME'], sell_price, row.get('QUANTITY') or '1'))
+
+    if in_date_order:
+        sales.sort(key=lambda sale: sale[0])
+
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(['ID', 'BOUGHT_ID', 'PRODUCT_NAME', 'SELL_PRICE', 'SELL_DATE', 'QUANTITY'])
+        for sold_id, (sell_date, bought_id, product_name, sell_price, quantity) in enumerate(sales, 1):
+            writer.writerow([sold_id, bought_id, product_name, sell_price, sell_date, quantity])
+
+
+@contextlib.contextmanager
+def ledger_directory():
+    """
+    Runs the enclosed block inside a fresh temporary directory.
+
+    Yields:
+    ------
+    str
+        The path of the temporary directory.
+    """
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with open('current_date.txt', 'w') as file:
+                file.write(START_DATE.isoformat())
+            yield directory
+        finally:
+            os.chdir(previous_directory)
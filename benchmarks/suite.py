@@ -0,0 +1,268 @@
+"""
+Times every SuperPy command on synthetic ledgers of several sizes, and
+compares two runs to find regressions.
+
+Every command runs as a separate `superpy.py` process, like a user would
+run it, so the times include the start of the interpreter. The first run
+of each command is a warm-up that builds the sidecar files (date index,
+rollups, snapshot), the following runs are measured. For each command
+and size the results hold the latency percentiles, the throughput in
+ledger rows per second and the peak RSS of the process.
+
+Usage:
+    python benchmarks/suite.py run [--sizes 1000 100000 1000000] [--repeat 5] [--output results.json]
+    python benchmarks/suite.py compare baseline.json results.json [--threshold 0.1]
+    python benchmarks/suite.py generate ROWS [--products 8] [--days 365] [--sold_fraction 0.8]
+
+`compare` exits with code 1 if a command got slower or used more memory
+than the threshold allows.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from ledger import START_DATE, generate_bought, generate_sold, ledger_directory, product_names
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUPERPY = os.path.join(REPOSITORY, 'superpy.py')
+
+SIZES = [1_000, 100_000, 1_000_000]
+REPEAT = 5
+WARMUP = 1
+THRESHOLD = 0.1
+# Differences below this many milliseconds are noise, not regressions
+MIN_DIFFERENCE_MS = 5
+
+
+def commands(rows, days):
+    """
+    Returns the commands to time on a ledger.
+
+    Commands that change the ledger get a different argument in every
+    run, e.g. the ID to delete.
+
+    Parameters:
+    ----------
+    rows : int
+        The number of rows in the bought file.
+    days : int
+        The number of days the ledger spans.
+
+    Returns:
+    -------
+    dict
+        A function from the run number to the command line, per command.
+    """
+    middle = START_DATE + datetime.timedelta(days=days // 2)
+    week = [middle.isoformat(), (middle + datetime.timedelta(days=6)).isoformat()]
+    future = (START_DATE + datetime.timedelta(days=days + 30)).isoformat()
+    return {
+        'buy': lambda run: ['buy', 'Apples', '0.50', future],
+        'sell': lambda run: ['sell', 'Apples', '0.75'],
+        'list': lambda run: ['list', '--start_date', week[0], '--end_date', week[1]],
+        'revenue': lambda run: ['revenue'],
+        'revenue_scan': lambda run: ['revenue', '--engine', 'python', '--start_date', week[0], '--end_date', week[1]],
+        'plot': lambda run: ['plot'],
+        'plot_cached': lambda run: ['plot', '--output', 'revenue.png'],
+        'report': lambda run: ['report', '--by', 'product', 'month', '--sort', 'profit', '--limit', '10'],
+        'delete_bought': lambda run: ['delete_bought', str(rows - run)],
+        'delete_sold': lambda run: ['delete_sold', str(1 + run)],
+        'advance_time': lambda run: ['advance_time', '1'],
+    }
+
+
+def run_command(command):
+    """
+    Runs a SuperPy command in a new process.
+
+    Returns:
+    -------
+    float, float or None
+        The wall-clock time in milliseconds, and the peak RSS of the
+        process in MB where the platform reports it.
+    """
+    environment = dict(os.environ, MPLBACKEND='Agg')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SUPERPY, *command], env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, 'wait4'):
+        # wait4 reports the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = (time.perf_counter() - start) * 1000
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        rss = usage.ru_maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    else:
+        process.wait()
+        elapsed = (time.perf_counter() - start) * 1000
+        rss = None
+
+    error = process.stderr.read().decode()
+    process.stderr.close()
+    if process.returncode != 0:
+        raise RuntimeError(f"superpy.py {' '.join(command)} failed: {error}")
+    return elapsed, rss
+
+
+def percentile(values, fraction):
+    """Returns a percentile of the values, interpolating between the two nearest."""
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def measure(rows, args):
+    """
+    Times every command on a fresh ledger with the given number of lots.
+
+    Returns:
+    -------
+    dict
+        The results per command.
+    """
+    results = {}
+    with ledger_directory():
+        # Generate in another process: the peak RSS of this process is
+        # inherited by the commands it starts and would hide theirs
+        subprocess.run([
+            sys.executable, __file__, 'generate', str(rows),
+            '--products', str(args.products), '--days', str(args.days), '--sold_fraction', str(args.sold_fraction),
+        ], check=True)
+        with open('current_date.txt', 'w') as file:
+            file.write((START_DATE + datetime.timedelta(days=args.days // 2)).isoformat())
+
+        for name, command in commands(rows, args.days).items():
+            if args.commands and name not in args.commands:
+                continue
+            for run in range(WARMUP):
+                run_command(command(run))
+
+            times, peaks = [], []
+            for run in range(WARMUP, WARMUP + args.repeat):
+                elapsed, rss = run_command(command(run))
+                times.append(elapsed)
+                peaks.append(rss)
+
+            median = percentile(times, 0.5)
+            results[name] = {
+                'runs': len(times),
+                'min_ms': min(times),
+                'p50_ms': median,
+                'p90_ms': percentile(times, 0.9),
+                'p99_ms': percentile(times, 0.99),
+                'max_ms': max(times),
+                'rows_per_s': rows / median * 1000,
+                'peak_rss_mb': max(peaks) if None not in peaks else None,
+            }
+            print(f"{rows:>9} rows {name:<14} p50 {median:8.1f} ms  p90 {results[name]['p90_ms']:8.1f} ms  "
+                  f"{results[name]['peak_rss_mb'] or 0:6.1f} MB", flush=True)
+    return results
+
+
+def git_commit():
+    """Returns the current commit of the repository, if it is a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Runs the suite and writes the results to a JSON file."""
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'products': args.products,
+            'days': args.days,
+            'sold_fraction': args.sold_fraction,
+        },
+        'results': {str(rows): measure(rows, args) for rows in args.sizes},
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Wrote {args.output}')
+
+
+def compare(args):
+    """
+    Compares two result files and reports the commands that got slower or
+    used more memory than the threshold allows.
+
+    Returns:
+    -------
+    int
+        The exit code, 1 if there are regressions.
+    """
+    with open(args.baseline) as file:
+        baseline = json.load(file)['results']
+    with open(args.results) as file:
+        results = json.load(file)['results']
+
+    regressions = []
+    for size, commands_results in results.items():
+        for name, result in commands_results.items():
+            old = baseline.get(size, {}).get(name)
+            if old is None:
+                continue
+            ratio = result['p50_ms'] / old['p50_ms']
+            flags = []
+            if ratio > 1 + args.threshold and result['p50_ms'] - old['p50_ms'] > MIN_DIFFERENCE_MS:
+                flags.append('SLOWER')
+            if old['peak_rss_mb'] and result['peak_rss_mb'] and result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + args.threshold):
+                flags.append('MORE MEMORY')
+            print(f"{size:>9} rows {name:<14} {old['p50_ms']:8.1f} -> {result['p50_ms']:8.1f} ms ({ratio:5.2f}x)  "
+                  f"{old['peak_rss_mb'] or 0:6.1f} -> {result['peak_rss_mb'] or 0:6.1f} MB  {' '.join(flags)}")
+            if flags:
+                regressions.append(f'{name} at {size} rows')
+
+    if regressions:
+        print('Regressions: ' + ', '.join(regressions))
+        return 1
+    print('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SuperPy benchmark suite')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    run_parser = subparsers.add_parser('run', help='time every command and write the results to JSON')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='the numbers of bought lots to test with')
+    run_parser.add_argument('--repeat', type=int, default=REPEAT, help='the number of measured runs per command')
+    run_parser.add_argument('--products', type=int, default=8, help='the number of different products')
+    run_parser.add_argument('--days', type=int, default=365, help='the number of days the ledger spans')
+    run_parser.add_argument('--sold_fraction', type=float, default=0.8, help='the fraction of lots that is sold')
+    run_parser.add_argument('--commands', nargs='+', help='only time these commands')
+    run_parser.add_argument('--output', default='results.json', help='the file to write the results to')
+
+    generate_parser = subparsers.add_parser('generate', help='write a synthetic ledger to the current directory')
+    generate_parser.add_argument('rows', type=int, help='the number of bought lots')
+    generate_parser.add_argument('--products', type=int, default=8, help='the number of different products')
+    generate_parser.add_argument('--days', type=int, default=365, help='the number of days the ledger spans')
+    generate_parser.add_argument('--sold_fraction', type=float, default=0.8, help='the fraction of lots that is sold')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline', help='the results to compare against')
+    compare_parser.add_argument('results', help='the new results')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD, help='the allowed slowdown, 0.1 is 10%%')
+
+    args = parser.parse_args()
+    if args.mode == 'run':
+        run(args)
+    elif args.mode == 'generate':
+        generate_bought('bought.csv', args.rows, products=product_names(args.products), days=args.days)
+        generate_sold('sold.csv', 'bought.csv', fraction=args.sold_fraction, in_date_order=True)
+    else:
+        sys.exit(compare(args))
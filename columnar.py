@@ -0,0 +1,137 @@
+import importlib.util
+
+# NumPy is optional and slow to import, so it is only loaded by load_numpy()
+np = None
+
+
+def is_available():
+    """
+    Checks whether the columnar engine can be used, without importing NumPy.
+
+    Returns:
+    -------
+    bool
+        True if NumPy is installed.
+    """
+    return np is not None or importlib.util.find_spec('numpy') is not None
+
+
+def load_numpy():
+    """
+    Imports NumPy on first use.
+
+    Returns:
+    -------
+    module
+        The numpy module.
+    """
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def use_columnar(args):
+    """
+    Decides whether a command should use the columnar engine.
+
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments, optionally containing 'engine'.
+
+    Returns:
+    -------
+    bool
+        True for engine 'numpy', or for 'auto' when NumPy is installed.
+
+    Raises:
+    ------
+    RuntimeError:
+        If engine 'numpy' is requested but NumPy is not installed.
+    """
+    engine = getattr(args, 'engine', 'auto') or 'auto'
+    if engine == 'numpy' and not is_available():
+        raise RuntimeError("The numpy engine needs NumPy, install it with 'pip install numpy'.")
+    return engine == 'numpy' or (engine == 'auto' and is_available())
+
+
+class SoldColumns:
+    """
+    The sold data stored as NumPy arrays, one array per column.
+
+    The rows are sorted by sell date, so a date range is a contiguous
+    slice that is found with a binary search.
+    """
+
+    def __init__(self, sold_data):
+        load_numpy()
+        count = len(sold_data)
+        dates = np.fromiter((sale.sell_date for sale in sold_data), dtype=np.int32, count=count)
+        order = np.argsort(dates, kind='stable')
+
+        # Dictionary-encode the product names as small integer codes
+        self.products = {}
+        codes = np.fromiter(
+            (self.products.setdefault(sale.product_name, len(self.products)) for sale in sold_data),
+            dtype=np.int32, count=count,
+        )
+
+        self.dates = dates[order]
+        self.quantities = np.fromiter((sale.quantity for sale in sold_data), dtype=np.int64, count=count)[order]
+        # Written off units are not sold, they only count towards the cost
+        self.written_off = np.fromiter((sale.written_off for sale in sold_data), dtype=bool, count=count)[order]
+        # The revenue of each sale, the unit price times the units sold
+        prices = np.fromiter((sale.sell_price for sale in sold_data), dtype=np.int64, count=count)[order]
+        self.cents = np.where(self.written_off, 0, prices * self.quantities)
+        self.product_codes = codes[order]
+
+    def date_range(self, start_date, end_date):
+        """
+        Returns the slice of rows sold between two dates (inclusive).
+
+        Parameters:
+        ----------
+        start_date : int
+            The ordinal of the first date.
+        end_date : int
+            The ordinal of the last date.
+
+        Returns:
+        -------
+        slice
+            The slice of the sorted columns in the range.
+        """
+        start = int(np.searchsorted(self.dates, start_date, side='left'))
+        end = int(np.searchsorted(self.dates, end_date, side='right'))
+        return slice(start, end)
+
+    def revenue_per_day(self, start_date, end_date):
+        """
+        Calculates the revenue of each day between two dates (inclusive).
+
+        Parameters:
+        ----------
+        start_date : int
+            The ordinal of the first date.
+        end_date : int
+            The ordinal of the last date.
+
+        Returns:
+        -------
+        dict
+            A dictionary mapping the ordinal of each day with sales to its
+            revenue in cents.
+        """
+        rows = self.date_range(start_date, end_date)
+        dates = self.dates[rows]
+        if not len(dates):
+            return {}
+
+        # Group by day offset from the first date in the range
+        first_date = int(dates[0])
+        offsets = dates - first_date
+        revenue = np.bincount(offsets, weights=self.cents[rows])
+        days = np.flatnonzero(np.bincount(offsets, weights=~self.written_off[rows]))
+        return {first_date + int(day): int(round(revenue[day])) for day in days}
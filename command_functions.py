@@ -1,289 +1,881 @@
 from utils import get_current_date
 import os
 import data_operations
+import columnar
+import contextlib
 import csv
-import matplotlib.pyplot as plt
 import datetime
-from data_operations import read_sold, read_bought, write_sold
-from prettytable import PrettyTable
+import itertools
+import json
+import metrics
+import output
+import sys
 from utils import set_current_date
-
-
-def buy(args):
+from inventory import Inventory
+from records import BoughtLot, Sale, format_cents, format_date, parse_date, to_cents
+
+# The number of sales aggregated at once by the numpy engine
+COLUMNAR_CHUNK_SIZE = 65536
+
+# The column names of the list command, for people and for other tools
+LIST_TABLE_COLUMNS = [
+    "ID",
+    "Product",
+    "Buy date",
+    "Buy price",
+    "Expiration date",
+    "Days till exp.",
+    "Quantity",
+    "Sold",
+    "Sold date",
+    "Sold price",
+]
+LIST_COLUMNS = [
+    "id",
+    "product_name",
+    "buy_date",
+    "buy_price",
+    "expiration_date",
+    "days_till_expiration",
+    "quantity",
+    "units_sold",
+    "sell_date",
+    "sell_price",
+]
+
+# Rendered plots are cached in this directory next to the data files. The
+# version is part of the cache key, so changing how plots are drawn only
+# needs a new version.
+PLOT_CACHE_DIRECTORY = '.plot_cache'
+PLOT_CACHE_SIZE = 32
+PLOT_CACHE_VERSION = 1
+BUCKET_NAMES = {'daily': 'day', 'weekly': 'week', 'monthly': 'month'}
+
+# The column names of the revenue command
+REVENUE_TABLE_COLUMNS = ["Date", "Revenue"]
+REVENUE_COLUMNS = ["date", "revenue"]
+
+
+def buy(args, current_date=None):
     """
     Buy a product and add it to the inventory.
 
     Parameters
     ----------
     args : argparse.Namespace
-        Command-line arguments containing product_name, price, and expiration_date.
+        Command-line arguments containing product_name, price, expiration_date
+        and quantity.
+    current_date : datetime.date, optional
+        The current date, read from the date provider if not given.
 
     Returns
     -------
     None
     """
+    if args.quantity < 1:
+        print("The quantity must be at least 1.")
+        return
+
     product_name = args.product_name
-    price = args.price
-    expiration_date = args.expiration_date
-    buy_date = get_current_date().strftime('%Y-%m-%d')
-
-    bought_file = 'bought.csv'
-
-    # Check if the bought file exists, create it if it doesn't
-    if not os.path.exists(bought_file):
-        with open(bought_file, 'w', newline='') as file:
-            writer = csv.writer(file, delimiter=';')
-            writer.writerow(['ID', 'PRODUCT_NAME', 'BUY_PRICE', 'EXPIRATION_DATE', 'BUY_DATE'])
-
-    # Read the existing bought data
-    bought_data = data_operations.read_bought(bought_file)
-
-    # Generate a new ID for the product
-    new_id = max([int(row['ID']) for row in bought_data]) + 1 if bought_data else 1
-
-    # Add the new product to the bought data
-    new_product = {
-        'ID': new_id,
-        'PRODUCT_NAME': product_name,
-        'BUY_PRICE': price,
-        'EXPIRATION_DATE': expiration_date,
-        'BUY_DATE': buy_date,
-    }
-    bought_data.append(new_product)
+    price = to_cents(args.price)
+    expiration_date = parse_date(args.expiration_date)
+    buy_date = (current_date or get_current_date()).toordinal()
+
+    backend = data_operations.get_backend(args)
+    with backend.transaction():
+        # Generate a new ID for the product from the last row of the file
+        new_id = backend.next_bought_id()
 
-    # Write the updated bought data to the file
-    with open(bought_file, 'w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['ID', 'PRODUCT_NAME', 'BUY_PRICE', 'EXPIRATION_DATE', 'BUY_DATE'], delimiter=';')
-        writer.writeheader()
-        writer.writerows(bought_data)
+        # Append the new product to the end of the bought data
+        new_product = BoughtLot(new_id, product_name, price, expiration_date, buy_date, args.quantity)
+        backend.append_bought(new_product)
+    backend.close()
 
     print('OK')
 
 
-def sell(args):
+def read_transactions(file_name):
+    """
+    Reads transactions from a CSV or JSON Lines file, or from stdin.
+
+    The format is detected from the first line: a line starting with '{'
+    means JSON Lines, anything else is a CSV header separated by ';' or ','.
+    Field names are matched case-insensitively.
+
+    Parameters
+    ----------
+    file_name : str
+        The name of the file to read, or '-' for stdin.
+
+    Yields
+    ------
+    tuple of (int, dict or None)
+        The line number and the fields of each transaction, or None if
+        the line could not be parsed.
+    """
+    file = sys.stdin if file_name == '-' else open(file_name, newline='')
+    try:
+        first_line = file.readline()
+        lines = itertools.chain([first_line], file)
+
+        if first_line.lstrip().startswith('{'):
+            for line_number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if not isinstance(row, dict):
+                    yield line_number, None
+                    continue
+                yield line_number, {str(key).lower(): value for key, value in row.items()}
+        else:
+            delimiter = ';' if ';' in first_line else ','
+            reader = csv.DictReader(lines, delimiter=delimiter)
+            for row in reader:
+                yield reader.line_num, {key.lower(): value for key, value in row.items() if key and value is not None}
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def describe_error(error):
+    """
+    Turns an error raised while parsing a transaction into a short message.
+
+    Parameters
+    ----------
+    error : Exception
+        The error.
+
+    Returns
+    -------
+    str
+        The message for the result report.
+    """
+    if isinstance(error, KeyError):
+        return f"missing field {error}"
+    return str(error) or type(error).__name__
+
+
+def parse_quantity(row):
     """
-    Sell a product from the inventory and store the sale information.
+    Reads the optional quantity of a transaction.
+
+    Parameters
+    ----------
+    row : dict
+        The fields of the transaction.
+
+    Returns
+    -------
+    int
+        The number of units, 1 if the field is missing or empty.
+
+    Raises
+    ------
+    ValueError
+        If the quantity is not a whole number of at least 1.
+    """
+    value = row.get('quantity')
+    if value is None or value == '':
+        return 1
+    quantity = int(value)
+    if quantity < 1:
+        raise ValueError("quantity must be at least 1")
+    return quantity
+
+
+def buy_batch(args, current_date=None):
+    """
+    Buy many products from a file or stdin in a single pass.
+
+    All purchases are appended to the bought data with one write, and a
+    result is printed for every line of the input.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Command-line arguments containing the input file.
+    current_date : datetime.date, optional
+        The current date, read from the date provider if not given.
+
+    Returns
+    -------
+    None
+    """
+    buy_date = (current_date or get_current_date()).toordinal()
+    results = []
+    lots = []
+
+    backend = data_operations.get_backend(args)
+    with backend.transaction():
+        new_id = backend.next_bought_id()
+        for line_number, row in read_transactions(args.file):
+            if row is None:
+                results.append(f"line {line_number}: ERROR cannot parse line")
+                continue
+            try:
+                if not row['product_name']:
+                    raise ValueError("empty product_name")
+                lot = BoughtLot(new_id, row['product_name'], to_cents(row['price']), parse_date(row['expiration_date']),
+                                buy_date, parse_quantity(row))
+            except (KeyError, TypeError, ValueError) as error:
+                results.append(f"line {line_number}: ERROR {describe_error(error)}")
+                continue
+
+            lots.append(lot)
+            new_id += 1
+            results.append(f"line {line_number}: OK id {lot.id}")
+
+        # Write all purchases at once
+        backend.extend_bought(lots)
+    backend.close()
+
+    sys.stdout.write('\n'.join(results) + '\n' if results else '')
+    print(f"Bought {len(lots)} of {len(results)} products")
+
+
+def sell_batch(args, current_date=None):
+    """
+    Sell many products from a file or stdin in a single pass.
+
+    The inventory is indexed once, every sale takes its units from the
+    lots that expire first, and all sales are appended with one write. A
+    result is printed for every line of the input.
 
     Parameters
     ----------
     args : argparse.Namespace
-        Command-line arguments containing product_name and sell_price.
+        Command-line arguments containing the input file.
+    current_date : datetime.date, optional
+        The current date, read from the date provider if not given.
 
     Returns
     -------
     None
     """
+    sold_date = (current_date or get_current_date()).toordinal()
+    results = []
+    sales = []
+    lots = []
+    sold_count = 0
+
+    backend = data_operations.get_backend(args)
+    with backend.transaction():
+        inventory = Inventory.from_data(backend.read_bought(), backend.read_sold())
+        new_id = backend.next_sold_id()
+        for line_number, row in read_transactions(args.file):
+            if row is None:
+                results.append(f"line {line_number}: ERROR cannot parse line")
+                continue
+            try:
+                product_name = row['product_name']
+                price = to_cents(row['price'])
+                quantity = parse_quantity(row)
+            except (KeyError, TypeError, ValueError) as error:
+                results.append(f"line {line_number}: ERROR {describe_error(error)}")
+                continue
+
+            portions = inventory.allocate(product_name, sold_date, quantity)
+            if not portions:
+                results.append(f"line {line_number}: ERROR {product_name} is either not available or expired")
+                continue
+
+            # One sale per lot the units are taken from
+            first_id = new_id
+            for lot, units in portions:
+                sales.append(Sale(new_id, lot.id, product_name, price, sold_date, units))
+                lots.append(lot)
+                new_id += 1
+            ids = str(first_id) if new_id - first_id == 1 else f"{first_id}-{new_id - 1}"
+            results.append(f"line {line_number}: OK id {ids}")
+            sold_count += 1
+
+        # Write all sales at once
+        backend.extend_sold(sales, lots)
+    backend.close()
+
+    sys.stdout.write('\n'.join(results) + '\n' if results else '')
+    print(f"Sold {sold_count} of {len(results)} products")
+
+
+def sell(args, current_date=None):
+    """
+    Sell units of a product from the inventory and store the sale information.
+
+    The units are taken from the unexpired lots that expire first. When a
+    lot runs out the rest comes from the next one, and a sale is stored
+    for every lot. Nothing is sold if there are not enough units in stock.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Command-line arguments containing product_name, price and quantity.
+    current_date : datetime.date, optional
+        The current date, read from the date provider if not given.
+
+    Returns
+    -------
+    None
+    """
+    if args.quantity < 1:
+        print("The quantity must be at least 1.")
+        return
+
     product_name = args.product_name
-    price = args.price
-    sold_date = get_current_date().strftime('%Y-%m-%d')
-
-    # Initialize the sold_data file if it does not exist
-    sold_data_file = 'sold.csv'
-    if not os.path.exists(sold_data_file):
-        with open(sold_data_file, 'w') as f:
-            f.write('ID;BOUGHT_ID;PRODUCT_NAME;SELL_PRICE;SELL_DATE\n')
-
-    # Read the data of bought products
-    bought_data = data_operations.read_bought(args.bought_file)
-
-    # Initialize sold_data
-    sold_data = read_sold()
-
-    for row in bought_data:
-        if row['PRODUCT_NAME'] == product_name:
-            print("Checking product:", row)
-            print("Current date:", get_current_date())
-            print("Expiration date:", datetime.datetime.strptime(row['EXPIRATION_DATE'], '%Y-%m-%d').date())
-
-    # Find the bought product with the given name
-    found = False
-    for bought_row in bought_data:
-        if (bought_row['PRODUCT_NAME'] == product_name and datetime.datetime.strptime(bought_row['EXPIRATION_DATE'], '%Y-%m-%d').date() > get_current_date()):
-
-            # Generate a unique SOLD_ID for the new sale
-            max_id = max([int(sold_row['ID']) for sold_row in sold_data]) if sold_data else 0
-            new_id = max_id + 1
-
-            # If a matching product is found, add a row to the sold data
-            # with the relevant information
-            sold_row = {
-                'ID': new_id,
-                'BOUGHT_ID': bought_row['ID'],
-                'PRODUCT_NAME': product_name,
-                'SELL_PRICE': price,
-                'SELL_DATE': sold_date,
-            }
-            # Add the new row to the existing data
-            sold_data.append(sold_row)
-            # Write the updated data back to the file
-            write_sold(sold_data)
-            # Print confirmation message
-            print('OK')
-            found = True
-            break
-
-    if not found:
+    price = to_cents(args.price)
+    sold_date = (current_date or get_current_date()).toordinal()
+    backend = data_operations.get_backend(args)
+    with backend.transaction():
+        # Find the lots of the product that expire first with units left
+        portions = backend.allocate(product_name, sold_date, args.quantity)
+
+        if portions:
+            # Generate consecutive SOLD_IDs for the new sales
+            new_id = backend.next_sold_id()
+
+            # Add a row to the sold data for every lot the units come from
+            sales = [
+                Sale(new_id + number, lot.id, product_name, price, sold_date, units)
+                for number, (lot, units) in enumerate(portions)
+            ]
+            backend.extend_sold(sales, [lot for lot, _ in portions])
+    backend.close()
+
+    if not portions:
         # If no matching product is found, print error message
         print("Cannot sell the product. It is either not available or expired.")
+        return
+
+    # Print confirmation message
+    print('OK')
 
 
-def list_products(args):
+def list_products(args, current_date=None):
     """
     Lists all products and their attributes in the given period.
 
+    The rows are streamed from the bought data, so with a csv, tsv or
+    jsonl format a listing of any size is written without holding it in
+    memory. --offset and --limit select a page of the rows.
+
     Parameters
     ----------
     args : argparse.Namespace
         The command line arguments.
+    current_date : datetime.date, optional
+        The current date, read from the date provider if not given.
     """
     # Set default values for start_date and end_date if they are not provided
-    if args.start_date is None:
-        args.start_date = datetime.date.min
-    if args.end_date is None:
-        args.end_date = datetime.date.max
+    start_date = args.start_date.toordinal() if args.start_date else datetime.date.min.toordinal()
+    end_date = args.end_date.toordinal() if args.end_date else datetime.date.max.toordinal()
+    today = (current_date or get_current_date()).toordinal()
+    output_format = getattr(args, 'format', None) or 'table'
 
-    # Read the bought and sold data using the original read_bought() and read_sold() functions
-    bought_data = read_bought("bought.csv")
-    sold_data = read_sold()
+    # Index the sales by lot. A lot is never sold before it is bought, so
+    # only sales from the start date onwards can belong to the listed lots
+    backend = data_operations.get_backend(args)
+    sales_by_lot = data_operations.index_sales_by_lot(backend.iter_sold(start_date))
 
-    # Prepare the output table
-    table = PrettyTable()
-    table.field_names = [
-        "ID",
-        "Product",
-        "Buy date",
-        "Buy price",
-        "Expiration date",
-        "Days till exp.",
-        "Sold",
-        "Sold date",
-        "Sold price",
-    ]
-
-    # Iterate through bought_data and sold_data and add rows to the table
-    for row in bought_data:
-        # Check if the product is in the given date range
-        buy_date = datetime.datetime.strptime(row["BUY_DATE"], "%Y-%m-%d").date()
-        if args.start_date <= buy_date <= args.end_date:
-            sold = "No"
-            sold_date = ""
-            sold_price = ""
-            for sold_row in sold_data:
-                if sold_row["ID"] == row["ID"]:
-                    sold = "Yes"
-                    sold_date = sold_row["SELL_DATE"]
-                    sold_price = sold_row["SELL_PRICE"]
-                    break
-
-            days_till_exp = (datetime.datetime.strptime(row["EXPIRATION_DATE"], "%Y-%m-%d") - datetime.datetime.now()).days
-
-            table.add_row([
-                row["ID"],
-                row["PRODUCT_NAME"],
-                row["BUY_DATE"],
-                row["BUY_PRICE"],
-                row["EXPIRATION_DATE"],
-                days_till_exp,
-                sold,
-                sold_date,
-                sold_price,
-            ])
-
-    print(table)
+    # Skip to the page before any row is formatted
+    lots = output.page(backend.iter_bought(start_date, end_date), getattr(args, 'limit', None), getattr(args, 'offset', 0))
+    columns = LIST_TABLE_COLUMNS if output_format == 'table' else LIST_COLUMNS
+    output.write_rows(columns, product_rows(lots, sales_by_lot, today, output_format == 'table'), output_format)
+    backend.close()
 
 
-def get_revenue(args):
+def product_rows(lots, sales_by_lot, today, for_table=True):
     """
-    Retrieves the revenue data for a specified date range.
+    Joins each lot to its sales and formats it as a row of the listing.
+
+    Parameters
+    ----------
+    lots : iterable of BoughtLot
+        The lots to list.
+    sales_by_lot : dict
+        The units sold and the last sale of each lot ID.
+    today : int
+        The ordinal of the current date.
+    for_table : bool
+        Show whether the lot is sold as Yes, No or "k of n" instead of the
+        number of units sold.
+
+    Yields
+    ------
+    list
+        The values of each row.
+    """
+    for lot in lots:
+        units, sale = sales_by_lot.get(lot.id, (0, None))
+        if for_table:
+            # Partly sold lots show how many units are gone, with the last sale
+            sold = "No" if sale is None else "Yes" if units >= lot.quantity else f"{units} of {lot.quantity}"
+        else:
+            sold = units
+        yield [
+            lot.id,
+            lot.product_name,
+            format_date(lot.buy_date),
+            format_cents(lot.buy_price),
+            format_date(lot.expiration_date),
+            lot.expiration_date - today,
+            lot.quantity,
+            sold,
+            format_date(sale.sell_date) if sale is not None else None,
+            format_cents(sale.sell_price) if sale is not None else None,
+        ]
+
+
+def log(args, *values):
+    """
+    Prints debug output when the --verbose flag is given.
 
     Parameters:
     ----------
     args : argparse.Namespace
-        The parsed command line arguments containing 'start_date' and 'end_date'.
+        The parsed command line arguments, optionally containing 'verbose'.
+    *values
+        The values to print.
+
+    Returns:
+    -------
+    None
+    """
+    if getattr(args, 'verbose', False):
+        print(*values, file=sys.stderr)
+
+
+def revenue_per_day(args):
+    """
+    Sums the revenue of every day in a date range.
+
+    By default the totals are read from the daily rollups. With an
+    explicit engine the sales are streamed and summed instead; only the
+    running totals are kept, so memory use grows with the number of days
+    in the range rather than the number of sales in the file. With more
+    than one worker the CSV sold file is split and summed by that many
+    processes.
+
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments containing 'start_date', 'end_date'
+        and optionally 'engine' and 'workers'.
+
+    Returns:
+    -------
+    dict
+        The revenue in cents per date ordinal, in date order.
     """
-    print("Getting revenue data...")
     # Set start_date and end_date based on the input arguments or default values
-    start_date = args.start_date if args.start_date else "1900-01-01"
-    end_date = args.end_date if args.end_date else "9999-12-31"
-
-    # Read the sold data
-    sold_data = read_sold()
-    print("All sold data:", sold_data)
-
-    # Filter the sold data by the given date range
-    filtered_sold_data = [
-        row for row in sold_data if start_date <= row["SELL_DATE"] <= end_date
-    ]
-
-    print("Filtered sold data:", filtered_sold_data)
-
-    # Calculate daily revenue
-    revenue_data = {}
-    for row in filtered_sold_data:
-        date = row["SELL_DATE"]
-        sold_price = float(row["SELL_PRICE"])
-        if date in revenue_data:
-            revenue_data[date] += sold_price
-        else:
-            revenue_data[date] = sold_price
+    start_date = parse_date(args.start_date if args.start_date else "1900-01-01")
+    end_date = parse_date(args.end_date if args.end_date else "9999-12-31")
+    log(args, "Getting revenue data from", format_date(start_date), "to", format_date(end_date))
+
+    revenue_cents = {}
+    backend = data_operations.get_backend(args)
+    workers = getattr(args, 'workers', 1) or 1
+    if workers > 1 and backend.name == 'csv':
+        # Sum the sales in parallel processes, each reading a part of the file
+        log(args, "Summing the sales with", workers, "workers")
+        for rollup in backend.parallel_rollups(workers, start_date, end_date, with_cost=False).rows():
+            if rollup.units:
+                revenue_cents[rollup.day] = revenue_cents.get(rollup.day, 0) + rollup.revenue
+    elif (getattr(args, 'engine', 'auto') or 'auto') == 'auto':
+        # Add up the totals of all products per day, days with only
+        # write-offs have no sales
+        for rollup in backend.read_rollups(start_date, end_date):
+            if rollup.units:
+                revenue_cents[rollup.day] = revenue_cents.get(rollup.day, 0) + rollup.revenue
+    elif columnar.use_columnar(args):
+        sales = backend.iter_sold(start_date, end_date)
+        # Group the sales with vectorized operations, one chunk at a time
+        while True:
+            chunk = list(itertools.islice(sales, COLUMNAR_CHUNK_SIZE))
+            if not chunk:
+                break
+            log(args, "Aggregating", len(chunk), "sales")
+            for date, cents in columnar.SoldColumns(chunk).revenue_per_day(start_date, end_date).items():
+                revenue_cents[date] = revenue_cents.get(date, 0) + cents
+    else:
+        # Calculate daily revenue in cents
+        for sale in backend.iter_sold(start_date, end_date):
+            if not sale.written_off:
+                revenue_cents[sale.sell_date] = revenue_cents.get(sale.sell_date, 0) + sale.sell_price * sale.quantity
+    backend.close()
+
+    return dict(sorted(revenue_cents.items()))
+
+
+def get_revenue(args):
+    """
+    Retrieves the revenue data for a specified date range.
 
-    print("Revenue data:", revenue_data)
+    Without a format the revenue is printed as a dictionary, with one it
+    is written as one row per day.
+
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments containing 'start_date', 'end_date'
+        and optionally 'engine', 'verbose', 'format', 'limit' and 'offset'.
+
+    Returns:
+    -------
+    dict
+        The revenue per date, as 'YYYY-MM-DD' strings and floats.
+    """
+    # There is one total per day, so the page is small even for a long period
+    revenue_cents = dict(output.page(revenue_per_day(args).items(), getattr(args, 'limit', None), getattr(args, 'offset', 0)))
+    revenue_data = {format_date(date): cents / 100 for date, cents in revenue_cents.items()}
+
+    output_format = getattr(args, 'format', None)
+    if output_format is None:
+        print("Revenue data:", revenue_data)
+    else:
+        columns = REVENUE_TABLE_COLUMNS if output_format == 'table' else REVENUE_COLUMNS
+        rows = ([format_date(date), format_cents(cents)] for date, cents in revenue_cents.items())
+        output.write_rows(columns, rows, output_format)
     return revenue_data
 
 
+def bucket_revenue(revenue_cents, bucket='daily'):
+    """
+    Adds up the daily revenue per week or month.
+
+    Parameters:
+    ----------
+    revenue_cents : dict
+        The revenue in cents per date ordinal, in date order.
+    bucket : str
+        'daily', 'weekly' or 'monthly'. Weeks start on Monday.
+
+    Returns:
+    -------
+    dict
+        The revenue in cents per first day of each bucket, in date order.
+    """
+    if bucket == 'daily':
+        return revenue_cents
+    import report
+
+    period = BUCKET_NAMES[bucket]
+    totals = {}
+    for day, cents in revenue_cents.items():
+        start = report.period_start(day, period)
+        totals[start] = totals.get(start, 0) + cents
+    return totals
+
+
+def plot_cache_file(args, extension):
+    """
+    Returns the name of the cached image for a plot.
+
+    The name is a hash of everything the image depends on: the date range,
+    the bucket, the image format and the signatures (inode, modification
+    time and size) of the data files. Any change to the data gives a new
+    name, so a cached image is never out of date.
+
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments.
+    extension : str
+        The image format, e.g. 'png'.
+
+    Returns:
+    -------
+    str
+        The name of the file in the plot cache.
+    """
+    import hashlib
+
+    files = data_operations.data_files(args)
+    key = json.dumps([
+        PLOT_CACHE_VERSION,
+        getattr(args, 'backend', 'csv'),
+        [data_operations.file_signature(file_name) for file_name in files],
+        args.start_date,
+        args.end_date,
+        getattr(args, 'bucket', 'daily'),
+        extension,
+    ])
+    directory = os.path.join(os.path.dirname(os.path.abspath(files[0])), PLOT_CACHE_DIRECTORY)
+    return os.path.join(directory, hashlib.sha256(key.encode()).hexdigest()[:32] + '.' + extension)
+
+
+def prune_plot_cache(directory):
+    """Removes the least recently used images beyond PLOT_CACHE_SIZE."""
+    images = sorted(
+        (entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.')),
+        key=lambda entry: entry.stat().st_mtime_ns,
+        reverse=True,
+    )
+    for entry in images[PLOT_CACHE_SIZE:]:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(entry.path)
+
+
+def draw_revenue(figure, revenue_cents, bucket):
+    """Draws the revenue per bucket on a figure."""
+    # Convert the dates to a format that can be plotted
+    dates = [datetime.date.fromordinal(date) for date in revenue_cents]
+
+    ax = figure.subplots()
+    ax.plot(dates, [cents / 100 for cents in revenue_cents.values()])
+
+    # Set the labels and title
+    ax.set_xlabel('Date')
+    ax.set_ylabel(f"Revenue per {BUCKET_NAMES[bucket]}")
+    ax.set_title('Revenue over time')
+    figure.autofmt_xdate()
+
+
 def plot_revenue(args):
     """
     Plots the revenue over time for a given date range.
 
+    Without an output file the plot is shown in a window. With one it is
+    drawn without a display and saved, and a copy of the image is kept in
+    a cache next to the data, so the same plot of unchanged data is not
+    drawn again.
+
     Parameters:
     -----------
     args : argparse.Namespace
-        The parsed command line arguments containing 'start_date' and 'end_date'.
+        The parsed command line arguments containing 'start_date' and 'end_date',
+        and optionally 'output' and 'bucket'.
 
     Returns:
     --------
     None
     """
+    import shutil
+
+    output_file = getattr(args, 'output', None)
+    bucket = getattr(args, 'bucket', None) or 'daily'
+    if output_file is None:
+        # matplotlib is slow to import, so only load it when plotting
+        with metrics.stage('import'):
+            import matplotlib.pyplot as plt
+
+        revenue_cents = bucket_revenue(revenue_per_day(args), bucket)
+        with metrics.stage('render'):
+            figure = plt.figure()
+            draw_revenue(figure, revenue_cents, bucket)
+            plt.show()
+        return
+
+    extension = os.path.splitext(output_file)[1].lstrip('.').lower()
+    cache_file = plot_cache_file(args, extension)
+    if os.path.exists(cache_file):
+        # Mark the image as recently used, then hand out a copy
+        os.utime(cache_file)
+        shutil.copyfile(cache_file, output_file)
+        print(f"Wrote {output_file} (cached)")
+        return
+
+    # A bare Figure draws without pyplot and its window backends
+    with metrics.stage('import'):
+        from matplotlib.figure import Figure
+
+    figure = Figure()
+    if extension not in figure.canvas.get_supported_filetypes():
+        print(f"Cannot save a plot as '{extension}'. Use png, svg or pdf.")
+        return
+
+    revenue_cents = bucket_revenue(revenue_per_day(args), bucket)
+    with metrics.stage('render'):
+        draw_revenue(figure, revenue_cents, bucket)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with data_operations.atomic_write(cache_file, binary=True) as file:
+            figure.savefig(file, format=extension)
+    shutil.copyfile(cache_file, output_file)
+    prune_plot_cache(os.path.dirname(cache_file))
+    print(f"Wrote {output_file}")
+
+
+def show_report(args):
+    """
+    Prints the revenue, cost, profit, units sold, spoilage and margin per
+    product, per day, week or month, or per product and period.
 
-    sold_data_file = 'sold.csv'
-    if not os.path.exists(sold_data_file):
-        with open(sold_data_file, 'w') as f:
-            f.write('id,bought_id,product_name,sell_price,sold_date\n')
-
-    # Get the revenue data for the specified time period
-    revenue_data = get_revenue(args)
+    All totals are summed in one pass over the sales, see report.aggregate.
 
-    # Convert the dates to a format that can be plotted
-    dates = [datetime.datetime.strptime(date, '%Y-%m-%d').date() for date in
-             revenue_data.keys()]
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments containing 'by', 'sort',
+        'start_date', 'end_date', and optionally 'format', 'limit' and
+        'offset'.
 
-    # Create the plot
-    fig, ax = plt.subplots()
-    ax.plot(dates, revenue_data.values())
+    Returns:
+    -------
+    None
+    """
+    import report
+
+    # Keep the order of the fields, without repeats
+    group_by = list(dict.fromkeys(args.by))
+    if sum(field in report.PERIODS for field in group_by) > 1:
+        print("Group by at most one of day, week and month.")
+        return
+
+    start_date = parse_date(args.start_date) if args.start_date else None
+    end_date = parse_date(args.end_date) if args.end_date else None
+    backend = data_operations.get_backend(args)
+    with metrics.stage('aggregate'):
+        totals = report.aggregate(backend.iter_bought(), backend.iter_sold(start_date, end_date), group_by)
+    backend.close()
+
+    # Only the groups up to the end of the page have to be ranked
+    limit, offset = getattr(args, 'limit', None), getattr(args, 'offset', 0) or 0
+    items = report.ranked(totals, args.sort, None if limit is None else offset + limit)
+    output_format = getattr(args, 'format', None) or 'table'
+    rows = report.report_rows(output.page(items, None, offset), group_by, output_format == 'table')
+    output.write_rows(group_by + report.METRICS, rows, output_format)
+
+
+def rebuild_rollups(args):
+    """
+    Rebuilds the daily rollups from the bought and sold data, e.g. after
+    the files were edited by hand.
 
-    # Set the labels and title
-    ax.set_xlabel('Date')
-    ax.set_ylabel('Revenue')
-    ax.set_title('Revenue over time')
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments.
 
-    # Show the plot
-    plt.show()
+    Returns:
+    -------
+    None
+    """
+    backend = data_operations.get_backend(args)
+    with backend.transaction():
+        count = backend.rebuild_rollups(getattr(args, 'workers', 1) or 1)
+    backend.close()
+    print(f"Rebuilt {count} daily totals in {backend}")
 
 
-def advance_time(args):
+def advance_time(args, current_date=None):
     """
-    Advances the current date by the given number of days.
+    Advances the current date by the given number of days and reports the
+    products that expired in the skipped days.
 
     Parameters:
     ----------
     args : argparse.Namespace
-        The parsed command line arguments containing 'days'.
+        The parsed command line arguments containing 'days' and optionally
+        'write_off'.
+    current_date : datetime.date, optional
+        The current date, read from the date provider if not given.
 
     Returns:
     -------
     None
     """
     days = int(args.days)
-    current_date = get_current_date()  # Get the current date from file
+    current_date = current_date or get_current_date()  # Get the current date from the date provider
     new_date = current_date + datetime.timedelta(days=days)  # Calculate the new date by adding the specified number of days to the current date
     set_current_date(new_date)  # Write the new date to the file as the current date
+
+    if days <= 0:
+        return
+
+    backend = data_operations.get_backend(args)
+    with backend.transaction():
+        # Find the unsold lots that expired after the old date, up to and including the new date
+        expired = backend.expiring_lots(current_date.toordinal(), new_date.toordinal())
+
+        if expired and getattr(args, 'write_off', False):
+            # Record the units left of every expired lot as written off on the new date
+            new_id = backend.next_sold_id()
+            sales = [
+                Sale(new_id + i, lot.id, lot.product_name, 0, new_date.toordinal(), remaining, written_off=True)
+                for i, (lot, remaining) in enumerate(expired)
+            ]
+            backend.extend_sold(sales, [lot for lot, _ in expired])
+    backend.close()
+
+    if not expired:
+        print(f"No products expired up to {new_date}")
+        return
+
+    action = "Wrote off" if getattr(args, 'write_off', False) else "Expired"
+    for lot, remaining in expired:
+        units = f"{remaining} x " if lot.quantity > 1 else ""
+        print(f"{action}: {units}{lot.product_name} (id {lot.id}, bought for {format_cents(lot.buy_price)}, expired {format_date(lot.expiration_date)})")
+    print(f"{len(expired)} products expired up to {new_date}")
+
+
+def expiring(args, current_date=None):
+    """
+    Lists the unsold products that expire within the given number of days.
+
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments containing 'within'.
+    current_date : datetime.date, optional
+        The current date, read from the date provider if not given.
+
+    Returns:
+    -------
+    None
+    """
+    from prettytable import PrettyTable
+
+    today = (current_date or get_current_date()).toordinal()
+
+    # Lots that expire today have already expired, so start after today
+    backend = data_operations.get_backend(args)
+    lots = backend.expiring_lots(today, today + int(args.within))
+    backend.close()
+
+    table = PrettyTable()
+    table.field_names = ["ID", "Product", "Quantity", "Buy price", "Expiration date", "Days till exp."]
+    for lot, remaining in lots:
+        table.add_row([lot.id, lot.product_name, remaining, format_cents(lot.buy_price), format_date(lot.expiration_date),
+                       lot.expiration_date - today])
+    with metrics.stage('render'):
+        print(table)
+
+
+def migrate(args):
+    """
+    Copies all bought and sold data between the CSV files, the SQLite
+    database and the packed binary files.
+
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments containing 'to', optionally
+        'source', and 'database', 'bought_file' and 'sold_file'.
+
+    Returns:
+    -------
+    None
+    """
+    backends = {
+        'csv': lambda: data_operations.CsvBackend(args.bought_file, args.sold_file),
+        'sqlite': lambda: data_operations.SqliteBackend(args.database),
+        'packed': lambda: data_operations.PackedBackend(*data_operations.packed_files(args)),
+    }
+    # Copy from the CSV files by default, and to CSV from the database
+    source_name = getattr(args, 'source', None) or ('sqlite' if args.to == 'csv' else 'csv')
+    if source_name == args.to:
+        print(f"Cannot migrate from {source_name} to itself. Choose another --from or --to.")
+        return
+    source, target = backends[source_name](), backends[args.to]()
+
+    bought_data = source.read_bought()
+    sold_data = source.read_sold()
+    with target.transaction():
+        target.write_bought(bought_data)
+        target.write_sold(sold_data)
+
+    source.close()
+    target.close()
+    print(f"Copied {len(bought_data)} bought and {len(sold_data)} sold rows to {target}")
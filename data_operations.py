@@ -1,103 +1,2482 @@
+import array
+import bisect
+import contextlib
 import csv
+import io
+import json
+import operator
 import os
+import sys
+
+try:
+    import fcntl
+except ImportError:  # fcntl is not available on Windows, locking is skipped there
+    fcntl = None
+
+from date_index import DateIndex
+from inventory import ExpiryQueue, Inventory
+import metrics
+from records import OPTIONAL_FIELDS, BoughtLot, Sale, field_getter, format_date
+from rollups import WATERMARK, Rollup, Rollups
+
+
+BOUGHT_FIELDS = BoughtLot.FIELDS
+SOLD_FIELDS = Sale.FIELDS
+
+# The number of extra rows a rollup file may hold before it is compacted
+ROLLUP_COMPACT_ROWS = 1000
+
+# The mark of a file that was never read, see read_appended
+EMPTY_MARK = [0, 0, '', 0]
+
+# The number of deleted rows a ledger may hold before it is compacted
+TOMBSTONE_COMPACT_ROWS = 1000
+
+# The format of the snapshot written by `compact`, the number of days of
+# expiration dates the lots in one block of the snapshot span, and the
+# number of rows added after a snapshot before a new one is written
+# automatically
+SNAPSHOT_VERSION = 3
+SNAPSHOT_BLOCK_DAYS = 30
+SNAPSHOT_TAIL_ROWS = 10000
+
+# The format of the index of the sales of every lot, see find_sales_of_lots
+LOT_INDEX_VERSION = 1
+
+# Parsed ledgers kept in memory between commands, only used by `serve`
+_cache = None
+
+
+def enable_cache():
+    """
+    Keeps parsed ledgers, inventories and database connections in memory.
+
+    Cached data is checked against the modification time and size of its
+    file before every use, so changes made by other processes are picked
+    up. Writes made by this process update the cache in place.
+
+    Returns:
+    -------
+    None
+    """
+    global _cache
+    if _cache is None:
+        _cache = {}
+
+
+def file_signature(file_name):
+    """
+    Returns a value that changes whenever the given file changes.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file.
+
+    Returns:
+    -------
+    tuple or None
+        The inode, modification time and size of the file, or None if the
+        file does not exist.
+    """
+    try:
+        stat = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def ledger_signature(file_name):
+    """
+    Returns a value that changes whenever a ledger or its deleted rows change.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+
+    Returns:
+    -------
+    tuple or None
+        The signatures of the ledger and its tombstone file, or None if
+        the ledger does not exist.
+    """
+    signature = file_signature(file_name)
+    if signature is None:
+        return None
+    return signature + (file_signature(tombstone_file(file_name)) or (0, 0, 0))
+
+
+def tombstone_file(file_name):
+    """Returns the name of the file with the deleted IDs of a ledger."""
+    return file_name + '.deleted'
+
+
+def read_tombstones(file_name):
+    """
+    Reads the IDs of the rows of a ledger that were deleted but are still
+    in the file, waiting for the next compaction.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+
+    Returns:
+    -------
+    set of int
+        The deleted IDs.
+    """
+    try:
+        with open(tombstone_file(file_name), newline='') as file:
+            reader = csv.reader(file, delimiter=';')
+            next(reader, None)
+            return {int(row[0]) for row in reader if row}
+    except FileNotFoundError:
+        return set()
+
+
+def append_tombstones(ids, file_name):
+    """
+    Marks rows of a ledger as deleted by appending their IDs to its
+    tombstone file, without rewriting the ledger.
+
+    Parameters:
+    ----------
+    ids : iterable of int
+        The IDs to delete.
+    file_name : str
+        The name of the ledger file.
+
+    Returns:
+    -------
+    None
+    """
+    deleted_file = tombstone_file(file_name)
+    new_file = not os.path.exists(deleted_file)
+    with open(deleted_file, 'a', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        if new_file:
+            writer.writerow(['ID'])
+        writer.writerows([record_id] for record_id in sorted(ids))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def read_sequence(file_name):
+    """
+    Reads the sequence file of a ledger: the highest ID ever handed out,
+    which survives deleting the last rows of the ledger, whether the rows
+    are in ID order, and the signature of the ledger both were stored for.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+
+    Returns:
+    -------
+    tuple of (int, bool, list or None)
+        The highest ID, whether the rows are in ID order and the file
+        signature, or (0, False, None) if they were never stored.
+    """
+    try:
+        with open(file_name + '.seq') as file:
+            fields = file.read().split()
+        if len(fields) == 5:
+            return int(fields[0]), fields[1] == '1', [int(field) for field in fields[2:]]
+        # Older sequence files only hold the highest ID
+        return int(fields[0]) if fields else 0, False, None
+    except (FileNotFoundError, ValueError):
+        return 0, False, None
+
+
+def write_sequence(file_name, last_id, in_order):
+    """
+    Stores the highest ID ever handed out for a ledger and whether its rows
+    are in ID order, with the current signature of the ledger.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+    last_id : int
+        The highest ID.
+    in_order : bool
+        Whether the IDs of the rows ascend from the first row to the last.
+
+    Returns:
+    -------
+    None
+    """
+    signature = file_signature(file_name) or (0, 0, 0)
+    with atomic_write(file_name + '.seq') as file:
+        file.write(f'{last_id} {int(in_order)} {" ".join(map(str, signature))}\n')
+
+
+def ledger_ids(file_name):
+    """
+    Returns the highest ID of a ledger and whether its rows are in ID order.
+
+    Both are kept in the sequence file on every write. If the ledger was
+    changed by another program since, e.g. edited by hand, its ID column
+    is scanned once and the sequence file is updated.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+
+    Returns:
+    -------
+    tuple of (int, bool)
+        The highest ID ever handed out, 0 for an empty ledger, and whether
+        the IDs of the rows ascend.
+    """
+    last_id, in_order, signature = read_sequence(file_name)
+    current = file_signature(file_name)
+    if current is None:
+        return last_id, True
+    if signature == list(current):
+        return last_id, in_order
+
+    highest, in_order = 0, True
+    with open(file_name, newline='') as file:
+        reader = csv.reader(file, delimiter=';')
+        header = next(reader, None)
+        if header is not None and 'ID' in header:
+            id_index = header.index('ID')
+            for row in reader:
+                if len(row) > id_index and row[id_index].strip().isdigit():
+                    row_id = int(row[id_index])
+                    in_order = in_order and row_id > highest
+                    highest = max(highest, row_id)
+    last_id = max(last_id, highest)
+    with contextlib.suppress(OSError):
+        write_sequence(file_name, last_id, in_order)
+    return last_id, in_order
+
+
+def find_rows(file_name, record_class, ids):
+    """
+    Finds rows of a ledger by ID without reading the whole file.
+
+    When the sequence file says the rows of the ledger are in ID order,
+    which holds for a ledger SuperPy only appended to, the byte offset of
+    a row is found with a binary search over the file. Each lookup reads a
+    few small blocks, O(log n) in the size of the file. A ledger that is
+    out of order, e.g. written by hand or sorted by date, is read once
+    from start to end instead.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+    record_class : type
+        The record class of the rows, BoughtLot or Sale.
+    ids : iterable of int
+        The IDs to look up.
+
+    Returns:
+    -------
+    dict
+        The found records by ID, in ID order. Deleted rows are not found.
+    """
+    ids = sorted(set(ids) - read_tombstones(file_name))
+    found = {}
+    if not ids or not os.path.exists(file_name):
+        return found
+
+    with open(file_name, 'rb') as file:
+        header = next(csv.reader([file.readline().decode()], delimiter=';'), None)
+        if header is None:
+            return found
+        data_start = file.tell()
+        data_end = file.seek(0, os.SEEK_END)
+        get_fields = field_getter(header, record_class)
+        id_index = header.index('ID')
+
+        if not ledger_ids(file_name)[1]:
+            wanted = {str(record_id) for record_id in ids}
+            file.seek(data_start)
+            for row in csv.reader(io.TextIOWrapper(file, newline=''), delimiter=';'):
+                if len(row) > id_index and row[id_index].strip() in wanted:
+                    record = record_class.from_fields(*get_fields(row))
+                    found[record.id] = record
+            return dict(sorted(found.items()))
+
+        def row_at(offset):
+            # The first complete row that starts at or after the offset
+            file.seek(offset)
+            if offset > data_start:
+                file.readline()
+            line = file.readline()
+            row = next(csv.reader([line.decode()], delimiter=';'), None)
+            return row
+
+        for record_id in ids:
+            # Find the last row start whose ID is <= record_id
+            low, high = data_start, data_end
+            while high - low > 1:
+                middle = (low + high) // 2
+                row = row_at(middle)
+                if row and row[id_index].strip().isdigit() and int(row[id_index]) <= record_id:
+                    low = middle
+                else:
+                    high = middle
+            for offset in (low, data_start):
+                row = row_at(offset)
+                if row and row[id_index].strip() == str(record_id):
+                    found[record_id] = record_class.from_fields(*get_fields(row))
+                    break
+    return found
+
+
+def cached_records(file_name):
+    """
+    Returns the cached records of a file if they are still up to date.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file.
+
+    Returns:
+    -------
+    list or None
+        The cached records, or None if there are none or they are stale.
+    """
+    if _cache is None:
+        return None
+    entry = _cache.get(os.path.abspath(file_name))
+    if entry is not None and entry[0] == ledger_signature(file_name):
+        return entry[1]
+    return None
+
+
+def store_records(file_name, records, signature=None):
+    """
+    Stores the records of a file in the cache, if caching is enabled.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file.
+    records : list
+        The records in the file.
+    signature : tuple, optional
+        The signature of the file the records belong to, the current
+        signature by default.
+
+    Returns:
+    -------
+    None
+    """
+    if _cache is not None:
+        _cache[os.path.abspath(file_name)] = (signature or ledger_signature(file_name), records)
+
+
+def read_records(file_name, record_class):
+    """
+    Reads the given file and parses every row into a record.
+
+    Each field is parsed exactly once here, so consumers work with
+    integers instead of re-parsing strings. When caching is enabled the
+    returned list is shared and must not be modified.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to read.
+    record_class : type
+        The record class of the rows, BoughtLot or Sale.
+
+    Returns:
+    -------
+    list
+        A list of records with the data from the file.
+    """
+    records = cached_records(file_name)
+    if records is not None:
+        return records
+
+    signature = ledger_signature(file_name)
+    deleted = read_tombstones(file_name)
+    with metrics.stage('parse'), open(file_name, 'r', newline='') as file:
+        reader = csv.reader(file, delimiter=';')
+        header = next(reader, None)
+        if header is None:
+            return []
+
+        # Pick the columns by name, so the column order in the file does not matter
+        # and files without the later columns can still be read
+        get_fields = field_getter(header, record_class)
+        from_fields = record_class.from_fields
+        records = [from_fields(*get_fields(row)) for row in reader if row]
+    metrics.count('rows_read', len(records))
+    metrics.count('bytes_read', signature[2] if signature else 0)
+    if deleted:
+        # Leave out the rows that were deleted but not compacted yet
+        records = [record for record in records if record.id not in deleted]
+
+    store_records(file_name, records, signature)
+    return records
+
+
+def iter_records(file_name, record_class, date_field=None, start_date=None, end_date=None):
+    """
+    Streams the records of the given file one at a time.
+
+    With a date field, only rows whose date lies between the start and end
+    date (inclusive) are parsed. Dates are compared as 'YYYY-MM-DD' text
+    before parsing, so skipped rows cost almost nothing and memory use
+    does not grow with the size of the file. When the file is sorted by
+    the date column, the date index of the file is used to seek to the
+    first row in the range and reading stops after the last.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to read.
+    record_class : type
+        The record class of the rows, BoughtLot or Sale.
+    date_field : str, optional
+        The column to filter on, e.g. 'SELL_DATE'.
+    start_date : int, optional
+        The ordinal of the first date to include.
+    end_date : int, optional
+        The ordinal of the last date to include.
+
+    Yields:
+    ------
+    BoughtLot or Sale
+        The records in the file, in file order.
+    """
+    if not os.path.exists(file_name):
+        return
+
+    start = format_date(start_date) if start_date is not None else ''
+    end = format_date(end_date) if end_date is not None else '\uffff'
+
+    # Serve the records from memory if they are cached
+    records = cached_records(file_name)
+    if records is not None:
+        if date_field is None:
+            yield from records
+        else:
+            get_date = operator.attrgetter(date_field.lower())
+            start, end = start_date or 1, end_date or float('inf')
+            yield from (record for record in records if start <= get_date(record) <= end)
+        return
+
+    # Find the first row in the range with the date index of the file
+    offset = None
+    if date_field is not None and (start_date is not None or end_date is not None):
+        offset = load_date_index(file_name, date_field).seek_range(start, end)
+
+    with open(file_name, 'rb') as binary_file:
+        header = binary_file.readline()
+        if offset is not None:
+            binary_file.seek(offset)
+        start_offset = binary_file.tell() - len(header)
+        try:
+            file = io.TextIOWrapper(binary_file, newline='')
+            header = next(csv.reader([header.decode()], delimiter=';'), None)
+            if header is None:
+                return
+
+            reader = csv.reader(file, delimiter=';')
+            get_fields = field_getter(header, record_class)
+            from_fields = record_class.from_fields
+            deleted = read_tombstones(file_name)
+            if date_field is None:
+                for row in reader:
+                    if row:
+                        record = from_fields(*get_fields(row))
+                        if record.id not in deleted:
+                            yield record
+                return
+
+            date_index = header.index(date_field)
+            for row in reader:
+                if not row:
+                    continue
+                date = row[date_index]
+                if start <= date <= end:
+                    record = from_fields(*get_fields(row))
+                    if record.id not in deleted:
+                        yield record
+                elif offset is not None and date > end:
+                    # The rows are sorted by date, so the rest is past the range
+                    break
+        finally:
+            # Count the bytes that were read, also when the reader stopped early
+            metrics.count('bytes_read', binary_file.tell() - start_offset)
+
+
+def load_date_index(file_name, date_field):
+    """
+    Loads the date index of a ledger file, updating its sidecar file first
+    if rows were added or the file was rewritten.
+
+    The sidecar is named after the ledger with '.idx' appended. If it
+    cannot be written, the updated index is still used for this query.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+    date_field : str
+        The date column to index, e.g. 'SELL_DATE'.
+
+    Returns:
+    -------
+    DateIndex
+        The up-to-date index.
+    """
+    index_file = file_name + '.idx'
+    index = DateIndex.load(index_file, date_field)
+    if index.update(file_name):
+        try:
+            with atomic_write(index_file) as file:
+                json.dump(index.to_dict(), file, separators=(',', ':'))
+        except OSError:
+            pass
+    return index
+
+
+def read_appended(file_name, record_class, mark):
+    """
+    Reads the rows that were appended to a file since it was marked.
+
+    A mark holds the inode, size and last bytes of the file at the time
+    it was read. If the file was replaced or changed before that size,
+    the rows cannot be read incrementally. An empty mark reads all rows.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to read.
+    record_class : type
+        The record class of the rows, BoughtLot or Sale.
+    mark : list
+        The inode, size, last bytes (as hex) and number of deleted rows
+        of the file when it was read before, or EMPTY_MARK.
+
+    Returns:
+    -------
+    tuple of (list, list) or None
+        The appended records and the new mark of the file, or None if
+        the file has to be read again from the start.
+    """
+    inode, size, tail, deleted_count = mark
+    if not os.path.exists(file_name):
+        return ([], EMPTY_MARK) if size == 0 else None
+
+    # Rows deleted since the mark cannot be taken back incrementally
+    deleted = read_tombstones(file_name)
+    if size and len(deleted) != deleted_count:
+        return None
+
+    with open(file_name, 'rb') as file:
+        stat = os.fstat(file.fileno())
+        if size and (stat.st_ino != inode or stat.st_size < size or DateIndex.read_tail(file, size) != tail):
+            return None
+        if stat.st_ino == inode and stat.st_size == size:
+            return [], mark
+
+        file.seek(0)
+        header = file.readline()
+        if not header.endswith(b'\n'):
+            return [], EMPTY_MARK
+        header = next(csv.reader([header.decode()], delimiter=';'))
+        get_fields = field_getter(header, record_class)
+
+        offset = max(size, file.tell())
+        file.seek(offset)
+        lines = []
+        for line in file:
+            if not line.endswith(b'\n'):
+                # Leave a row that is still being written for the next read
+                break
+            offset += len(line)
+            lines.append(line.decode())
+
+        records = [record_class.from_fields(*get_fields(row)) for row in csv.reader(lines, delimiter=';') if row]
+        records = [record for record in records if record.id not in deleted]
+        return records, [stat.st_ino, offset, DateIndex.read_tail(file, offset), len(deleted)]
+
+
+def load_lot_index(index_file):
+    """
+    Loads the index of the sales of every lot.
+
+    The file starts with a line of JSON holding the mark of the sold file
+    and the number of sales, followed by two arrays of 64-bit integers: the
+    lot IDs in ascending order, and the ID of the sale of each entry.
+
+    Parameters:
+    ----------
+    index_file : str
+        The name of the index file.
+
+    Returns:
+    -------
+    tuple of (array, array, list)
+        The lot IDs, the sale IDs and the mark of the sold file. A missing
+        or damaged index gives empty arrays and an empty mark.
+    """
+    lot_ids, sale_ids = array.array('q'), array.array('q')
+    try:
+        with open(index_file, 'rb') as file:
+            header = json.loads(file.readline())
+            if header.get('version') != LOT_INDEX_VERSION:
+                raise ValueError(f"unknown lot index version {header.get('version')}")
+            size = header['rows'] * lot_ids.itemsize
+            lot_ids.frombytes(file.read(size))
+            sale_ids.frombytes(file.read(size))
+            if len(lot_ids) != header['rows'] or len(sale_ids) != header['rows']:
+                raise ValueError('truncated lot index')
+            metrics.count('bytes_read', 2 * size)
+            return lot_ids, sale_ids, header['mark']
+    except (OSError, KeyError, TypeError, ValueError):
+        return array.array('q'), array.array('q'), EMPTY_MARK
+
+
+def find_sales_of_lots(sold_file, lot_ids):
+    """
+    Finds the sales of some lots without reading the whole sold file.
+
+    The sale IDs of every lot are kept in an index next to the sold file
+    (`sold.csv.bylot`), sorted by lot ID, so the sales of a lot are found
+    by bisection. Sales appended since the index was written are read from
+    the tail of the file, and the index is rewritten when the tail grew
+    long or the file was rewritten. The sales themselves are read with
+    find_rows, which also skips deleted sales.
+
+    Parameters:
+    ----------
+    sold_file : str
+        The name of the sold file.
+    lot_ids : iterable of int
+        The IDs of the lots.
+
+    Returns:
+    -------
+    dict
+        The sales of the lots by ID.
+    """
+    index_file = sold_file + '.bylot'
+    with metrics.stage('join'):
+        indexed_lots, indexed_sales, mark = load_lot_index(index_file)
+        # Deleted sales are skipped by find_rows, so new tombstones do not make the index stale
+        mark = [*mark[:3], len(read_tombstones(sold_file))]
+        appended = read_appended(sold_file, Sale, mark)
+        if appended is None:
+            indexed_lots, indexed_sales = array.array('q'), array.array('q')
+            appended = read_appended(sold_file, Sale, EMPTY_MARK)
+        tail, new_mark = appended
+
+        wanted = set(lot_ids)
+        sale_ids = {sale.id for sale in tail if sale.bought_id in wanted}
+        for lot_id in wanted:
+            start = bisect.bisect_left(indexed_lots, lot_id)
+            sale_ids.update(indexed_sales[start:bisect.bisect_right(indexed_lots, lot_id, start)])
+
+        if not indexed_lots or len(tail) > SNAPSHOT_TAIL_ROWS:
+            entries = list(zip(indexed_lots, indexed_sales))
+            entries += [(sale.bought_id, sale.id) for sale in tail if sale.bought_id is not None]
+            entries.sort()
+            header = {'version': LOT_INDEX_VERSION, 'mark': new_mark, 'rows': len(entries)}
+            try:
+                with atomic_write(index_file, binary=True) as file:
+                    file.write(json.dumps(header, separators=(',', ':')).encode() + b'\n')
+                    file.write(array.array('q', [lot_id for lot_id, _ in entries]).tobytes())
+                    file.write(array.array('q', [sale_id for _, sale_id in entries]).tobytes())
+            except OSError:
+                pass
+    return find_rows(sold_file, Sale, sale_ids)
+
+
+def snapshot_block(lot):
+    """Returns the key of the snapshot block a lot is stored in."""
+    return lot.product_name, lot.expiration_date // SNAPSHOT_BLOCK_DAYS
+
+
+def snapshot_filter(product_name=None, after_date=None, until_date=None):
+    """
+    Creates a test for the snapshot blocks that can hold the lots of a
+    product, or the lots that expire in a period.
+
+    Parameters:
+    ----------
+    product_name : str, optional
+        Only the blocks of this product.
+    after_date : int, optional
+        Only the blocks with lots that expire after this date ordinal.
+    until_date : int, optional
+        Only the blocks with lots that expire up to this date ordinal.
+
+    Returns:
+    -------
+    callable
+        A function from a block key to whether the block is needed.
+    """
+    first_block = (after_date + 1) // SNAPSHOT_BLOCK_DAYS if after_date is not None else -1
+    last_block = until_date // SNAPSHOT_BLOCK_DAYS if until_date is not None else float('inf')
+
+    def wanted(key):
+        product, block = key
+        return (product_name is None or product == product_name) and first_block <= block <= last_block
+    return wanted
+
+
+def load_snapshot(snapshot_file, wanted=None):
+    """
+    Loads a snapshot of the unsold lots written by `compact`.
+
+    The file starts with a line of JSON holding the marks and an index
+    of the blocks, followed by the blocks. Each block holds the lots of
+    one product whose expiration dates fall in the same SNAPSHOT_BLOCK_DAYS,
+    compressed separately, so only the blocks that are needed are read
+    and decoded.
+
+    Parameters:
+    ----------
+    snapshot_file : str
+        The name of the snapshot file.
+    wanted : callable, optional
+        A test for the keys of the blocks to load, see snapshot_filter.
+        All blocks are loaded by default.
+
+    Returns:
+    -------
+    tuple of (ExpiryQueue, list)
+        The unsold lots and the marks of the bought and sold file at the
+        time of the snapshot. A missing or damaged snapshot gives no lots
+        and empty marks, so the lots are read from the start.
+    """
+    import zlib
+
+    items = []
+    try:
+        with open(snapshot_file, 'rb') as file:
+            header = json.loads(file.readline())
+            if header.get('version') != SNAPSHOT_VERSION:
+                raise ValueError(f"unknown snapshot version {header.get('version')}")
+            marks = [header['marks']['bought'], header['marks']['sold']]
+
+            offset = file.tell()
+            for product_name, block, size in header['blocks']:
+                if wanted is None or wanted((product_name, block)):
+                    file.seek(offset)
+                    lots = json.loads(zlib.decompress(file.read(size)))
+                    items += [(BoughtLot(lot_id, product_name, *fields), remaining) for lot_id, *fields, remaining in lots]
+                    metrics.count('bytes_read', size)
+                offset += size
+    except (OSError, KeyError, TypeError, ValueError, zlib.error):
+        return ExpiryQueue(), [EMPTY_MARK, EMPTY_MARK]
+    return ExpiryQueue.from_items(items), marks
+
+
+def save_snapshot(snapshot_file, queue, marks):
+    """
+    Writes a snapshot of the unsold lots, in blocks per product and period
+    of expiration dates, see load_snapshot.
+
+    Parameters:
+    ----------
+    snapshot_file : str
+        The name of the snapshot file.
+    queue : ExpiryQueue
+        The unsold lots.
+    marks : list
+        The marks of the bought and sold file the lots were read up to.
+
+    Returns:
+    -------
+    None
+    """
+    import zlib
+
+    blocks = {}
+    for lot, remaining in queue.items():
+        blocks.setdefault(snapshot_block(lot), []).append(
+            [lot.id, lot.buy_price, lot.expiration_date, lot.buy_date, lot.quantity, remaining])
+    data = [zlib.compress(json.dumps(lots, separators=(',', ':')).encode(), 1) for lots in blocks.values()]
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'marks': {'bought': marks[0], 'sold': marks[1]},
+        'blocks': [[product_name, block, len(block_data)] for (product_name, block), block_data in zip(blocks, data)],
+    }
+    try:
+        with atomic_write(snapshot_file, binary=True) as file:
+            file.write(json.dumps(header, separators=(',', ':')).encode() + b'\n')
+            file.writelines(data)
+    except OSError:
+        pass
 
 
 def read_bought(file_name):
     """
-    Reads the given file and returns its contents
-    as a list of dictionaries.
+    Reads the given file and returns its contents
+    as a list of bought lots.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to read.
+
+    Returns:
+    -------
+    List[BoughtLot]
+        A list of lots with the data from the file.
+    """
+    return read_records(file_name, BoughtLot)
+
+
+def read_sold(sold_file='sold.csv'):
+    """
+    Reads the data of sold products from the given file.
+
+    Parameters
+    ----------
+    sold_file : str
+        The name of the file to read.
+
+    Returns
+    -------
+    sold_data : list of Sale
+        The data of sold products as a list of sales,
+        one for each row in the file.
+    """
+    # If the sold file does not exist, return an empty list
+    if not os.path.exists(sold_file):
+        return []
+
+    return read_records(sold_file, Sale)
+
+
+def read_last_row(file_name):
+    """
+    Reads the last row of the given file without scanning the whole file.
+
+    The file is read backwards in small blocks until a complete line is
+    found, so the cost does not grow with the size of the file.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to read.
+
+    Returns:
+    -------
+    List[str] or None
+        The fields of the last data row, or None if the file is missing
+        or only contains the header.
+    """
+    if not os.path.exists(file_name):
+        return None
+
+    with open(file_name, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        block = b''
+
+        # Read blocks from the end until the block holds a full last line
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            file.seek(position)
+            block = file.read(step) + block
+            if b'\n' in block.rstrip(b'\r\n'):
+                break
+
+    lines = block.rstrip(b'\r\n').split(b'\n')
+
+    # A single line at the start of the file is the header
+    if len(lines) < 2 and position == 0:
+        return None
+
+    last_line = lines[-1].decode().rstrip('\r')
+    return next(csv.reader([last_line], delimiter=';'))
+
+
+def next_id(file_name):
+    """
+    Returns the next free ID for the given file.
+
+    The highest ID is kept in the sequence file of the ledger, so it is
+    found without reading the ledger. IDs of rows that were deleted and
+    compacted away are not handed out again.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to generate an ID for.
+
+    Returns:
+    -------
+    int
+        The ID for the next row.
+    """
+    return ledger_ids(file_name)[0] + 1
+
+
+def append_rows(records, file_name):
+    """
+    Appends records to the end of the given file in a single write.
+
+    The header is written first if the file does not exist yet, and the
+    rows are flushed and fsync'd before returning.
+
+    Parameters:
+    ----------
+    records : list of BoughtLot or Sale
+        The records to append.
+    file_name : str
+        The name of the file to append to.
+
+    Returns:
+    -------
+    None
+    """
+    if not records:
+        return
+
+    cached = cached_records(file_name)
+    new_file = not os.path.exists(file_name) or os.path.getsize(file_name) == 0
+
+    # Make sure a hand-edited file without a trailing newline stays valid
+    missing_newline = False
+    if not new_file:
+        upgrade_header(file_name, type(records[0]))
+        with open(file_name, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            missing_newline = file.read(1) != b'\n'
+    last_id, in_order = ledger_ids(file_name)
+
+    with metrics.stage('write'), open(file_name, 'a', newline='') as file:
+        size = file.tell()
+        if missing_newline:
+            file.write('\r\n')
+        writer = csv.writer(file, delimiter=';')
+        if new_file:
+            writer.writerow(records[0].FIELDS)
+        writer.writerows(record.to_fields() for record in records)
+        file.flush()
+        os.fsync(file.fileno())
+        metrics.count('bytes_written', file.tell() - size)
+    metrics.count('rows_written', len(records))
+    write_sequence(file_name, *sequence_after(last_id, in_order, records))
+
+    # Keep the cache in step with our own appends instead of re-parsing
+    if cached is not None:
+        cached.extend(records)
+        store_records(file_name, cached)
+
+
+def upgrade_header(file_name, record_class):
+    """
+    Adds the columns that are missing from a file written by an older
+    version, e.g. QUANTITY, so new rows can be appended to it.
+
+    The file is rewritten once, with the default value in the new columns.
+    Deleted rows are kept, so the tombstones of the file still apply.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file.
+    record_class : type
+        The record class of the rows, BoughtLot or Sale.
+
+    Returns:
+    -------
+    bool
+        True if the file was rewritten.
+    """
+    with open(file_name, newline='') as file:
+        reader = csv.reader(file, delimiter=';')
+        header = next(reader, None)
+        if header is None or all(field in header for field in record_class.FIELDS):
+            return False
+
+        get_fields = field_getter(header, record_class)
+        with atomic_write(file_name) as new_file:
+            writer = csv.writer(new_file, delimiter=';')
+            writer.writerow(record_class.FIELDS)
+            for row in reader:
+                if row:
+                    fields = list(get_fields(row))
+                    writer.writerow(fields + [OPTIONAL_FIELDS[field] for field in record_class.FIELDS[len(fields):]])
+    return True
+
+
+def append_bought(lot, bought_file):
+    """
+    Appends a single lot to the bought file.
+
+    Parameters:
+    ----------
+    lot : BoughtLot
+        The lot to append.
+    bought_file : str
+        The name of the file to append to.
+
+    Returns:
+    -------
+    None
+    """
+    append_rows([lot], bought_file)
+
+
+def append_sold(sale, sold_file='sold.csv'):
+    """
+    Appends a single sale to the sold file.
+
+    Parameters:
+    ----------
+    sale : Sale
+        The sale to append.
+    sold_file : str
+        The name of the file to append to.
+
+    Returns:
+    -------
+    None
+    """
+    append_rows([sale], sold_file)
+
+
+@contextlib.contextmanager
+def atomic_write(file_name, binary=False):
+    """
+    Opens a temporary file that replaces the given file when the block ends.
+
+    The data is written to a temporary file in the same directory, which is
+    fsync'd and then moved over the original with os.replace. Readers see
+    either the old or the new file, never a half-written one.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the file to replace.
+    binary : bool
+        Open the temporary file for writing bytes instead of text.
+
+    Yields:
+    ------
+    file object
+        The temporary file.
+    """
+    # tempfile imports random and hashlib, so only load it when writing
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(file_name))
+    descriptor, temp_name = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(file_name)}.', suffix='.tmp')
+    try:
+        with open(descriptor, 'wb') if binary else open(descriptor, 'w', newline='') as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(lock_file):
+    """
+    Holds an exclusive advisory lock on the given lock file.
+
+    Other SuperPy processes wait at this point until the lock is released.
+    On platforms without fcntl the block runs without a lock.
+
+    Parameters:
+    ----------
+    lock_file : str
+        The name of the lock file, it is created when missing.
+
+    Yields:
+    ------
+    None
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(lock_file, 'a') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def write_bought(bought_data, bought_file):
+    """
+    Writes the given list of lots to a CSV file with the given filename.
+
+    Parameters:
+    ----------
+    bought_data : list of BoughtLot
+        A list of lots representing the data to be written to the file.
+    bought_file : str
+        The name of the file to which the data should be written.
+
+    Returns:
+    -------
+    None
+    """
+    last_id = ledger_ids(bought_file)[0]
+    with metrics.stage('write'), atomic_write(bought_file) as file:
+        writer = csv.writer(file, delimiter=";")
+        writer.writerow(BOUGHT_FIELDS)
+        writer.writerows(lot.to_fields() for lot in bought_data)
+        metrics.count('bytes_written', file.tell())
+    metrics.count('rows_written', len(bought_data))
+    write_sequence(bought_file, *sequence_after(last_id, True, bought_data, start=0))
+    clear_tombstones(bought_file)
+    store_records(bought_file, list(bought_data))
+
+
+def write_sold(sold_data, sold_file='sold.csv'):
+    """
+    Writes the given data to the given sold file.
+
+    Parameters:
+    -----------
+    sold_data : list of Sale
+        The data to write to the sold file as a list
+        of sales, one for each row in the file.
+    sold_file : str
+        The name of the file to which the data should be written.
+
+    Returns:
+    -------
+    None
+    """
+    last_id = ledger_ids(sold_file)[0]
+    # Write a new sold file and swap it in place of the old one
+    with metrics.stage('write'), atomic_write(sold_file) as file:
+        sold_writer = csv.writer(file, delimiter=';')
+        # Write the headers to the sold file
+        sold_writer.writerow(SOLD_FIELDS)
+        # Write the data rows to the sold file
+        sold_writer.writerows(sale.to_fields() for sale in sold_data)
+        metrics.count('bytes_written', file.tell())
+    metrics.count('rows_written', len(sold_data))
+    write_sequence(sold_file, *sequence_after(last_id, True, sold_data, start=0))
+    clear_tombstones(sold_file)
+    store_records(sold_file, list(sold_data))
+
+
+def sequence_after(last_id, in_order, records, start=None):
+    """
+    Updates the highest ID and the ID order of a ledger for written rows.
+
+    Parameters:
+    ----------
+    last_id : int
+        The highest ID ever handed out before the write.
+    in_order : bool
+        Whether the rows before the written ones are in ID order.
+    records : iterable of BoughtLot or Sale
+        The rows that were written, in file order.
+    start : int, optional
+        The highest ID of the rows before the written ones, last_id by
+        default. 0 when the ledger was rewritten with only these rows.
+
+    Returns:
+    -------
+    tuple of (int, bool)
+        The new highest ID and whether the rows are still in ID order.
+    """
+    previous = last_id if start is None else start
+    for record in records:
+        in_order = in_order and record.id > previous
+        previous = record.id
+        last_id = max(last_id, record.id)
+    return last_id, in_order
+
+
+def clear_tombstones(file_name):
+    """
+    Removes the tombstone file of a ledger after the ledger was rewritten
+    without the deleted rows.
 
     Parameters:
     ----------
     file_name : str
-        The name of the file to read.
+        The name of the ledger file.
 
     Returns:
     -------
-    List[Dict]
-        A list of dictionaries with the data from the file.
+    None
     """
-    with open(file_name, 'r', newline='') as file:
-        reader = csv.DictReader(file, delimiter=';')
-        return [row for row in reader]
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(tombstone_file(file_name))
 
 
-def read_sold():
+def index_sales_by_lot(sold_data):
     """
-    Reads the data of sold products from the 'sold.csv' file.
+    Sums the units sold of every lot and keeps its latest sale. Written
+    off units are left out.
 
-    Returns
+    Parameters:
+    ----------
+    sold_data : iterable of Sale
+        The sales.
+
+    Returns:
     -------
-    sold_data : list of dict
-        The data of sold products as a list of dictionaries,
-        where each dictionary represents a row in the file.
+    dict
+        A dictionary mapping each lot ID to the number of units sold and
+        the last sale in file order.
+    """
+    index = {}
+    with metrics.stage('join'):
+        for sale in sold_data:
+            if sale.bought_id is not None and not sale.written_off:
+                units, _ = index.get(sale.bought_id, (0, None))
+                index[sale.bought_id] = (units + sale.quantity, sale)
+    return index
+
+
+class CsvBackend:
+    """
+    Stores the bought and sold data in semicolon separated CSV files.
+
+    This is the default backend. New rows are appended to the files, and
+    the files are only rewritten when rows are deleted. Transactions hold
+    an advisory lock on a lock file next to the bought file, so parallel
+    processes do not lose rows or hand out the same ID twice.
+    """
+
+    name = 'csv'
+
+    def __init__(self, bought_file='bought.csv', sold_file='sold.csv'):
+        self.bought_file = bought_file
+        self.sold_file = sold_file
+        self.lock_file = os.path.join(os.path.dirname(os.path.abspath(bought_file)), '.superpy.lock')
+        self.rollups_file = sold_file + '.rollup'
+        self.snapshot_file = bought_file + '.snapshot'
+        self._in_transaction = False
+
+    def __str__(self):
+        return f"{self.bought_file} and {self.sold_file}"
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed read-modify-write while holding the ledger lock.
+
+        Yields:
+        ------
+        CsvBackend
+            The backend itself.
+        """
+        if self._in_transaction:
+            yield self
+            return
+
+        with file_lock(self.lock_file):
+            self._in_transaction = True
+            try:
+                yield self
+            finally:
+                self._in_transaction = False
+
+    def read_bought(self):
+        """
+        Reads all bought lots.
+
+        Returns:
+        -------
+        list of BoughtLot
+            The bought lots.
+        """
+        if not os.path.exists(self.bought_file):
+            return []
+        return read_bought(self.bought_file)
+
+    def read_sold(self, start_date=None, end_date=None):
+        """
+        Reads the sales, optionally only those between two dates (inclusive).
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first sell date.
+        end_date : int, optional
+            The ordinal of the last sell date.
+
+        Returns:
+        -------
+        list of Sale
+            The sales.
+        """
+        if start_date is None and end_date is None:
+            return read_sold(self.sold_file)
+        return list(self.iter_sold(start_date, end_date))
+
+    def iter_bought(self, start_date=None, end_date=None):
+        """
+        Streams the bought lots, optionally only those bought between two dates.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first buy date.
+        end_date : int, optional
+            The ordinal of the last buy date.
+
+        Yields:
+        ------
+        BoughtLot
+            The bought lots.
+        """
+        return metrics.timed_iter('parse', iter_records(self.bought_file, BoughtLot, 'BUY_DATE', start_date, end_date), 'rows_read')
+
+    def iter_sold(self, start_date=None, end_date=None):
+        """
+        Streams the sales, optionally only those sold between two dates.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first sell date.
+        end_date : int, optional
+            The ordinal of the last sell date.
+
+        Yields:
+        ------
+        Sale
+            The sales.
+        """
+        return metrics.timed_iter('parse', iter_records(self.sold_file, Sale, 'SELL_DATE', start_date, end_date), 'rows_read')
+
+    def write_bought(self, bought_data):
+        """Replaces all bought lots with the given lots."""
+        write_bought(bought_data, self.bought_file)
+        # The cost of the sales may have changed, rebuild the rollups on the next read
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.rollups_file)
+
+    def write_sold(self, sold_data):
+        """Replaces all sales with the given sales."""
+        write_sold(sold_data, self.sold_file)
+
+    def next_bought_id(self):
+        """Returns the ID for the next bought lot."""
+        return next_id(self.bought_file)
+
+    def next_sold_id(self):
+        """Returns the ID for the next sale."""
+        return next_id(self.sold_file)
+
+    def append_bought(self, lot):
+        """Adds a single bought lot."""
+        append_bought(lot, self.bought_file)
+
+    def append_sold(self, sale, lot=None):
+        """Adds a single sale, and its totals to the rollups if its lot is given."""
+        self.extend_sold([sale], [lot] if lot is not None else None)
+
+    def extend_bought(self, lots):
+        """Adds many bought lots in a single write."""
+        append_rows(lots, self.bought_file)
+
+    def extend_sold(self, sales, lots=None):
+        """Adds many sales in a single write, and their totals to the rollups if their lots are given."""
+        signature = ledger_signature(self.sold_file)
+        append_rows(sales, self.sold_file)
+        if lots is not None:
+            self._record_rollups([Rollup.from_sale(sale, lot) for sale, lot in zip(sales, lots)], signature)
+
+    def read_rollups(self, start_date=None, end_date=None):
+        """
+        Reads the daily totals per product in a date range.
+
+        The rollups are rebuilt from the ledgers first if the sold file
+        was changed without updating them, and the rollup file is
+        compacted when it holds many more rows than totals. Both rewrite
+        the rollup file while holding the ledger lock.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first day.
+        end_date : int, optional
+            The ordinal of the last day.
+
+        Returns:
+        -------
+        list of Rollup
+            The totals per product per day, sorted by day and product.
+        """
+        def stale(rollups):
+            return rollups is None or rollups.watermark != list(ledger_signature(self.sold_file) or [])
+
+        def oversized(rollups):
+            return rollups.row_count > 2 * len(rollups.totals) + ROLLUP_COMPACT_ROWS
+
+        with metrics.stage('rollups'):
+            rollups = Rollups.load(self.rollups_file)
+        if stale(rollups) or oversized(rollups):
+            # A sale recorded between loading and rewriting the file would
+            # be lost or counted twice, so load it again under the lock
+            with self.transaction():
+                with metrics.stage('rollups'):
+                    rollups = Rollups.load(self.rollups_file)
+                if stale(rollups):
+                    rollups = self._rebuild_rollups()
+                elif oversized(rollups):
+                    self._write_rollups(rollups, rollups.watermark)
+        return rollups.rows(start_date, end_date)
+
+    def rebuild_rollups(self, workers=1):
+        """
+        Rebuilds the rollups from the bought and sold files.
+
+        Parameters:
+        ----------
+        workers : int
+            The number of processes to read the files with.
+
+        Returns:
+        -------
+        int
+            The number of product and day totals.
+        """
+        return len(self._rebuild_rollups(workers).totals)
+
+    def _rebuild_rollups(self, workers=1):
+        # No rows can be sold between taking the signature and writing the file
+        with self.transaction():
+            signature = ledger_signature(self.sold_file)
+            with metrics.stage('aggregate'):
+                if workers > 1 and _cache is None:
+                    rollups = self.parallel_rollups(workers)
+                else:
+                    rollups = Rollups.from_data(self.iter_bought(), self.iter_sold())
+            self._write_rollups(rollups, signature)
+        return rollups
+
+    def parallel_rollups(self, workers, start_date=None, end_date=None, with_cost=True):
+        """
+        Sums the sales per product and day with several processes, each
+        reading a part of the files.
+
+        Parameters:
+        ----------
+        workers : int
+            The number of processes.
+        start_date : int, optional
+            The ordinal of the first day.
+        end_date : int, optional
+            The ordinal of the last day.
+        with_cost : bool
+            Also sum the cost and profit, which needs the bought file.
+
+        Returns:
+        -------
+        Rollups
+            The totals per product per day.
+        """
+        # Only load multiprocessing when the sales are summed in parallel
+        from parallel import ledger_rollups
+
+        sold_offset = None
+        if os.path.exists(self.sold_file) and (start_date is not None or end_date is not None):
+            start = format_date(start_date) if start_date is not None else ''
+            end = format_date(end_date) if end_date is not None else '\uffff'
+            sold_offset = load_date_index(self.sold_file, 'SELL_DATE').seek_range(start, end)
+        return ledger_rollups(
+            self.bought_file, self.sold_file, workers, start_date, end_date, with_cost,
+            read_tombstones(self.bought_file), read_tombstones(self.sold_file), sold_offset,
+        )
+
+    def _write_rollups(self, rollups, signature):
+        try:
+            with atomic_write(self.rollups_file) as file:
+                writer = csv.writer(file, delimiter=';')
+                writer.writerow(Rollup.FIELDS)
+                writer.writerows(rollup.to_fields() for rollup in rollups.rows())
+                writer.writerow([WATERMARK, *(signature or [])])
+        except OSError:
+            pass
+
+    def _record_rollups(self, changes, signature):
+        """
+        Appends the totals of changed sales to the rollup file.
+
+        The changes are only recorded if the rollups matched the sold file
+        as it was before the change. Otherwise the rollups are stale and
+        are rebuilt on the next read anyway.
+
+        Parameters:
+        ----------
+        changes : list of Rollup
+            The totals to add, negative for deleted sales.
+        signature : tuple or None
+            The signature of the sold file before the change.
+
+        Returns:
+        -------
+        None
+        """
+        last_row = read_last_row(self.rollups_file)
+        if not last_row or last_row[0] != WATERMARK or last_row[1:] != [str(value) for value in signature or []]:
+            return
+
+        with open(self.rollups_file, 'a', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerows(rollup.to_fields() for rollup in changes)
+            writer.writerow([WATERMARK, *(ledger_signature(self.sold_file) or [])])
+
+    def allocate(self, product_name, current_date, quantity):
+        """
+        Plans which lots to sell units of a product from, first expired
+        first out.
+
+        Parameters:
+        ----------
+        product_name : str
+            The name of the product.
+        current_date : int
+            The ordinal of the current date.
+        quantity : int
+            The number of units to sell.
+
+        Returns:
+        -------
+        list of tuple
+            The (lot, units) portions to sell, or an empty list if there
+            are not enough units in stock.
+        """
+        if _cache is None:
+            # Only load and index the unexpired lots of this product for a one-off sell
+            queue = self.expiry_queue(product_name=product_name, after_date=current_date)
+            inventory = Inventory.from_queue(queue, product_name)
+        else:
+            inventory = self.inventory()
+        # The sales are applied to the cached inventory when they are read back
+        return inventory.allocate(product_name, current_date, quantity, take=False)
+
+    def inventory(self):
+        """
+        Returns the index of all unsold lots.
+
+        When caching is enabled the index is kept in memory and only the
+        rows appended since the last call are applied to it. It is rebuilt
+        when one of the files was rewritten or changed by another process.
+
+        Returns:
+        -------
+        Inventory
+            The inventory of unsold lots.
+        """
+        bought_data = self.read_bought()
+        sold_data = self.read_sold()
+        if _cache is None:
+            return Inventory.from_data(bought_data, sold_data)
+
+        key = ('inventory', os.path.abspath(self.bought_file), os.path.abspath(self.sold_file))
+        entry = _cache.get(key)
+        if entry is None or entry[0] is not bought_data or entry[1] is not sold_data:
+            inventory = Inventory.from_data(bought_data, sold_data)
+        else:
+            # The cached lists were extended in place, apply only the new rows
+            _, _, inventory, bought_count, sold_count = entry
+            for lot in bought_data[bought_count:]:
+                inventory.add(lot)
+            for sale in sold_data[sold_count:]:
+                inventory.remove(sale.bought_id, sale.quantity)
+
+        _cache[key] = (bought_data, sold_data, inventory, len(bought_data), len(sold_data))
+        return inventory
+
+    def expiring_lots(self, after_date, until_date):
+        """
+        Finds the unsold lots that expire in a period.
+
+        Parameters:
+        ----------
+        after_date : int
+            The ordinal of the day before the period.
+        until_date : int
+            The ordinal of the last day of the period.
+
+        Returns:
+        -------
+        list of tuple
+            (BoughtLot, units left) pairs, ordered by expiration date.
+        """
+        return self.expiry_queue(after_date=after_date, until_date=until_date).expiring(after_date, until_date)
+
+    def expiry_queue(self, checkpoint=False, product_name=None, after_date=None, until_date=None):
+        """
+        Returns the unsold lots, ordered by expiration date.
+
+        The lots are loaded from the snapshot written by `compact`, and
+        only the rows added to the ledgers since then are read and
+        replayed. The lots are read from the start, and a new snapshot is
+        written, if a ledger was rewritten or the tail grew too long.
+
+        With a product or a period, only the snapshot blocks that can hold
+        lots of the product or lots that expire in the period are loaded.
+        The queue then holds those lots, and may hold a few others.
+
+        Parameters:
+        ----------
+        checkpoint : bool
+            Always write a new snapshot.
+        product_name : str, optional
+            The product the lots are needed of.
+        after_date : int, optional
+            The lots are needed that expire after this date ordinal.
+        until_date : int, optional
+            The lots are needed that expire up to this date ordinal.
+
+        Returns:
+        -------
+        ExpiryQueue
+            The unsold lots.
+        """
+        partial = product_name is not None or after_date is not None or until_date is not None
+        wanted = snapshot_filter(product_name, after_date, until_date) if partial else None
+        with self.transaction(), metrics.stage('inventory'):
+            queue, marks = load_snapshot(self.snapshot_file, wanted)
+            bought = read_appended(self.bought_file, BoughtLot, marks[0])
+            sold = read_appended(self.sold_file, Sale, marks[1])
+            if bought is None or sold is None:
+                queue, marks = ExpiryQueue(), [EMPTY_MARK, EMPTY_MARK]
+                bought = read_appended(self.bought_file, BoughtLot, EMPTY_MARK)
+                sold = read_appended(self.sold_file, Sale, EMPTY_MARK)
+
+            (lots, bought_mark), (sales, sold_mark) = bought, sold
+            if checkpoint or marks == [EMPTY_MARK, EMPTY_MARK] or len(lots) + len(sales) > SNAPSHOT_TAIL_ROWS:
+                if partial and marks != [EMPTY_MARK, EMPTY_MARK]:
+                    # The new snapshot needs the lots of every block
+                    queue, _ = load_snapshot(self.snapshot_file)
+                queue.add(lots)
+                queue.remove(sales)
+                save_snapshot(self.snapshot_file, queue, [bought_mark, sold_mark])
+            else:
+                if partial:
+                    lots = [lot for lot in lots if wanted(snapshot_block(lot))]
+                queue.add(lots)
+                queue.remove(sales)
+        return queue
+
+    def compact(self):
+        """
+        Compacts the ledgers and writes a snapshot of the unsold lots.
+
+        Deleted rows are removed from the files, the rollup file is
+        rewritten with one row per product and day, and the snapshot lets
+        later commands skip every row before this point. Sold lots stay in
+        the bought file, because their sales refer to them.
+
+        Returns:
+        -------
+        str
+            A summary of what was compacted.
+        """
+        with self.transaction():
+            bought_removed = self.compact_deleted(self.bought_file, BoughtLot, force=True)
+            sold_removed = self.compact_deleted(self.sold_file, Sale, force=True)
+
+            rollups = len(self.read_rollups())
+            rollups_file = Rollups.load(self.rollups_file)
+            if rollups_file is not None:
+                self._write_rollups(rollups_file, rollups_file.watermark)
+
+            lots = len(self.expiry_queue(checkpoint=True))
+
+        return (f"Removed {bought_removed} deleted bought and {sold_removed} deleted sold rows, "
+                f"kept {rollups} daily totals and {lots} unsold lots in {self.snapshot_file}")
+
+    def delete_bought(self, ids):
+        """
+        Deletes the bought lots with the given IDs.
+
+        The lots are found with a binary search over the file and their
+        IDs appended to the tombstone file of the ledger. The file itself
+        is only rewritten once many rows were deleted. Their sales are
+        found through the index of the sales of every lot, so the sold
+        file is not read in full either.
+
+        Parameters:
+        ----------
+        ids : iterable of int
+            The IDs to delete.
+
+        Returns:
+        -------
+        set of int
+            The IDs that were found and deleted.
+        """
+        deleted_lots = find_rows(self.bought_file, BoughtLot, ids)
+        if deleted_lots:
+            signature = ledger_signature(self.sold_file)
+            append_tombstones(deleted_lots, self.bought_file)
+
+            # Sales of the deleted lots no longer have a cost
+            changes = []
+            for sale in find_sales_of_lots(self.sold_file, deleted_lots).values():
+                changes += [Rollup.from_sale(sale, deleted_lots[sale.bought_id], -1), Rollup.from_sale(sale, None)]
+            if changes:
+                self._record_rollups(changes, signature)
+            self.compact_deleted(self.bought_file, BoughtLot)
+        return set(deleted_lots)
+
+    def delete_sold(self, ids):
+        """
+        Deletes the sales with the given IDs.
+
+        The sales are found with a binary search over the file and their
+        IDs appended to the tombstone file of the ledger. The file itself
+        is only rewritten once many rows were deleted.
+
+        Parameters:
+        ----------
+        ids : iterable of int
+            The IDs to delete.
+
+        Returns:
+        -------
+        set of int
+            The IDs that were found and deleted.
+        """
+        deleted_sales = find_rows(self.sold_file, Sale, ids)
+        if deleted_sales:
+            signature = ledger_signature(self.sold_file)
+            append_tombstones(deleted_sales, self.sold_file)
+
+            # Take the deleted sales out of the rollups
+            lots = find_rows(self.bought_file, BoughtLot, {sale.bought_id for sale in deleted_sales.values() if sale.bought_id is not None})
+            self._record_rollups([Rollup.from_sale(sale, lots.get(sale.bought_id), -1) for sale in deleted_sales.values()], signature)
+            self.compact_deleted(self.sold_file, Sale)
+        return set(deleted_sales)
+
+    def compact_deleted(self, file_name, record_class, force=False):
+        """
+        Rewrites a ledger without its deleted rows once enough rows were
+        deleted, and removes its tombstone file.
+
+        Parameters:
+        ----------
+        file_name : str
+            The name of the ledger file, the bought or the sold file.
+        record_class : type
+            The record class of the rows, BoughtLot or Sale.
+        force : bool
+            Compact even if only a few rows were deleted.
+
+        Returns:
+        -------
+        int
+            The number of rows that were removed from the file.
+        """
+        deleted = read_tombstones(file_name)
+        if not deleted or (not force and len(deleted) < TOMBSTONE_COMPACT_ROWS):
+            return 0
+
+        signature = ledger_signature(self.sold_file)
+        records = read_records(file_name, record_class)
+        if record_class is BoughtLot:
+            write_bought(records, file_name)
+        else:
+            write_sold(records, file_name)
+
+        # The sales are the same, so the rollups still match the new file
+        self._record_rollups([], signature)
+        return len(deleted)
+
+    def close(self):
+        """Releases the resources of the backend."""
+
+
+class SqliteBackend:
+    """
+    Stores the bought and sold data in a SQLite database.
+
+    The tables are indexed on product, dates and lot IDs, sells run in a
+    transaction and the database uses WAL mode, so readers never block
+    the writer.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bought (
+            id INTEGER PRIMARY KEY,
+            product_name TEXT NOT NULL,
+            buy_price INTEGER NOT NULL,
+            expiration_date INTEGER NOT NULL,
+            buy_date INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS sold (
+            id INTEGER PRIMARY KEY,
+            bought_id INTEGER,
+            product_name TEXT NOT NULL,
+            sell_price INTEGER NOT NULL,
+            sell_date INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            written_off INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS bought_product ON bought (product_name, expiration_date, id);
+        CREATE INDEX IF NOT EXISTS bought_buy_date ON bought (buy_date);
+        CREATE INDEX IF NOT EXISTS bought_expiration_date ON bought (expiration_date, id);
+        CREATE INDEX IF NOT EXISTS sold_sell_date ON sold (sell_date);
+        CREATE INDEX IF NOT EXISTS sold_bought_id ON sold (bought_id);
+        CREATE TABLE IF NOT EXISTS sequences (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rollups (
+            day INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            revenue INTEGER NOT NULL,
+            cost INTEGER NOT NULL,
+            units INTEGER NOT NULL,
+            profit INTEGER NOT NULL,
+            PRIMARY KEY (day, product_name)
+        );
     """
-    # If the 'sold.csv' file does not exist, return an empty list
-    if not os.path.exists('sold.csv'):
+
+    # The units of a sale that were sold, written off units are only a cost
+    SOLD_UNITS = 'CASE WHEN sold.written_off THEN 0 ELSE sold.quantity END'
+
+    # Adds (sign 1) or subtracts (sign -1) the totals of the selected sales
+    ROLLUP_UPSERT = f"""
+        INSERT INTO rollups (day, product_name, revenue, cost, units, profit)
+        SELECT sold.sell_date, sold.product_name, :sign * {SOLD_UNITS} * sold.sell_price,
+               :sign * sold.quantity * COALESCE(bought.buy_price, 0), :sign * {SOLD_UNITS},
+               :sign * COALESCE({SOLD_UNITS} * sold.sell_price - sold.quantity * bought.buy_price, 0)
+        FROM sold LEFT JOIN bought ON bought.id = sold.bought_id
+        WHERE {{where}}
+        ON CONFLICT (day, product_name) DO UPDATE SET
+            revenue = revenue + excluded.revenue,
+            cost = cost + excluded.cost,
+            units = units + excluded.units,
+            profit = profit + excluded.profit
+    """
+
+    BOUGHT_COLUMNS = 'id, product_name, buy_price, expiration_date, buy_date, quantity'
+    SOLD_COLUMNS = 'id, bought_id, product_name, sell_price, sell_date, quantity, written_off'
+
+    # The units of a lot that are not sold yet
+    REMAINING = 'bought.quantity - COALESCE((SELECT SUM(sold.quantity) FROM sold WHERE sold.bought_id = bought.id), 0)'
+
+    def __init__(self, database='superpy.db', shared=False):
+        self.database = database
+        # A shared backend is reused between commands and never closed
+        self.shared = shared
+        # Autocommit mode, transactions are started explicitly
+        # Only load sqlite3 when the SQLite backend is used
+        import sqlite3
+
+        self.connection = sqlite3.connect(database, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+        self._add_columns()
+        self._in_transaction = False
+
+    def __str__(self):
+        return self.database
+
+    def _add_columns(self):
+        # Databases created before lots had a quantity hold one unit per row,
+        # and those created before write-offs were marked have none
+        added_columns = [
+            ('bought', 'quantity', 'INTEGER NOT NULL DEFAULT 1'),
+            ('sold', 'quantity', 'INTEGER NOT NULL DEFAULT 1'),
+            ('sold', 'written_off', 'INTEGER NOT NULL DEFAULT 0'),
+        ]
+        for table, column, definition in added_columns:
+            columns = [row[1] for row in self.connection.execute(f'PRAGMA table_info({table})')]
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed block in a single write transaction.
+
+        Yields:
+        ------
+        SqliteBackend
+            The backend itself.
+        """
+        if self._in_transaction:
+            yield self
+            return
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        self._in_transaction = True
+        try:
+            yield self
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        else:
+            self.connection.execute('COMMIT')
+        finally:
+            self._in_transaction = False
+
+    def read_bought(self):
+        """
+        Reads all bought lots.
+
+        Returns:
+        -------
+        list of BoughtLot
+            The bought lots.
+        """
+        rows = self.connection.execute(f'SELECT {self.BOUGHT_COLUMNS} FROM bought ORDER BY id')
+        return [BoughtLot(*row) for row in rows]
+
+    def read_sold(self, start_date=None, end_date=None):
+        """
+        Reads the sales, optionally only those between two dates (inclusive).
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first sell date.
+        end_date : int, optional
+            The ordinal of the last sell date.
+
+        Returns:
+        -------
+        list of Sale
+            The sales.
+        """
+        return list(self.iter_sold(start_date, end_date))
+
+    def iter_bought(self, start_date=None, end_date=None):
+        """
+        Streams the bought lots, optionally only those bought between two dates.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first buy date.
+        end_date : int, optional
+            The ordinal of the last buy date.
+
+        Yields:
+        ------
+        BoughtLot
+            The bought lots.
+        """
+        rows = self.connection.execute(
+            f'SELECT {self.BOUGHT_COLUMNS} FROM bought WHERE buy_date BETWEEN ? AND ? ORDER BY id',
+            (start_date if start_date is not None else 1, end_date if end_date is not None else 2 ** 31),
+        )
+        return metrics.timed_iter('query', (BoughtLot(*row) for row in rows), 'rows_read')
+
+    def iter_sold(self, start_date=None, end_date=None):
+        """
+        Streams the sales, optionally only those sold between two dates.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first sell date.
+        end_date : int, optional
+            The ordinal of the last sell date.
+
+        Yields:
+        ------
+        Sale
+            The sales.
+        """
+        rows = self.connection.execute(
+            f'SELECT {self.SOLD_COLUMNS} FROM sold WHERE sell_date BETWEEN ? AND ? ORDER BY id',
+            (start_date if start_date is not None else 1, end_date if end_date is not None else 2 ** 31),
+        )
+        return metrics.timed_iter('query', (Sale(*row) for row in rows), 'rows_read')
+
+    def write_bought(self, bought_data):
+        """Replaces all bought lots with the given lots."""
+        with self.transaction():
+            self.connection.execute('DELETE FROM bought')
+            self.extend_bought(bought_data)
+            self.rebuild_rollups()
+
+    def write_sold(self, sold_data):
+        """Replaces all sales with the given sales."""
+        with self.transaction():
+            self.connection.execute('DELETE FROM sold')
+            self.connection.executemany(
+                f'INSERT INTO sold ({self.SOLD_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((sale.id, sale.bought_id, sale.product_name, sale.sell_price, sale.sell_date, sale.quantity, sale.written_off)
+                 for sale in sold_data),
+            )
+            self.rebuild_rollups()
+
+    def next_bought_id(self):
+        """Returns the ID for the next bought lot."""
+        return self._next_id('bought')
+
+    def next_sold_id(self):
+        """Returns the ID for the next sale."""
+        return self._next_id('sold')
+
+    def _next_id(self, table):
+        # IDs of deleted rows are not handed out again, see _delete
+        return self.connection.execute(
+            f"SELECT MAX(COALESCE((SELECT MAX(id) FROM {table}), 0), "
+            f"COALESCE((SELECT last_id FROM sequences WHERE name = ?), 0)) + 1",
+            (table,),
+        ).fetchone()[0]
+
+    def append_bought(self, lot):
+        """Adds a single bought lot."""
+        self.extend_bought([lot])
+
+    def append_sold(self, sale, lot=None):
+        """Adds a single sale and its totals to the rollups."""
+        self.extend_sold([sale])
+
+    def extend_bought(self, lots):
+        """Adds many bought lots in a single statement."""
+        self.connection.executemany(
+            f'INSERT INTO bought ({self.BOUGHT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+            ((lot.id, lot.product_name, lot.buy_price, lot.expiration_date, lot.buy_date, lot.quantity) for lot in lots),
+        )
+
+    def extend_sold(self, sales, lots=None):
+        """Adds many sales in a single statement and their totals to the rollups."""
+        with self.transaction():
+            self.connection.executemany(
+                f'INSERT INTO sold ({self.SOLD_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((sale.id, sale.bought_id, sale.product_name, sale.sell_price, sale.sell_date, sale.quantity, sale.written_off)
+                 for sale in sales),
+            )
+            self._update_rollups('sold.id = :id', ({'id': sale.id} for sale in sales), 1)
+
+    def read_rollups(self, start_date=None, end_date=None):
+        """
+        Reads the daily totals per product in a date range.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first day.
+        end_date : int, optional
+            The ordinal of the last day.
+
+        Returns:
+        -------
+        list of Rollup
+            The totals per product per day, sorted by day and product.
+        """
+        # Databases migrated before the rollups existed have sales but no totals
+        if self.connection.execute('SELECT EXISTS (SELECT 1 FROM sold) AND NOT EXISTS (SELECT 1 FROM rollups)').fetchone()[0]:
+            with self.transaction():
+                self.rebuild_rollups()
+
+        rows = self.connection.execute(
+            'SELECT day, product_name, revenue, cost, units, profit FROM rollups '
+            'WHERE day BETWEEN ? AND ? ORDER BY day, product_name',
+            (start_date if start_date is not None else 1, end_date if end_date is not None else 2 ** 31),
+        )
+        return [Rollup(*row) for row in rows]
+
+    def rebuild_rollups(self, workers=1):
+        """
+        Rebuilds the rollups from the bought and sold tables. SQLite runs
+        the query itself, so the number of workers is ignored.
+
+        Returns:
+        -------
+        int
+            The number of product and day totals.
+        """
+        with self.transaction():
+            self.connection.execute('DELETE FROM rollups')
+            self.connection.execute(f"""
+                INSERT INTO rollups (day, product_name, revenue, cost, units, profit)
+                SELECT sold.sell_date, sold.product_name, SUM({self.SOLD_UNITS} * sold.sell_price),
+                       SUM(sold.quantity * COALESCE(bought.buy_price, 0)), SUM({self.SOLD_UNITS}),
+                       SUM(COALESCE({self.SOLD_UNITS} * sold.sell_price - sold.quantity * bought.buy_price, 0))
+                FROM sold LEFT JOIN bought ON bought.id = sold.bought_id
+                GROUP BY sold.sell_date, sold.product_name
+                HAVING SUM({self.SOLD_UNITS}) != 0 OR SUM(sold.quantity * COALESCE(bought.buy_price, 0)) != 0
+            """)
+            return self.connection.execute('SELECT COUNT(*) FROM rollups').fetchone()[0]
+
+    def _update_rollups(self, where, parameters, sign):
+        self.connection.executemany(
+            self.ROLLUP_UPSERT.format(where=where),
+            (dict(values, sign=sign) for values in parameters),
+        )
+        if sign < 0:
+            self.connection.execute('DELETE FROM rollups WHERE revenue = 0 AND cost = 0 AND units = 0 AND profit = 0')
+
+    def allocate(self, product_name, current_date, quantity):
+        """
+        Plans which lots to sell units of a product from, first expired
+        first out.
+
+        Parameters:
+        ----------
+        product_name : str
+            The name of the product.
+        current_date : int
+            The ordinal of the current date.
+        quantity : int
+            The number of units to sell.
+
+        Returns:
+        -------
+        list of tuple
+            The (lot, units) portions to sell, or an empty list if there
+            are not enough units in stock.
+        """
+        rows = self.connection.execute(
+            f"""
+            SELECT {self.BOUGHT_COLUMNS}, {self.REMAINING} AS remaining FROM bought
+            WHERE product_name = ? AND expiration_date > ? AND remaining > 0
+            ORDER BY expiration_date, id
+            """,
+            (product_name, current_date),
+        )
+        # Only read as many lots as the units need
+        portions = []
+        for *columns, remaining in rows:
+            units = min(remaining, quantity)
+            portions.append((BoughtLot(*columns), units))
+            quantity -= units
+            if quantity == 0:
+                return portions
         return []
 
-    # Read the data from the 'sold.csv' file
-    with open('sold.csv', 'r') as sold_file:
-        # Create a CSV reader object
-        sold_reader = csv.DictReader(sold_file, delimiter=';')
+    def expiring_lots(self, after_date, until_date):
+        """
+        Finds the lots with units left that expire in a period.
 
-        # Initialize an empty list to store the data
-        sold_data = []
+        Parameters:
+        ----------
+        after_date : int
+            The ordinal of the day before the period.
+        until_date : int
+            The ordinal of the last day of the period.
 
-        # Loop over each row in the 'sold.csv' file
-        for sold_row in sold_reader:
-            # Append the row to the list of data
-            sold_data.append(sold_row)
+        Returns:
+        -------
+        list of tuple
+            (BoughtLot, units left) pairs, ordered by expiration date.
+        """
+        rows = self.connection.execute(
+            f"""
+            SELECT {self.BOUGHT_COLUMNS}, {self.REMAINING} AS remaining FROM bought
+            WHERE expiration_date > ? AND expiration_date <= ? AND remaining > 0
+            ORDER BY expiration_date, id
+            """,
+            (after_date, until_date),
+        )
+        return [(BoughtLot(*columns), remaining) for *columns, remaining in rows]
 
-    return sold_data
+    def compact(self):
+        """
+        Rebuilds the rollups, then rewrites the database file without
+        free pages and refreshes the statistics of the query planner.
 
+        Returns:
+        -------
+        str
+            A summary of what was compacted.
+        """
+        size = os.path.getsize(self.database)
+        rollups = self.rebuild_rollups()
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.connection.execute('VACUUM')
+        self.connection.execute('ANALYZE')
+        return f"Compacted {self.database} from {size} to {os.path.getsize(self.database)} bytes, kept {rollups} daily totals"
 
-def write_bought(bought_data, bought_file):
+    def delete_bought(self, ids):
+        """
+        Deletes the bought lots with the given IDs.
+
+        Parameters:
+        ----------
+        ids : iterable of int
+            The IDs to delete.
+
+        Returns:
+        -------
+        set of int
+            The IDs that were found and deleted.
+        """
+        return self._delete('bought', ids)
+
+    def delete_sold(self, ids):
+        """
+        Deletes the sales with the given IDs.
+
+        Parameters:
+        ----------
+        ids : iterable of int
+            The IDs to delete.
+
+        Returns:
+        -------
+        set of int
+            The IDs that were found and deleted.
+        """
+        return self._delete('sold', ids)
+
+    def _delete(self, table, ids):
+        # The rollups of the sales that are deleted, or whose lot is deleted
+        sales = 'sold.id = :id' if table == 'sold' else 'sold.bought_id = :id'
+        deleted = set()
+        with self.transaction():
+            # Remember the highest ID, in case the last rows are deleted
+            self.connection.execute(
+                f"INSERT INTO sequences (name, last_id) SELECT ?, id FROM {table} WHERE id = (SELECT MAX(id) FROM {table}) "
+                f"ON CONFLICT (name) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)",
+                (table,),
+            )
+            for record_id in set(ids):
+                self._update_rollups(sales, [{'id': record_id}], -1)
+                if self.connection.execute(f'DELETE FROM {table} WHERE id = ?', (record_id,)).rowcount:
+                    deleted.add(record_id)
+                if table == 'bought':
+                    self._update_rollups(sales, [{'id': record_id}], 1)
+        return deleted
+
+    def close(self):
+        """Releases the resources of the backend."""
+        if not self.shared:
+            self.connection.close()
+
+
+class PackedBackend:
+    """
+    Reads the bought and sold data from packed binary files.
+
+    The files hold one fixed-width column per field and are memory-mapped,
+    so commands that only need a few columns or a date range read just
+    those bytes and skip parsing CSV text. The files are written in full
+    by `migrate --to packed`; adding, selling and deleting rows is not
+    supported, convert the data back to CSV for that.
+    """
+
+    name = 'packed'
+
+    def __init__(self, bought_file='bought.spb', sold_file='sold.spb'):
+        self.bought_file = bought_file
+        self.sold_file = sold_file
+
+    def __str__(self):
+        return f"{self.bought_file} and {self.sold_file}"
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Runs the enclosed block, the packed files are never changed in place."""
+        yield self
+
+    def open(self, file_name, record_class):
+        """
+        Memory-maps a packed file.
+
+        Parameters:
+        ----------
+        file_name : str
+            The name of the packed file.
+        record_class : type
+            BoughtLot or Sale.
+
+        Returns:
+        -------
+        PackedFile or None
+            The mapped file, or None if it does not exist.
+        """
+        # Only load the packed format when the packed backend is used
+        from packed import PackedFile
+
+        if not os.path.exists(file_name):
+            return None
+        return PackedFile(file_name, record_class)
+
+    def read_bought(self):
+        """Reads all bought lots."""
+        return list(self.iter_bought())
+
+    def read_sold(self, start_date=None, end_date=None):
+        """Reads the sales, optionally only those between two dates (inclusive)."""
+        return list(self.iter_sold(start_date, end_date))
+
+    def iter_bought(self, start_date=None, end_date=None):
+        """Streams the bought lots, optionally only those bought between two dates (inclusive)."""
+        return metrics.timed_iter('parse', self._iter_records(self.bought_file, BoughtLot, start_date, end_date), 'rows_read')
+
+    def iter_sold(self, start_date=None, end_date=None):
+        """Streams the sales, optionally only those between two dates (inclusive)."""
+        return metrics.timed_iter('parse', self._iter_records(self.sold_file, Sale, start_date, end_date), 'rows_read')
+
+    def _iter_records(self, file_name, record_class, start_date, end_date):
+        packed = self.open(file_name, record_class)
+        if packed is None:
+            return
+        with packed:
+            yield from packed.records(start_date, end_date)
+
+    def write_bought(self, bought_data):
+        """Replaces the packed bought file."""
+        from packed import write_packed
+
+        with atomic_write(self.bought_file, binary=True) as file:
+            write_packed(file, bought_data, BoughtLot)
+
+    def write_sold(self, sold_data):
+        """Replaces the packed sold file."""
+        from packed import write_packed
+
+        with atomic_write(self.sold_file, binary=True) as file:
+            write_packed(file, sold_data, Sale)
+
+    def _read_only(self, *args):
+        raise RuntimeError("The packed backend is read-only, use 'migrate --to csv --from packed' to change the data.")
+
+    next_bought_id = next_sold_id = _read_only
+    append_bought = append_sold = extend_bought = extend_sold = _read_only
+    delete_bought = delete_sold = _read_only
+
+    def read_rollups(self, start_date=None, end_date=None):
+        """
+        Sums the daily totals per product in a date range from the columns.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first day.
+        end_date : int, optional
+            The ordinal of the last day.
+
+        Returns:
+        -------
+        list of Rollup
+            The totals per product per day, sorted by day and product.
+        """
+        from packed import packed_rollups
+
+        sold = self.open(self.sold_file, Sale)
+        if sold is None:
+            return []
+        bought = self.open(self.bought_file, BoughtLot)
+        with sold:
+            rollups = packed_rollups(bought, sold, start_date, end_date)
+        if bought is not None:
+            bought.close()
+        return rollups.rows(start_date, end_date)
+
+    def rebuild_rollups(self, workers=1):
+        """The totals are always summed from the columns, so there is nothing to rebuild."""
+        return len(self.read_rollups())
+
+    def allocate(self, product_name, current_date, quantity):
+        """Plans which lots to sell units of a product from, first expired first out."""
+        inventory = Inventory.from_data(self.iter_bought(), self.iter_sold(), product_name)
+        return inventory.allocate(product_name, current_date, quantity)
+
+    def expiring_lots(self, after_date, until_date):
+        """Finds the lots with units left that expire in a period, ordered by expiration date."""
+        return ExpiryQueue.from_data(self.iter_bought(), self.iter_sold()).expiring(after_date, until_date)
+
+    def compact(self):
+        """The packed files hold no deleted rows or journals, so there is nothing to compact."""
+        return f"{self} are already compact"
+
+    def close(self):
+        """Releases the resources of the backend."""
+
+
+def get_backend(args):
     """
-    Writes the given list of dictionaries to a CSV file with the given filename.
+    Creates the storage backend selected by the command line arguments.
 
     Parameters:
     ----------
-    bought_data : list of dict
-        A list of dictionaries representing the data to be written to the file.
-    bought_file : str
-        The name of the file to which the data should be written.
+    args : argparse.Namespace
+        The parsed command line arguments, optionally containing 'backend',
+        'database', 'bought_file' and 'sold_file'.
 
     Returns:
     -------
-    None
+    CsvBackend, SqliteBackend or PackedBackend
+        The storage backend.
     """
-    with open(bought_file, "w", newline="") as file:
-        writer = csv.writer(file, delimiter=";")
-        writer.writerow(["ID", "PRODUCT_NAME", "BUY_PRICE", "EXPIRATION_DATE", "BUY_DATE"])
-        for row in bought_data:
-            writer.writerow(row.values())
+    if getattr(args, 'backend', 'csv') == 'packed':
+        return PackedBackend(*packed_files(args))
+    if getattr(args, 'backend', 'csv') == 'sqlite':
+        database = getattr(args, 'database', 'superpy.db')
+        if _cache is None:
+            return SqliteBackend(database)
 
+        # Keep one open connection per database while caching
+        key = ('sqlite', os.path.abspath(database))
+        if key not in _cache:
+            _cache[key] = SqliteBackend(database, shared=True)
+        return _cache[key]
+    return CsvBackend(getattr(args, 'bought_file', 'bought.csv'), getattr(args, 'sold_file', 'sold.csv'))
 
-def write_sold(sold_data):
+
+def packed_files(args):
     """
-    Writes the given data to the 'sold.csv' file.
+    Returns the names of the packed files next to the CSV files, e.g.
+    'bought.spb' for 'bought.csv'.
 
     Parameters:
-    -----------
-    sold_data : list of dict
-        The data to write to the 'sold.csv' file as a list
-        of dictionaries, where each dictionary represents
-        a row in the file.
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments, optionally containing
+        'bought_file' and 'sold_file'.
 
     Returns:
     -------
-    None
+    str, str
+        The names of the packed bought and sold files.
+    """
+    bought_file = getattr(args, 'bought_file', 'bought.csv')
+    sold_file = getattr(args, 'sold_file', 'sold.csv')
+    return os.path.splitext(bought_file)[0] + '.spb', os.path.splitext(sold_file)[0] + '.spb'
+
+
+def data_files(args):
+    """
+    Returns the files that hold the data of the selected backend, e.g. to
+    tell from their signatures whether the data changed.
+
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments, optionally containing 'backend',
+        'database', 'bought_file' and 'sold_file'.
+
+    Returns:
+    -------
+    list of str
+        The names of the files, which do not all have to exist.
     """
-    # Open the 'sold.csv' file with write permission and clear it
-    with open('sold.csv', 'w', newline='') as sold_file:
-        # Create a DictWriter object that writes to the 'sold.csv' file,
-        # using the field names from the first row of the data as the headers
-        sold_writer = csv.DictWriter(sold_file, fieldnames=sold_data[0].keys(), delimiter=';')
-        # Write the headers to the 'sold.csv' file
-        sold_writer.writeheader()
-        # Write the data roles to the 'sold.csv' file
-        sold_writer.writerows(sold_data)
+    backend = getattr(args, 'backend', 'csv')
+    if backend == 'packed':
+        return list(packed_files(args))
+    if backend == 'sqlite':
+        # Committed changes can sit in the write-ahead log for a while
+        database = getattr(args, 'database', 'superpy.db')
+        return [database, database + '-wal']
+    files = [getattr(args, 'bought_file', 'bought.csv'), getattr(args, 'sold_file', 'sold.csv')]
+    return files + [tombstone_file(file_name) for file_name in files]
 
 
 def delete_bought(args):
@@ -113,19 +2492,14 @@ def delete_bought(args):
     -------
     None
     """
-    # Read current data from bought_data file
-    bought_data = read_bought(args.bought_file)
+    backend = get_backend(args)
+    with backend.transaction():
+        deleted = backend.delete_bought([args.id])
+    backend.close()
 
-    # Find the bought product with the matching id
-    for index, bought_row in enumerate(bought_data):
-        if int(bought_row['ID']) == args.id:
-            # If a matching product is found, delete the corresponding row
-            del bought_data[index]
-            # Write the updated data back to the file
-            write_bought(bought_data, args.bought_file)
-            # Print confirmation message
-            print(f"Deleted product with id {args.id}")
-            break
+    if deleted:
+        # Print confirmation message
+        print(f"Deleted product with id {args.id}")
     else:
         # If no matching product is found, print an error message
         print(f"No product with id {args.id} found in stock.")
@@ -144,19 +2518,110 @@ def delete_sold(args):
     -------
     None
     """
-    # Read current data from sold_data file
-    sold_data = read_sold()
+    backend = get_backend(args)
+    with backend.transaction():
+        deleted = backend.delete_sold([args.id])
+    backend.close()
 
-    # Find the sold product with the matching id
-    for index, sold_row in enumerate(sold_data):
-        if sold_row['ID'] == args.id:
-            # If a matching product is found, delete the corresponding row
-            del sold_data[index]
-            # Write the updated data back to the file
-            write_sold(sold_data)
-            # Print confirmation message
-            print(f"Deleted product with id {args.id}")
-            break
+    if deleted:
+        # Print confirmation message
+        print(f"Deleted product with id {args.id}")
     else:
         # If no matching product is found, print an error message
         print(f"No product with id {args.id} found in sold products.")
+
+
+def parse_ids(values, last_id=None):
+    """
+    Parses IDs given on the command line.
+
+    Parameters:
+    ----------
+    values : list of str
+        IDs like '7', comma separated lists like '7,9', ranges like
+        '10-20' (inclusive), or '-' to read IDs separated by whitespace
+        or commas from stdin.
+    last_id : int, optional
+        The highest ID of the ledger. Ranges are cut off there, so a
+        range like '1-1000000000' does not create IDs that cannot exist.
+
+    Returns:
+    -------
+    set of int
+        The IDs.
+
+    Raises:
+    ------
+    ValueError:
+        If a value is not an ID or a range of IDs.
+    """
+    ids = set()
+    for value in values:
+        parts = sys.stdin.read().replace(',', ' ').split() if value == '-' else value.split(',')
+        for part in parts:
+            first, _, last = part.strip().partition('-')
+            if last:
+                last = int(last) if last_id is None else min(int(last), last_id)
+                ids.update(range(int(first), last + 1))
+            elif first:
+                ids.add(int(first))
+    return ids
+
+
+def delete(args):
+    """
+    Delete many bought or sold rows at once based on their ids.
+
+    All rows are deleted in one transaction, so the ledger is not
+    rewritten once per row.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Command-line arguments containing the ledger ('bought' or 'sold')
+        and the ids to delete.
+
+    Returns
+    -------
+    None
+    """
+    backend = get_backend(args)
+    last_id = (backend.next_bought_id() if args.ledger == 'bought' else backend.next_sold_id()) - 1
+    try:
+        ids = parse_ids(args.ids, last_id)
+    except ValueError as error:
+        print(f"ERROR: invalid id: {error}")
+        backend.close()
+        return
+
+    with backend.transaction():
+        if args.ledger == 'bought':
+            deleted = backend.delete_bought(ids)
+        else:
+            deleted = backend.delete_sold(ids)
+    backend.close()
+
+    print(f"Deleted {len(deleted)} of {len(ids)} {args.ledger} rows")
+    missing = sorted(ids - deleted)
+    if missing:
+        shown = ", ".join(map(str, missing[:20]))
+        print(f"Not found: {shown}" + (f" and {len(missing) - 20} more" if len(missing) > 20 else ""))
+
+
+def compact(args):
+    """
+    Compacts the data of the selected storage backend.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Command-line arguments, optionally containing the storage backend
+        and the bought and sold files.
+
+    Returns
+    -------
+    None
+    """
+    backend = get_backend(args)
+    print(backend.compact())
+    backend.close()
@@ -0,0 +1,210 @@
+import bisect
+import csv
+import json
+import os
+
+
+class DateIndex:
+    """
+    A sparse index from each date in a ledger file to the byte offset of
+    its first row.
+
+    The index is kept in a sidecar file next to the ledger and brought up
+    to date before every range query. Rows appended since the last update
+    are indexed from where the previous update stopped, so only a rewritten
+    file is scanned from the start again.
+
+    Range queries can only seek when the dates in the file never go back.
+    Setting the date back and adding rows marks the index as unsorted, and
+    queries on the file then fall back to a full scan.
+    """
+
+    VERSION = 1
+    # The number of bytes before the indexed size that must be unchanged
+    # for the index to be extended instead of rebuilt
+    TAIL_SIZE = 64
+
+    def __init__(self, date_field):
+        self.date_field = date_field
+        self.inode = None
+        self.size = 0
+        self.tail = ''
+        self.sorted = True
+        self.dates = []
+        self.offsets = []
+
+    @classmethod
+    def load(cls, index_file, date_field):
+        """
+        Loads an index from its sidecar file.
+
+        Parameters:
+        ----------
+        index_file : str
+            The name of the sidecar file.
+        date_field : str
+            The date column of the ledger, e.g. 'SELL_DATE'.
+
+        Returns:
+        -------
+        DateIndex
+            The stored index, or an empty index if the sidecar file is
+            missing, unreadable or for another column.
+        """
+        index = cls(date_field)
+        try:
+            with open(index_file) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return index
+
+        if data.get('version') != cls.VERSION or data.get('date_field') != date_field:
+            return index
+        index.inode = data['inode']
+        index.size = data['size']
+        index.tail = data['tail']
+        index.sorted = data['sorted']
+        index.dates = data['dates']
+        index.offsets = data['offsets']
+        return index
+
+    def to_dict(self):
+        """
+        Returns the index as a dictionary that can be stored as JSON.
+
+        Returns:
+        -------
+        dict
+            The index data.
+        """
+        return {
+            'version': self.VERSION,
+            'date_field': self.date_field,
+            'inode': self.inode,
+            'size': self.size,
+            'tail': self.tail,
+            'sorted': self.sorted,
+            'dates': self.dates,
+            'offsets': self.offsets,
+        }
+
+    def reset(self):
+        """
+        Empties the index so the next update scans the whole file.
+
+        Returns:
+        -------
+        None
+        """
+        self.inode = None
+        self.size = 0
+        self.tail = ''
+        self.sorted = True
+        self.dates = []
+        self.offsets = []
+
+    def update(self, file_name):
+        """
+        Brings the index up to date with the ledger file.
+
+        Parameters:
+        ----------
+        file_name : str
+            The name of the ledger file.
+
+        Returns:
+        -------
+        bool
+            True if the index changed and should be saved.
+        """
+        stat = os.stat(file_name)
+        with open(file_name, 'rb') as file:
+            # Rebuild the index if the file was replaced, truncated or
+            # changed before the indexed size
+            if stat.st_ino != self.inode or stat.st_size < self.size or self.read_tail(file, self.size) != self.tail:
+                self.reset()
+                self.inode = stat.st_ino
+            elif stat.st_size == self.size:
+                return False
+
+            file.seek(0)
+            header = file.readline()
+            date_index = next(csv.reader([header.decode()], delimiter=';')).index(self.date_field)
+            offset = max(self.size, len(header))
+            file.seek(offset)
+
+            # The byte offsets of the lines the reader took for the current row
+            starts = []
+
+            def complete_lines():
+                nonlocal offset
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        # Leave a row that is still being written for the next update
+                        break
+                    starts.append(offset)
+                    offset += len(line)
+                    yield line.decode()
+
+            last_date = self.dates[-1] if self.dates else None
+            for fields in csv.reader(complete_lines(), delimiter=';'):
+                row_offset = starts[0]
+                starts.clear()
+                if len(fields) > date_index:
+                    date = fields[date_index].strip()
+                    if last_date is None or date > last_date:
+                        self.dates.append(date)
+                        self.offsets.append(row_offset)
+                        last_date = date
+                    elif date < last_date:
+                        self.sorted = False
+
+            self.size = offset
+            self.tail = self.read_tail(file, offset)
+        return True
+
+    @classmethod
+    def read_tail(cls, file, size):
+        """
+        Reads the bytes just before the given size of a file.
+
+        Parameters:
+        ----------
+        file : file object
+            The ledger file, opened in binary mode.
+        size : int
+            The end of the bytes to read.
+
+        Returns:
+        -------
+        str
+            The bytes as a hex string.
+        """
+        start = max(size - cls.TAIL_SIZE, 0)
+        file.seek(start)
+        return file.read(size - start).hex()
+
+    def seek_range(self, start_date, end_date):
+        """
+        Finds the byte offset of the first row in a date range.
+
+        Parameters:
+        ----------
+        start_date : str
+            The first date of the range in 'YYYY-MM-DD' format.
+        end_date : str
+            The last date of the range in 'YYYY-MM-DD' format.
+
+        Returns:
+        -------
+        int or None
+            The offset to start reading from, the indexed size if there
+            are no rows in the range, or None if the file is not sorted
+            by date and has to be scanned in full.
+        """
+        if not self.sorted:
+            return None
+        position = bisect.bisect_left(self.dates, start_date)
+        if position == len(self.dates) or self.dates[position] > end_date:
+            return self.size
+        return self.offsets[position]
@@ -0,0 +1,394 @@
+import bisect
+import heapq
+
+# The largest number of used up lots whose keys are removed from the expiry
+# queue one by one. More are removed by filtering the keys once.
+BISECT_REMOVALS = 1000
+
+
+def sold_quantities(sold_data):
+    """
+    Adds up how many units of each lot were sold.
+
+    Parameters:
+    ----------
+    sold_data : iterable of Sale
+        The sales.
+
+    Returns:
+    -------
+    dict
+        The number of units sold per lot ID.
+    """
+    sold = {}
+    for sale in sold_data:
+        sold[sale.bought_id] = sold.get(sale.bought_id, 0) + sale.quantity
+    return sold
+
+
+class Inventory:
+    """
+    An index of the bought lots with units left, keyed by product name.
+
+    The lots of each product are kept in a heap ordered by expiration
+    date, so the next sellable lot can be found in O(log n) instead of
+    scanning the whole bought file. Selling several units takes them
+    from the lots in first-expired-first-out order.
+    """
+
+    def __init__(self):
+        self._lots = {}
+        # The number of units left of every lot in the heaps
+        self._remaining = {}
+        # Expired lots taken off the heaps, kept in case the date is set back
+        self._expired = []
+        self._expired_until = None
+
+    @classmethod
+    def from_data(cls, bought_data, sold_data, product_name=None):
+        """
+        Builds the inventory from the bought and sold data in a single pass.
+
+        Parameters:
+        ----------
+        bought_data : iterable of BoughtLot
+            The lots of the bought file.
+        sold_data : iterable of Sale
+            The sales of the sold file. The units they sold are taken off
+            the lots referenced by their bought_id.
+        product_name : str, optional
+            Only index lots of this product.
+
+        Returns:
+        -------
+        Inventory
+            The inventory with all lots that have units left.
+        """
+        sold = sold_quantities(sold_data)
+
+        inventory = cls()
+        for lot in bought_data:
+            if product_name is not None and lot.product_name != product_name:
+                continue
+            remaining = lot.quantity - sold.get(lot.id, 0)
+            if remaining > 0:
+                inventory.add(lot, remaining)
+        return inventory
+
+    @classmethod
+    def from_queue(cls, queue, product_name=None):
+        """
+        Builds the inventory from the lots with units left in an expiry queue.
+
+        Parameters:
+        ----------
+        queue : ExpiryQueue
+            The lots with units left.
+        product_name : str, optional
+            Only index lots of this product.
+
+        Returns:
+        -------
+        Inventory
+            The inventory.
+        """
+        inventory = cls()
+        for lot, remaining in queue.items():
+            if product_name is None or lot.product_name == product_name:
+                inventory.add(lot, remaining)
+        return inventory
+
+    def add(self, lot, remaining=None):
+        """
+        Adds a bought lot to the index.
+
+        Parameters:
+        ----------
+        lot : BoughtLot
+            The lot to add.
+        remaining : int, optional
+            The number of units left, all units of the lot by default.
+
+        Returns:
+        -------
+        None
+        """
+        if lot.id in self._remaining:
+            return
+        self._remaining[lot.id] = lot.quantity if remaining is None else remaining
+        lots = self._lots.setdefault(lot.product_name, [])
+        heapq.heappush(lots, (lot.expiration_date, lot.id, lot))
+
+    def remove(self, lot_id, quantity=None):
+        """
+        Takes units of a lot out of the index, e.g. because they were sold
+        elsewhere.
+
+        A lot without units left is only marked as removed and skipped
+        once it reaches the top of its heap, so this is O(1).
+
+        Parameters:
+        ----------
+        lot_id : int
+            The ID of the lot.
+        quantity : int, optional
+            The number of units to take, all of them by default.
+
+        Returns:
+        -------
+        None
+        """
+        if lot_id not in self._remaining:
+            return
+        if quantity is None or quantity >= self._remaining[lot_id]:
+            self._remaining[lot_id] = 0
+        else:
+            self._remaining[lot_id] -= quantity
+
+    def remaining(self, lot_id):
+        """Returns the number of units left of a lot."""
+        return self._remaining.get(lot_id, 0)
+
+    def next_lot(self, product_name, current_date):
+        """
+        Returns the unexpired lot of a product that expires first.
+
+        Lots that have expired on the current date are taken off the
+        heap on the way.
+
+        Parameters:
+        ----------
+        product_name : str
+            The name of the product.
+        current_date : int
+            The ordinal of the current date.
+
+        Returns:
+        -------
+        BoughtLot or None
+            The lot, or None if the product is not in stock.
+        """
+        # Put the expired lots back if the date was set back in time
+        if self._expired_until is not None and current_date < self._expired_until:
+            for entry in self._expired:
+                heapq.heappush(self._lots[entry[2].product_name], entry)
+            self._expired = []
+        self._expired_until = current_date
+
+        lots = self._lots.get(product_name)
+        while lots:
+            expiration_date, lot_id, lot = lots[0]
+            if self._remaining[lot_id] <= 0:
+                heapq.heappop(lots)
+                del self._remaining[lot_id]
+            elif expiration_date <= current_date:
+                self._expired.append(heapq.heappop(lots))
+            else:
+                return lot
+        return None
+
+    def allocate(self, product_name, current_date, quantity, take=True):
+        """
+        Takes units of a product from the lots that expire first.
+
+        The units are taken from the next unexpired lot until it is used
+        up, then from the lot after it, and so on. Either all units are
+        taken or none: if there is not enough stock the index is left
+        unchanged.
+
+        Parameters:
+        ----------
+        product_name : str
+            The name of the product.
+        current_date : int
+            The ordinal of the current date.
+        quantity : int
+            The number of units to take.
+        take : bool
+            Take the units out of the index. Without it the portions are
+            only planned, e.g. when the sales will be applied to the index
+            later with remove().
+
+        Returns:
+        -------
+        list of tuple
+            The (lot, units) portions taken from each lot, in the order
+            they were taken, or an empty list if there is not enough stock.
+        """
+        portions = []
+        # The heap entries of used up lots, put back if the stock runs out
+        taken = []
+        needed = quantity
+        while needed > 0:
+            lot = self.next_lot(product_name, current_date)
+            if lot is None:
+                break
+            units = min(needed, self._remaining[lot.id])
+            portions.append((lot, units))
+            needed -= units
+            if units == self._remaining[lot.id]:
+                taken.append(heapq.heappop(self._lots[product_name]))
+
+        if needed > 0 or not take:
+            for entry in taken:
+                heapq.heappush(self._lots[product_name], entry)
+            return [] if needed > 0 else portions
+
+        for lot, units in portions:
+            self._remaining[lot.id] -= units
+        for _, lot_id, _ in taken:
+            del self._remaining[lot_id]
+        return portions
+
+
+class ExpiryQueue:
+    """
+    The lots of all products with units left, ordered by expiration date.
+
+    Finding the lots that expire in a period is a binary search for its
+    start followed by reading the k lots up to its end, so reports on
+    expiring stock do not scan the whole bought file.
+    """
+
+    def __init__(self):
+        # Sorted (expiration date, lot ID) keys, the lots by ID and the
+        # number of units left of each lot
+        self._keys = []
+        self._lots = {}
+        self._remaining = {}
+
+    @classmethod
+    def from_data(cls, bought_data, sold_data):
+        """
+        Builds the queue from the bought and sold data.
+
+        Parameters:
+        ----------
+        bought_data : iterable of BoughtLot
+            The lots of the bought file.
+        sold_data : iterable of Sale
+            The sales of the sold file. The units they sold are taken off
+            the lots referenced by their bought_id.
+
+        Returns:
+        -------
+        ExpiryQueue
+            The queue with all lots that have units left.
+        """
+        sold = sold_quantities(sold_data)
+        return cls.from_items((lot, lot.quantity - sold.get(lot.id, 0)) for lot in bought_data)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Builds the queue from lots and the number of units left of each.
+
+        Parameters:
+        ----------
+        items : iterable of tuple
+            (BoughtLot, units left) pairs. Lots without units left are
+            skipped.
+
+        Returns:
+        -------
+        ExpiryQueue
+            The queue.
+        """
+        queue = cls()
+        for lot, remaining in items:
+            if remaining > 0 and lot.id not in queue._lots:
+                queue._lots[lot.id] = lot
+                queue._remaining[lot.id] = remaining
+        queue._keys = sorted((lot.expiration_date, lot.id) for lot in queue._lots.values())
+        return queue
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return (self._lots[lot_id] for _, lot_id in self._keys)
+
+    def items(self):
+        """
+        Returns the lots with the number of units left of each.
+
+        Returns:
+        -------
+        iterator of tuple
+            (BoughtLot, units left) pairs, ordered by expiration date.
+        """
+        return ((self._lots[lot_id], self._remaining[lot_id]) for _, lot_id in self._keys)
+
+    def add(self, lots):
+        """
+        Adds bought lots to the queue.
+
+        Parameters:
+        ----------
+        lots : iterable of BoughtLot
+            The lots to add.
+
+        Returns:
+        -------
+        None
+        """
+        for lot in lots:
+            if lot.id not in self._lots:
+                self._lots[lot.id] = lot
+                self._remaining[lot.id] = lot.quantity
+                bisect.insort(self._keys, (lot.expiration_date, lot.id))
+
+    def remove(self, sales):
+        """
+        Takes sold or written off units out of the queue. Lots without
+        units left are removed.
+
+        Parameters:
+        ----------
+        sales : iterable of Sale
+            The sales.
+
+        Returns:
+        -------
+        None
+        """
+        used_up = []
+        for sale in sales:
+            if sale.bought_id in self._remaining:
+                self._remaining[sale.bought_id] -= sale.quantity
+                if self._remaining[sale.bought_id] <= 0:
+                    del self._remaining[sale.bought_id]
+                    used_up.append(self._lots.pop(sale.bought_id))
+
+        if len(used_up) <= BISECT_REMOVALS:
+            # Find the keys of a few lots by bisection
+            for lot in used_up:
+                del self._keys[bisect.bisect_left(self._keys, (lot.expiration_date, lot.id))]
+        else:
+            # Every deletion shifts the rest of the list, so filter many at once
+            self._keys = [key for key in self._keys if key[1] in self._lots]
+
+    def expiring(self, after_date, until_date):
+        """
+        Returns the lots that expire in a period.
+
+        A lot counts as expired on its expiration date, like in
+        Inventory.next_lot.
+
+        Parameters:
+        ----------
+        after_date : int
+            The ordinal of the day before the period.
+        until_date : int
+            The ordinal of the last day of the period.
+
+        Returns:
+        -------
+        list of tuple
+            (BoughtLot, units left) pairs of the lots with
+            after_date < expiration date <= until_date, ordered by
+            expiration date and ID.
+        """
+        start = bisect.bisect_right(self._keys, (after_date, float('inf')))
+        end = bisect.bisect_right(self._keys, (until_date, float('inf')))
+        return [(self._lots[lot_id], self._remaining[lot_id]) for _, lot_id in self._keys[start:end]]
@@ -0,0 +1,197 @@
+import contextlib
+import json
+import sys
+import time
+
+# Metrics are only collected after enable(), so commands pay nothing for
+# them by default
+enabled = False
+
+# The number of calls and the seconds spent in each stage, by stage name
+_stages = {}
+# Counters such as the number of rows read, by name
+_counters = {}
+_start = None
+
+
+def enable():
+    """
+    Starts collecting metrics and forgets the metrics collected before.
+
+    Returns:
+    -------
+    None
+    """
+    global enabled, _start
+    enabled = True
+    _stages.clear()
+    _counters.clear()
+    _start = time.perf_counter()
+
+
+def disable():
+    """Stops collecting metrics."""
+    global enabled
+    enabled = False
+
+
+def add_time(name, seconds, calls=1):
+    """Adds time to a stage."""
+    totals = _stages.setdefault(name, [0, 0.0])
+    totals[0] += calls
+    totals[1] += seconds
+
+
+def count(name, amount=1):
+    """
+    Adds to a counter.
+
+    Parameters:
+    ----------
+    name : str
+        The name of the counter, e.g. 'rows_read'.
+    amount : int
+        The amount to add.
+
+    Returns:
+    -------
+    None
+    """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the enclosed block as a stage.
+
+    Nested stages are timed separately, so the time of an outer stage
+    includes the time of the stages inside it.
+
+    Parameters:
+    ----------
+    name : str
+        The name of the stage, e.g. 'render'.
+
+    Yields:
+    ------
+    None
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def timed_iter(name, iterable, counter=None):
+    """
+    Times the work done to produce each item of an iterable as a stage.
+
+    Only the time spent inside the iterable is counted, not the time the
+    caller spends on each item.
+
+    Parameters:
+    ----------
+    name : str
+        The name of the stage, e.g. 'parse'.
+    iterable : iterable
+        The items, usually a generator that reads a file.
+    counter : str, optional
+        A counter to add the number of items to.
+
+    Returns:
+    -------
+    iterable
+        The same items.
+    """
+    if not enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable), counter)
+
+
+def _timed_iter(name, iterator, counter):
+    clock = time.perf_counter
+    seconds = 0.0
+    items = 0
+    try:
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                seconds += clock() - start
+                return
+            seconds += clock() - start
+            items += 1
+            yield item
+    finally:
+        add_time(name, seconds)
+        if counter is not None:
+            count(counter, items)
+
+
+def snapshot():
+    """
+    Returns the metrics collected since enable().
+
+    Returns:
+    -------
+    dict
+        The total seconds, the calls and seconds of every stage and the
+        counters.
+    """
+    return {
+        'total_seconds': round(time.perf_counter() - _start, 6) if _start is not None else 0.0,
+        'stages': {name: {'calls': calls, 'seconds': round(seconds, 6)} for name, (calls, seconds) in sorted(_stages.items())},
+        'counters': dict(sorted(_counters.items())),
+    }
+
+
+def print_report(file=None):
+    """
+    Prints the time of every stage and the counters as a table.
+
+    Parameters:
+    ----------
+    file : file object, optional
+        The file to print to, stderr by default so the output of the
+        command is unchanged.
+
+    Returns:
+    -------
+    None
+    """
+    file = file or sys.stderr
+    metrics = snapshot()
+    total = metrics['total_seconds']
+    print(f"{'Stage':<16}{'Calls':>8}{'Time (ms)':>12}{'Share':>8}", file=file)
+    for name, values in sorted(metrics['stages'].items(), key=lambda item: -item[1]['seconds']):
+        share = values['seconds'] / total if total else 0
+        print(f"{name:<16}{values['calls']:>8}{values['seconds'] * 1000:>12.1f}{share:>8.0%}", file=file)
+    print(f"{'total':<16}{'':>8}{total * 1000:>12.1f}", file=file)
+    for name, value in metrics['counters'].items():
+        print(f"{name:<16}{value:>8}", file=file)
+
+
+def write_json(command, file=None):
+    """
+    Prints the metrics as a single line of JSON, so they can be picked
+    out of a log.
+
+    Parameters:
+    ----------
+    command : str
+        The name of the command that ran.
+    file : file object, optional
+        The file to print to, stderr by default.
+
+    Returns:
+    -------
+    None
+    """
+    print(json.dumps({'command': command, **snapshot()}, separators=(',', ':')), file=file or sys.stderr)
@@ -0,0 +1,85 @@
+import csv
+import itertools
+import json
+import os
+import sys
+
+import metrics
+
+# The formats the list and revenue commands can print. Only 'table' holds
+# all rows in memory, the others write every row as soon as it is made.
+FORMATS = ['table', 'csv', 'tsv', 'jsonl']
+
+
+def page(rows, limit=None, offset=0):
+    """
+    Skips the first rows and stops after a number of rows.
+
+    Parameters:
+    ----------
+    rows : iterable
+        The rows, usually a generator.
+    limit : int, optional
+        The largest number of rows to keep. Default is all.
+    offset : int
+        The number of rows to skip first.
+
+    Returns:
+    -------
+    iterator
+        The rows on the page.
+    """
+    offset = offset or 0
+    return itertools.islice(rows, offset, None if limit is None else offset + limit)
+
+
+def write_rows(columns, rows, output_format='table', file=None):
+    """
+    Writes rows in one of the output formats.
+
+    The csv, tsv and jsonl formats stream the rows to the file, so memory
+    use does not grow with the number of rows and the output can be piped
+    into other tools. The table format collects the rows into a
+    PrettyTable first, and is meant for short, interactive output.
+
+    Parameters:
+    ----------
+    columns : list of str
+        The names of the columns, used for the header and the JSON keys.
+    rows : iterable of sequence
+        The values of each row. None is written as an empty field in CSV
+        and as null in JSON.
+    output_format : str
+        One of FORMATS.
+    file : file object, optional
+        The file to write to, stdout by default.
+
+    Returns:
+    -------
+    None
+    """
+    file = file or sys.stdout
+    with metrics.stage('render'):
+        try:
+            if output_format in ('csv', 'tsv'):
+                writer = csv.writer(file, delimiter=',' if output_format == 'csv' else '\t', lineterminator='\n')
+                writer.writerow(columns)
+                writer.writerows(rows)
+            elif output_format == 'jsonl':
+                encode = json.JSONEncoder(separators=(',', ':')).encode
+                file.writelines(encode(dict(zip(columns, row))) + '\n' for row in rows)
+            else:
+                from prettytable import PrettyTable
+
+                table = PrettyTable()
+                table.field_names = columns
+                for row in rows:
+                    table.add_row(['' if value is None else value for value in row])
+                print(table, file=file)
+            file.flush()
+        except BrokenPipeError:
+            # The reader stopped early, e.g. `| head`. Send what is left of
+            # the output to /dev/null so closing stdout does not fail again
+            if file is sys.stdout:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
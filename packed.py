@@ -0,0 +1,248 @@
+import array
+import bisect
+import mmap
+import operator
+import struct
+
+from records import BoughtLot, Sale
+from rollups import Rollup, Rollups, sale_totals
+
+
+# The file starts with the magic bytes, the format version, whether the
+# rows are sorted by date, the number of rows and the size of the product
+# dictionary in bytes
+MAGIC = b'SPYP'
+VERSION = 3
+HEADER = struct.Struct('<4sHHqq')
+
+# The columns of each ledger with their array typecodes. Every column is
+# stored as one contiguous block, so reading a column never touches the
+# bytes of the others.
+COLUMNS = {
+    BoughtLot: [('id', 'q'), ('product_name', 'i'), ('buy_price', 'q'), ('expiration_date', 'i'), ('buy_date', 'i'),
+                ('quantity', 'i')],
+    Sale: [('id', 'q'), ('bought_id', 'q'), ('product_name', 'i'), ('sell_price', 'q'), ('sell_date', 'i'),
+           ('quantity', 'i'), ('written_off', 'b')],
+}
+
+# The column the rows of each ledger are sorted on when possible
+DATE_COLUMNS = {BoughtLot: 'buy_date', Sale: 'sell_date'}
+
+# Sales without a lot are stored with this bought ID
+NO_LOT = -1
+
+
+def padding(size):
+    """Returns the number of bytes that align a block of the given size to 8 bytes."""
+    return -size % 8
+
+
+def write_packed(file, records, record_class):
+    """
+    Writes records to a packed file.
+
+    Product names are dictionary-encoded: each distinct name is stored once
+    and the rows only hold its number in the dictionary.
+
+    Parameters:
+    ----------
+    file : file object
+        The file to write to, opened in binary mode.
+    records : list of BoughtLot or Sale
+        The records to write.
+    record_class : type
+        BoughtLot or Sale.
+
+    Returns:
+    -------
+    None
+    """
+    date_column = DATE_COLUMNS[record_class]
+    dates = [getattr(record, date_column) for record in records]
+    is_sorted = all(previous <= date for previous, date in zip(dates, dates[1:]))
+
+    products = {}
+    for record in records:
+        products.setdefault(record.product_name, len(products))
+    dictionary = '\n'.join(products).encode()
+
+    file.write(HEADER.pack(MAGIC, VERSION, is_sorted, len(records), len(dictionary)))
+    file.write(dictionary + bytes(padding(len(dictionary))))
+    for name, typecode in COLUMNS[record_class]:
+        if name == 'product_name':
+            values = (products[record.product_name] for record in records)
+        elif name == 'bought_id':
+            values = (NO_LOT if record.bought_id is None else record.bought_id for record in records)
+        else:
+            values = (getattr(record, name) for record in records)
+        block = array.array(typecode, values).tobytes()
+        file.write(block + bytes(padding(len(block))))
+
+
+class PackedFile:
+    """
+    A packed ledger file, memory-mapped for reading.
+
+    The columns are memoryviews on the mapped file, so only the pages of
+    the columns and rows that are actually read are loaded from disk, and
+    no Python objects are created for rows that are skipped.
+    """
+
+    def __init__(self, file_name, record_class):
+        self.record_class = record_class
+        with open(file_name, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, is_sorted, rows, dictionary_size = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{file_name} is not a packed ledger of version {VERSION}")
+        self.sorted = bool(is_sorted)
+        self.rows = rows
+
+        offset = HEADER.size
+        dictionary = self._map[offset:offset + dictionary_size].decode()
+        self.products = dictionary.split('\n') if rows else []
+        offset += dictionary_size + padding(dictionary_size)
+
+        self.columns = {}
+        view = memoryview(self._map)
+        for name, typecode in COLUMNS[record_class]:
+            size = rows * array.array(typecode).itemsize
+            self.columns[name] = view[offset:offset + size].cast(typecode)
+            offset += size + padding(size)
+        view.release()
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def date_range(self, start_date=None, end_date=None):
+        """
+        Finds the rows of a date range.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first date.
+        end_date : int, optional
+            The ordinal of the last date.
+
+        Returns:
+        -------
+        range
+            The row numbers to read. Without sorted dates this is every
+            row, and the dates of the rows still have to be checked.
+        """
+        if not self.sorted or (start_date is None and end_date is None):
+            return range(self.rows)
+        dates = self.columns[DATE_COLUMNS[self.record_class]]
+        start = 0 if start_date is None else bisect.bisect_left(dates, start_date)
+        end = self.rows if end_date is None else bisect.bisect_right(dates, end_date)
+        return range(start, end)
+
+    def records(self, start_date=None, end_date=None):
+        """
+        Yields the records of a date range.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first date.
+        end_date : int, optional
+            The ordinal of the last date.
+
+        Yields:
+        ------
+        BoughtLot or Sale
+            The records in file order.
+        """
+        rows = self.date_range(start_date, end_date)
+        start_date = start_date if start_date is not None else 1
+        end_date = end_date if end_date is not None else float('inf')
+        columns = [self.columns[name][rows.start:rows.stop] for name, _ in COLUMNS[self.record_class]]
+        date_position = [name for name, _ in COLUMNS[self.record_class]].index(DATE_COLUMNS[self.record_class])
+        products = self.products
+        record_class = self.record_class
+
+        try:
+            for values in zip(*columns):
+                if not start_date <= values[date_position] <= end_date:
+                    continue
+                if record_class is Sale:
+                    id, bought_id, product, price, date, quantity, written_off = values
+                    yield Sale(id, None if bought_id == NO_LOT else bought_id, products[product], price, date, quantity,
+                               written_off)
+                else:
+                    id, product, price, expiration_date, buy_date, quantity = values
+                    yield BoughtLot(id, products[product], price, expiration_date, buy_date, quantity)
+        finally:
+            # The file can only be unmapped once every view on it is released
+            for column in columns:
+                column.release()
+
+    def close(self):
+        """Releases the columns and unmaps the file."""
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        self._map.close()
+
+
+def packed_rollups(bought, sold, start_date=None, end_date=None):
+    """
+    Sums the sales of a date range per product and day from the columns.
+
+    Only the ID and price columns of the bought file and the bought ID,
+    product, price, date, quantity and written off columns of the sold
+    file are read.
+
+    Parameters:
+    ----------
+    bought : PackedFile or None
+        The packed bought file, used for the cost of each sale.
+    sold : PackedFile
+        The packed sold file.
+    start_date : int, optional
+        The ordinal of the first day.
+    end_date : int, optional
+        The ordinal of the last day.
+
+    Returns:
+    -------
+    Rollups
+        The totals per product per day.
+    """
+    buy_prices = {}
+    if bought is not None:
+        for lot_id, price in zip(bought.columns['id'], bought.columns['buy_price']):
+            buy_prices.setdefault(lot_id, price)
+
+    rows = sold.date_range(start_date, end_date)
+    start_date = start_date if start_date is not None else 1
+    end_date = end_date if end_date is not None else float('inf')
+    names = ('bought_id', 'product_name', 'sell_price', 'sell_date', 'quantity', 'written_off')
+    columns = [sold.columns[name][rows.start:rows.stop] for name in names]
+
+    # Sum with plain tuples keyed on the product number, and only create
+    # rollups for the groups at the end
+    totals = {}
+    for bought_id, product, price, date, quantity, written_off in zip(*columns):
+        if not start_date <= date <= end_date:
+            continue
+        key = (date, product)
+        sale = sale_totals(quantity, price, buy_prices.get(bought_id), written_off)
+        group = totals.get(key)
+        totals[key] = sale if group is None else tuple(map(operator.add, group, sale))
+    for column in columns:
+        column.release()
+
+    rollups = Rollups()
+    for (date, product), values in totals.items():
+        rollups.add(Rollup(date, sold.products[product], *values))
+    return rollups
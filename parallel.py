@@ -0,0 +1,214 @@
+import concurrent.futures
+import csv
+import io
+import multiprocessing
+import operator
+import os
+
+from records import OPTIONAL_FIELDS, format_date, parse_date, to_cents
+from rollups import Rollup, Rollups, sale_totals
+
+
+# Files smaller than this per worker are not worth splitting
+MIN_CHUNK_SIZE = 1 << 20
+
+# The buy price of each lot, set in every worker process by _set_buy_prices
+_buy_prices = {}
+
+
+def chunk_ranges(file_name, chunks, start_offset=None):
+    """
+    Splits a ledger file into byte ranges that start and end on row
+    boundaries.
+
+    Parameters:
+    ----------
+    file_name : str
+        The name of the ledger file.
+    chunks : int
+        The number of ranges to split the file into at most.
+    start_offset : int, optional
+        The offset of the first row to include, e.g. from the date
+        index. Default is the row after the header.
+
+    Returns:
+    -------
+    list of tuple
+        The (start, end) offsets of the ranges, in file order.
+    """
+    size = os.path.getsize(file_name)
+    with open(file_name, 'rb') as file:
+        first = max(len(file.readline()), start_offset or 0)
+        chunks = max(1, min(chunks, (size - first) // MIN_CHUNK_SIZE))
+
+        bounds = [first]
+        for chunk in range(1, chunks):
+            # Move each boundary forward to the start of the next row
+            file.seek(first + (size - first) * chunk // chunks - 1)
+            file.readline()
+            bounds.append(max(file.tell(), bounds[-1]))
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def read_chunk(file_name, start, end):
+    """Reads the rows in a byte range of a ledger file."""
+    with open(file_name, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start).decode()
+    return csv.reader(io.StringIO(data, newline=''), delimiter=';')
+
+
+def read_header(file_name):
+    """Reads the column names of a ledger file."""
+    with open(file_name, newline='') as file:
+        return next(csv.reader(file, delimiter=';'), [])
+
+
+def _read_buy_prices(file_name, start, end, header, deleted):
+    """Returns the buy price in cents of each lot in a byte range."""
+    id_index, price_index = header.index('ID'), header.index('BUY_PRICE')
+    prices = {}
+    for row in read_chunk(file_name, start, end):
+        if row:
+            lot_id = int(row[id_index])
+            if lot_id not in deleted:
+                prices.setdefault(lot_id, to_cents(row[price_index]))
+    return prices
+
+
+def _set_buy_prices(buy_prices):
+    global _buy_prices
+    _buy_prices = buy_prices
+
+
+def _sum_sales(file_name, start, end, header, first_day, last_day, deleted):
+    """
+    Sums the sales in a byte range per day and product.
+
+    Returns:
+    -------
+    dict
+        The revenue, cost, units and profit in cents for each
+        ('YYYY-MM-DD', product name) pair.
+    """
+    id_index, bought_index = header.index('ID'), header.index('BOUGHT_ID')
+    product_index, price_index, date_index = header.index('PRODUCT_NAME'), header.index('SELL_PRICE'), header.index('SELL_DATE')
+    # Files written before sales had a quantity hold one unit per row
+    quantity_index = header.index('QUANTITY') if 'QUANTITY' in header else None
+    default_quantity = int(OPTIONAL_FIELDS['QUANTITY'])
+    written_off_index = header.index('WRITTEN_OFF') if 'WRITTEN_OFF' in header else None
+    buy_prices = _buy_prices
+
+    totals = {}
+    for row in read_chunk(file_name, start, end):
+        if not row:
+            continue
+        date = row[date_index]
+        if not first_day <= date <= last_day or (deleted and int(row[id_index]) in deleted):
+            continue
+        quantity = int(row[quantity_index]) if quantity_index is not None else default_quantity
+        written_off = written_off_index is not None and row[written_off_index] not in ('', '0')
+        cost = buy_prices.get(int(row[bought_index])) if row[bought_index] else None
+        key = (date, row[product_index])
+        sale = sale_totals(quantity, to_cents(row[price_index]), cost, written_off)
+        group = totals.get(key)
+        totals[key] = sale if group is None else tuple(map(operator.add, group, sale))
+    return totals
+
+
+def executor(workers, buy_prices=None):
+    """
+    Creates a process pool whose workers know the buy price of each lot.
+
+    Where possible the workers are forked, so they share the prices with
+    this process instead of receiving a pickled copy each.
+
+    Parameters:
+    ----------
+    workers : int
+        The number of worker processes.
+    buy_prices : dict, optional
+        The buy price in cents of each lot ID.
+
+    Returns:
+    -------
+    concurrent.futures.ProcessPoolExecutor
+        The process pool.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=context, initializer=_set_buy_prices, initargs=(buy_prices or {},),
+    )
+
+
+def ledger_rollups(bought_file, sold_file, workers, start_date=None, end_date=None, with_cost=True,
+                   bought_deleted=frozenset(), sold_deleted=frozenset(), sold_offset=None):
+    """
+    Sums the sales per product and day in parallel processes.
+
+    Both files are split into byte ranges of whole rows. The buy prices
+    are read from the bought file first, one range per worker, and
+    merged. Then each worker sums the sales in its range of the sold
+    file, and the partial totals are added up here. The result is the
+    same as Rollups.from_data on the whole files.
+
+    Parameters:
+    ----------
+    bought_file : str
+        The name of the bought file.
+    sold_file : str
+        The name of the sold file.
+    workers : int
+        The number of worker processes.
+    start_date : int, optional
+        The ordinal of the first day.
+    end_date : int, optional
+        The ordinal of the last day.
+    with_cost : bool
+        Read the buy prices for the cost and profit. Without them only
+        the revenue and units are summed.
+    bought_deleted : set of int
+        The IDs of deleted lots.
+    sold_deleted : set of int
+        The IDs of deleted sales.
+    sold_offset : int, optional
+        The offset of the first sale in the date range, from the date
+        index of the sold file.
+
+    Returns:
+    -------
+    Rollups
+        The totals per product per day.
+    """
+    first_day = format_date(start_date) if start_date is not None else ''
+    last_day = format_date(end_date) if end_date is not None else '\uffff'
+
+    buy_prices = {}
+    if with_cost and os.path.exists(bought_file):
+        header = read_header(bought_file)
+        with executor(workers) as pool:
+            futures = [
+                pool.submit(_read_buy_prices, bought_file, start, end, header, bought_deleted)
+                for start, end in chunk_ranges(bought_file, workers)
+            ]
+            parts = [future.result() for future in futures]
+        # The first lot with an ID wins, so merge the later ranges first
+        for part in reversed(parts):
+            buy_prices.update(part)
+
+    rollups = Rollups()
+    if not os.path.exists(sold_file):
+        return rollups
+
+    header = read_header(sold_file)
+    with executor(workers, buy_prices) as pool:
+        futures = [
+            pool.submit(_sum_sales, sold_file, start, end, header, first_day, last_day, sold_deleted)
+            for start, end in chunk_ranges(sold_file, workers, sold_offset)
+        ]
+        for future in futures:
+            for (date, product_name), totals in future.result().items():
+                rollups.add(Rollup(parse_date(date), product_name, *totals))
+    return rollups
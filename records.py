@@ -0,0 +1,225 @@
+import datetime
+import functools
+import operator
+
+# Columns that were added later and may be missing from older files, with
+# the value to use for them. They always come last in FIELDS.
+OPTIONAL_FIELDS = {'QUANTITY': '1', 'WRITTEN_OFF': '0'}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_date(date_str):
+    """
+    Converts a 'YYYY-MM-DD' string to a date ordinal.
+
+    Ledgers repeat the same dates over and over, so parsed dates are cached.
+
+    Parameters:
+    ----------
+    date_str : str
+        The date in 'YYYY-MM-DD' format.
+
+    Returns:
+    -------
+    int
+        The proleptic Gregorian ordinal of the date.
+    """
+    return datetime.date.fromisoformat(date_str).toordinal()
+
+
+@functools.lru_cache(maxsize=None)
+def format_date(ordinal):
+    """
+    Converts a date ordinal back to a 'YYYY-MM-DD' string.
+
+    Parameters:
+    ----------
+    ordinal : int
+        The proleptic Gregorian ordinal of the date.
+
+    Returns:
+    -------
+    str
+        The date in 'YYYY-MM-DD' format.
+    """
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+
+def to_cents(price):
+    """
+    Converts a price to an integer number of cents.
+
+    Parameters:
+    ----------
+    price : str or float
+        The price, e.g. '0.50' or 0.5.
+
+    Returns:
+    -------
+    int
+        The price in cents.
+    """
+    return round(float(price) * 100)
+
+
+def format_cents(cents):
+    """
+    Formats an integer number of cents as a price string.
+
+    Parameters:
+    ----------
+    cents : int
+        The price in cents.
+
+    Returns:
+    -------
+    str
+        The price with two decimals, e.g. '0.50'.
+    """
+    sign = '-' if cents < 0 else ''
+    whole, fraction = divmod(abs(cents), 100)
+    return f'{sign}{whole}.{fraction:02d}'
+
+
+def field_getter(header, record_class):
+    """
+    Creates a function that picks the fields of a record from a row.
+
+    The columns are picked by name, so the column order in the file does
+    not matter. Optional columns that are missing from the header are left
+    out, and the record class fills in their default.
+
+    Parameters:
+    ----------
+    header : list of str
+        The column names of the file.
+    record_class : type
+        BoughtLot or Sale.
+
+    Returns:
+    -------
+    callable
+        A function from a row to the fields in the order of FIELDS.
+
+    Raises:
+    ------
+    ValueError:
+        If a required column is missing.
+    """
+    fields = [field for field in record_class.FIELDS if field in header or field not in OPTIONAL_FIELDS]
+    return operator.itemgetter(*[header.index(field) for field in fields])
+
+
+class BoughtLot:
+    """
+    A lot of a product that was bought, as stored in the bought file.
+
+    Dates are stored as ordinals and prices as integer cents, so they are
+    parsed once when the file is loaded and never again. The buy price is
+    the price of one unit.
+    """
+
+    __slots__ = ('id', 'product_name', 'buy_price', 'expiration_date', 'buy_date', 'quantity')
+
+    FIELDS = ['ID', 'PRODUCT_NAME', 'BUY_PRICE', 'EXPIRATION_DATE', 'BUY_DATE', 'QUANTITY']
+
+    def __init__(self, id, product_name, buy_price, expiration_date, buy_date, quantity=1):
+        self.id = id
+        self.product_name = product_name
+        self.buy_price = buy_price
+        self.expiration_date = expiration_date
+        self.buy_date = buy_date
+        self.quantity = quantity
+
+    @classmethod
+    def from_fields(cls, id, product_name, buy_price, expiration_date, buy_date, quantity='1'):
+        """
+        Creates a lot from the string fields of a row in the bought file.
+
+        Returns:
+        -------
+        BoughtLot
+            The parsed lot.
+        """
+        return cls(int(id), product_name, to_cents(buy_price), parse_date(expiration_date), parse_date(buy_date),
+                   int(quantity or 1))
+
+    def to_fields(self):
+        """
+        Returns the fields of the lot as they are written to the bought file.
+
+        Returns:
+        -------
+        list of str
+            The fields in the order of FIELDS.
+        """
+        return [
+            str(self.id),
+            self.product_name,
+            format_cents(self.buy_price),
+            format_date(self.expiration_date),
+            format_date(self.buy_date),
+            str(self.quantity),
+        ]
+
+    def __repr__(self):
+        return f'BoughtLot({", ".join(self.to_fields())})'
+
+
+class Sale:
+    """
+    A sale of units of a bought lot, as stored in the sold file.
+
+    The bought_id is None for sales that were recorded without a lot. The
+    sell price is the price of one unit. Written off sales record expired
+    units that were thrown away: they take the units out of stock, but
+    are not counted as sold or as revenue.
+    """
+
+    __slots__ = ('id', 'bought_id', 'product_name', 'sell_price', 'sell_date', 'quantity', 'written_off')
+
+    FIELDS = ['ID', 'BOUGHT_ID', 'PRODUCT_NAME', 'SELL_PRICE', 'SELL_DATE', 'QUANTITY', 'WRITTEN_OFF']
+
+    def __init__(self, id, bought_id, product_name, sell_price, sell_date, quantity=1, written_off=False):
+        self.id = id
+        self.bought_id = bought_id
+        self.product_name = product_name
+        self.sell_price = sell_price
+        self.sell_date = sell_date
+        self.quantity = quantity
+        self.written_off = bool(written_off)
+
+    @classmethod
+    def from_fields(cls, id, bought_id, product_name, sell_price, sell_date, quantity='1', written_off='0'):
+        """
+        Creates a sale from the string fields of a row in the sold file.
+
+        Returns:
+        -------
+        Sale
+            The parsed sale.
+        """
+        return cls(int(id), int(bought_id) if bought_id else None, product_name, to_cents(sell_price), parse_date(sell_date),
+                   int(quantity or 1), written_off not in ('', '0'))
+
+    def to_fields(self):
+        """
+        Returns the fields of the sale as they are written to the sold file.
+
+        Returns:
+        -------
+        list of str
+            The fields in the order of FIELDS.
+        """
+        return [
+            str(self.id),
+            '' if self.bought_id is None else str(self.bought_id),
+            self.product_name,
+            format_cents(self.sell_price),
+            format_date(self.sell_date),
+            str(self.quantity),
+            '1' if self.written_off else '0',
+        ]
+
+    def __repr__(self):
+        return f'Sale({", ".join(self.to_fields())})'
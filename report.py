@@ -0,0 +1,189 @@
+import datetime
+import heapq
+
+from records import format_cents, format_date
+from rollups import sale_totals
+
+# The fields a report can be grouped by. The periods group the sales by
+# the day they were sold, or by the first day of its week or month.
+GROUPS = ['product', 'day', 'week', 'month']
+PERIODS = ['day', 'week', 'month']
+
+# The totals of every group, in report order
+METRICS = ['revenue', 'cost', 'profit', 'units', 'spoiled', 'spoilage', 'margin']
+
+# The position of each total in the lists that are summed. The revenue of
+# the sales with a lot is only used for the margin, and is not shown.
+REVENUE, COST, PROFIT, UNITS, SPOILED, SPOILAGE, COSTED_REVENUE = range(7)
+
+
+def period_start(day, period):
+    """
+    Returns the first day of the period a day falls in.
+
+    Parameters:
+    ----------
+    day : int
+        The ordinal of the day.
+    period : str
+        'day', 'week' or 'month'. Weeks start on Monday.
+
+    Returns:
+    -------
+    int
+        The ordinal of the first day of the period.
+    """
+    if period == 'day':
+        return day
+    date = datetime.date.fromordinal(day)
+    if period == 'week':
+        return day - date.weekday()
+    return date.replace(day=1).toordinal()
+
+
+def aggregate(bought_data, sold_data, group_by):
+    """
+    Sums the sales per group in a single pass.
+
+    The buy prices are indexed first. Then every sale is joined to the
+    price of its lot and added to the totals of its group in a
+    dictionary, so the work grows with the number of sales and the
+    memory with the number of lots and groups.
+
+    Written off units of expired products count as spoiled instead of
+    sold, and their cost as spoilage. The cost and profit include the
+    write-offs, like the profit of the other commands. Sales without a lot
+    only count towards revenue and units, so they have no cost and no
+    profit, and are left out of the margin.
+
+    Parameters:
+    ----------
+    bought_data : iterable of BoughtLot
+        The bought lots.
+    sold_data : iterable of Sale
+        The sales to report on.
+    group_by : list of str
+        The fields to group by, from GROUPS. Without fields there is a
+        single group with the totals of all sales.
+
+    Returns:
+    -------
+    dict
+        The revenue, cost, profit, units, spoiled units, spoilage and
+        revenue of the sales with a lot in cents, as a list per group
+        key. A key holds the product name and the ordinal of the first
+        day of the period, in the order of group_by.
+    """
+    buy_prices = {}
+    for lot in bought_data:
+        buy_prices.setdefault(lot.id, lot.buy_price)
+
+    period = next((field for field in group_by if field in PERIODS), None)
+    starts = {}
+    totals = {}
+    for sale in sold_data:
+        if period is not None:
+            # Many sales share a day, so look the start of its period up once
+            start = starts.get(sale.sell_date)
+            if start is None:
+                start = starts[sale.sell_date] = period_start(sale.sell_date, period)
+        key = tuple(sale.product_name if field == 'product' else start for field in group_by)
+
+        group = totals.get(key)
+        if group is None:
+            group = totals[key] = [0, 0, 0, 0, 0, 0, 0]
+        buy_price = buy_prices.get(sale.bought_id)
+        revenue, cost, units, profit = sale_totals(sale.quantity, sale.sell_price, buy_price, sale.written_off)
+        group[REVENUE] += revenue
+        group[COST] += cost
+        group[PROFIT] += profit
+        group[UNITS] += units
+        if sale.written_off:
+            group[SPOILED] += sale.quantity
+            group[SPOILAGE] += cost
+        elif buy_price is not None:
+            group[COSTED_REVENUE] += revenue
+    return totals
+
+
+def margin(totals):
+    """
+    Returns the profit as a fraction of the revenue of the sales with a lot,
+    or None without such revenue. Sales without a lot have no known cost,
+    so counting their revenue would make the margin look higher.
+    """
+    return totals[PROFIT] / totals[COSTED_REVENUE] if totals[COSTED_REVENUE] else None
+
+
+def ranked(totals, sort='revenue', top=None):
+    """
+    Orders the groups of a report.
+
+    Parameters:
+    ----------
+    totals : dict
+        The totals per group key, from aggregate.
+    sort : str
+        A metric to sort on, highest first, or 'group' to sort on the
+        group key.
+    top : int, optional
+        Only return this many groups. They are picked with a heap, so the
+        other groups are never sorted.
+
+    Returns:
+    -------
+    list of tuple
+        The (key, totals) pairs.
+    """
+    if sort == 'group':
+        items = sorted(totals.items())
+        return items if top is None else items[:top]
+
+    if sort == 'margin':
+        # Groups without revenue from sales with a lot have no margin and come last
+        def sort_key(item):
+            value = margin(item[1])
+            return (value is not None, value or 0)
+    else:
+        index = METRICS.index(sort)
+
+        def sort_key(item):
+            return item[1][index]
+    if top is None:
+        return sorted(totals.items(), key=sort_key, reverse=True)
+    return heapq.nlargest(top, totals.items(), key=sort_key)
+
+
+def report_rows(items, group_by, for_table=True):
+    """
+    Formats the groups of a report as rows.
+
+    Parameters:
+    ----------
+    items : iterable of tuple
+        The (key, totals) pairs, from ranked.
+    group_by : list of str
+        The fields the report is grouped by.
+    for_table : bool
+        Show the margin as a percentage instead of a fraction.
+
+    Yields:
+    ------
+    list
+        The group fields followed by the metrics. Money is formatted as
+        decimal strings.
+    """
+    for key, totals in items:
+        fields = [value if field == 'product' else format_date(value) for field, value in zip(group_by, key)]
+        share = margin(totals)
+        if share is not None:
+            share = f"{share:.1%}" if for_table else round(share, 4)
+        yield fields + [
+            format_cents(totals[REVENUE]),
+            format_cents(totals[COST]),
+            format_cents(totals[PROFIT]),
+            totals[UNITS],
+            totals[SPOILED],
+            format_cents(totals[SPOILAGE]),
+            share,
+        ]
@@ -0,0 +1,220 @@
+import csv
+
+from records import format_date, parse_date
+
+
+# The first field of the line that records which sold file the rollups match
+WATERMARK = 'WATERMARK'
+
+
+def sale_totals(quantity, sell_price, buy_price, written_off, sign=1):
+    """
+    Returns what a single sale adds to the totals of its day. Every way of
+    summing sales uses this, so the rules live in one place.
+
+    Without a lot the sale only counts towards revenue and units, like in
+    the report. A written off sale has no revenue and no units sold,
+    only the cost of the lot as a loss.
+
+    Parameters:
+    ----------
+    quantity : int
+        The number of units of the sale.
+    sell_price : int
+        The sell price per unit in cents.
+    buy_price : int or None
+        The buy price per unit of the lot in cents, or None without a lot.
+    written_off : bool
+        Whether the units were written off instead of sold.
+    sign : int
+        1 to add the sale, -1 to take it out again.
+
+    Returns:
+    -------
+    tuple of int
+        The revenue, cost, units sold and profit in cents.
+    """
+    units = sign * quantity
+    sold = 0 if written_off else units
+    if buy_price is None:
+        return sold * sell_price, 0, sold, 0
+    return sold * sell_price, units * buy_price, sold, sold * sell_price - units * buy_price
+
+
+class Rollup:
+    """
+    The sales totals of one product on one day. All amounts are in cents.
+    """
+
+    __slots__ = ('day', 'product_name', 'revenue', 'cost', 'units', 'profit')
+
+    FIELDS = ['DAY', 'PRODUCT_NAME', 'REVENUE', 'COST', 'UNITS', 'PROFIT']
+
+    def __init__(self, day, product_name, revenue, cost, units, profit):
+        self.day = day
+        self.product_name = product_name
+        self.revenue = revenue
+        self.cost = cost
+        self.units = units
+        self.profit = profit
+
+    @classmethod
+    def from_sale(cls, sale, lot, sign=1):
+        """
+        Creates the contribution of a single sale to the totals of its day.
+        The prices of the sale and lot are per unit.
+
+        Parameters:
+        ----------
+        sale : Sale
+            The sale.
+        lot : BoughtLot or None
+            The lot the sale was sold from, see sale_totals.
+        sign : int
+            1 to add the sale, -1 to take it out again.
+
+        Returns:
+        -------
+        Rollup
+            The totals of the sale.
+        """
+        buy_price = lot.buy_price if lot is not None else None
+        return cls(sale.sell_date, sale.product_name,
+                   *sale_totals(sale.quantity, sale.sell_price, buy_price, sale.written_off, sign))
+
+    @classmethod
+    def from_fields(cls, day, product_name, revenue, cost, units, profit):
+        """Creates a rollup from the string fields of a rollup file row."""
+        return cls(parse_date(day), product_name, int(revenue), int(cost), int(units), int(profit))
+
+    def to_fields(self):
+        """Returns the fields of the rollup as written to the rollup file."""
+        return [format_date(self.day), self.product_name, self.revenue, self.cost, self.units, self.profit]
+
+    def __repr__(self):
+        return (f"Rollup({format_date(self.day)!r}, {self.product_name!r}, revenue={self.revenue}, "
+                f"cost={self.cost}, units={self.units}, profit={self.profit})")
+
+
+class Rollups:
+    """
+    Daily sales totals per product, summed from rollup rows.
+
+    The rollup file is a journal: writes append the change of every sale
+    as a row, followed by a watermark row with the signature of the sold
+    file after the write. Reading sums the rows, and the rollups are only
+    valid while the watermark matches the sold file.
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.watermark = None
+        # The number of rows read from the journal, to decide when to compact it
+        self.row_count = 0
+
+    @classmethod
+    def from_data(cls, bought_data, sold_data):
+        """
+        Builds the rollups from the bought and sold data in a single pass.
+
+        Parameters:
+        ----------
+        bought_data : iterable of BoughtLot
+            The bought lots, used for the cost of each sale.
+        sold_data : iterable of Sale
+            The sales.
+
+        Returns:
+        -------
+        Rollups
+            The rollups of all sales.
+        """
+        lots = {}
+        for lot in bought_data:
+            lots.setdefault(lot.id, lot)
+
+        rollups = cls()
+        for sale in sold_data:
+            rollups.add(Rollup.from_sale(sale, lots.get(sale.bought_id)))
+        return rollups
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Reads and sums a rollup file.
+
+        Parameters:
+        ----------
+        file_name : str
+            The name of the rollup file.
+
+        Returns:
+        -------
+        Rollups or None
+            The rollups, or None if the file is missing or damaged.
+        """
+        rollups = cls()
+        try:
+            with open(file_name, newline='') as file:
+                reader = csv.reader(file, delimiter=';')
+                if next(reader, None) != Rollup.FIELDS:
+                    return None
+                for row in reader:
+                    if not row:
+                        continue
+                    if row[0] == WATERMARK:
+                        rollups.watermark = [int(value) for value in row[1:]]
+                    else:
+                        rollups.add(Rollup.from_fields(*row))
+                    rollups.row_count += 1
+        except (OSError, TypeError, ValueError):
+            return None
+        return rollups
+
+    def add(self, rollup):
+        """
+        Adds the totals of a rollup row.
+
+        Parameters:
+        ----------
+        rollup : Rollup
+            The totals to add, negative to subtract.
+
+        Returns:
+        -------
+        None
+        """
+        key = (rollup.day, rollup.product_name)
+        totals = self.totals.get(key)
+        if totals is None:
+            if rollup.revenue or rollup.cost or rollup.units or rollup.profit:
+                self.totals[key] = Rollup(rollup.day, rollup.product_name, rollup.revenue, rollup.cost, rollup.units, rollup.profit)
+            return
+
+        totals.revenue += rollup.revenue
+        totals.cost += rollup.cost
+        totals.units += rollup.units
+        totals.profit += rollup.profit
+        if not (totals.revenue or totals.cost or totals.units or totals.profit):
+            # All sales of the product on that day were deleted
+            del self.totals[key]
+
+    def rows(self, start_date=None, end_date=None):
+        """
+        Returns the totals in a date range, sorted by day and product.
+
+        Parameters:
+        ----------
+        start_date : int, optional
+            The ordinal of the first day.
+        end_date : int, optional
+            The ordinal of the last day.
+
+        Returns:
+        -------
+        list of Rollup
+            The totals per product per day.
+        """
+        start_date = start_date if start_date is not None else 1
+        end_date = end_date if end_date is not None else float('inf')
+        return [self.totals[key] for key in sorted(self.totals) if start_date <= key[0] <= end_date]
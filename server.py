@@ -0,0 +1,154 @@
+import contextlib
+import io
+import json
+import os
+import shlex
+import socket
+import socketserver
+import stat
+import sys
+
+
+def run_captured(command):
+    """
+    Runs a command and returns everything it printed.
+
+    Parameters:
+    ----------
+    command : callable
+        The command to run, without arguments.
+
+    Returns:
+    -------
+    str
+        The output of the command, or an error message.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            command()
+        except SystemExit:
+            # argparse exits after printing the usage for invalid commands
+            pass
+        except Exception as error:
+            print(f"ERROR: {error}")
+    return output.getvalue()
+
+
+def serve_repl(run, stdin=None):
+    """
+    Reads commands from stdin, one per line, until 'exit' or end of input.
+
+    Each line uses the same syntax as the command line, e.g.
+    'sell Apples 0.75'.
+
+    Parameters:
+    ----------
+    run : callable
+        Runs a command given as a list of arguments and returns its output.
+    stdin : file object, optional
+        The input to read from, sys.stdin by default.
+
+    Returns:
+    -------
+    None
+    """
+    stdin = stdin or sys.stdin
+    interactive = stdin.isatty()
+
+    while True:
+        if interactive:
+            sys.stdout.write('superpy> ')
+            sys.stdout.flush()
+
+        line = stdin.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line in ('exit', 'quit'):
+            break
+
+        try:
+            argv = shlex.split(line)
+        except ValueError as error:
+            print(f"ERROR: {error}")
+            continue
+
+        sys.stdout.write(run(argv))
+        sys.stdout.flush()
+
+
+def serve_socket(path, run):
+    """
+    Runs commands received on a Unix socket until interrupted.
+
+    Clients send one JSON array of arguments per line and receive the
+    output of the command as one JSON string per line. A connection can
+    be kept open for any number of commands. Commands are handled one at
+    a time, so they never interleave.
+
+    Parameters:
+    ----------
+    path : str
+        The path of the Unix socket.
+    run : callable
+        Runs a command given as a list of arguments and returns its output.
+
+    Returns:
+    -------
+    None
+
+    Exits with an error if another kind of file exists at the path, e.g.
+    a ledger, instead of removing it.
+    """
+    class CommandHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    argv = json.loads(line)
+                except ValueError:
+                    output = "ERROR: expected a JSON array of arguments\n"
+                else:
+                    output = run([str(arg) for arg in argv]) if isinstance(argv, list) else "ERROR: expected a JSON array of arguments\n"
+                self.wfile.write(json.dumps(output).encode() + b'\n')
+                self.wfile.flush()
+
+    # Only remove a socket left behind by an earlier server
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            sys.exit(f"Cannot listen on {path}, it exists and is not a socket.")
+        os.unlink(path)
+
+    with socketserver.UnixStreamServer(path, CommandHandler) as command_server:
+        print(f"Listening on {path}")
+        try:
+            command_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+
+def send_command(path, argv):
+    """
+    Sends a command to a running server and returns its output.
+
+    Parameters:
+    ----------
+    path : str
+        The path of the Unix socket of the server.
+    argv : list of str
+        The command line arguments of the command.
+
+    Returns:
+    -------
+    str
+        The output of the command.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(argv).encode() + b'\n')
+        with connection.makefile('rb') as response:
+            return json.loads(response.readline())
@@ -2,10 +2,19 @@
 import argparse
 import datetime
 import os
-from prettytable import PrettyTable
-from data_operations import read_bought, read_sold, write_sold, delete_bought, delete_sold
-from command_functions import buy, sell, list_products, get_revenue, plot_revenue, advance_time
+import sys
+from data_operations import read_bought, read_sold, write_sold, compact, delete, delete_bought, delete_sold, enable_cache
+from command_functions import buy, sell, buy_batch, sell_batch, list_products, get_revenue, plot_revenue, advance_time, expiring, migrate, rebuild_rollups, show_report
 from utils import get_current_date, set_current_date, filter_data_by_date, calculate_revenue
+from records import Sale, to_cents
+import data_operations
+import metrics
+import output
+import report
+
+# The commands that work on the current date. It is read once per command,
+# also when a running server executes several commands
+DATED_COMMANDS = {buy, sell, buy_batch, sell_batch, list_products, advance_time, expiring}
 
 
 # Do not change these lines.
@@ -68,6 +77,8 @@ def create_pretty_table(data):
     PrettyTable
         A PrettyTable object with the given data.
     """
+    from prettytable import PrettyTable
+
     # create a PrettyTable object from the data
     table = PrettyTable()
     for row in data:
@@ -99,73 +110,61 @@ def initialize_data_files(args):
             f.write('bought_id,product_name,sell_price,sold_date\n')
 
 
-def calculate_profit(bought_data, sold_data):
+def set_time(new_date):
     """
-    Calculates the profit based on bought and sold data.
+    Sets the current date to the given date.
 
     Parameters:
     ----------
-    bought_data : list of dict
-        The data of the bought products as a list of
-        dictionaries, where each dictionary represents
-        a row in the bought data file.
-    sold_data : list of dict
-        The data of the sold products as a list of dictionaries,
-        where each dictionary represents a row in the sold data file.
+    new_date : datetime.date
+        The date to set as the new current date.
 
     Returns:
     -------
-    float, PrettyTable
-        The calculated profit based on the bought and sold data, and a
-        PrettyTable object displaying the profit.
+    None
     """
-    profit = 0  # Initialize profit to zero
-
-    for sold_row in sold_data:  # Loop through each row in the sold data
-        bought_id = int(sold_row['ID'])  # Get the ID of the bought
-
-        # Find the corresponding bought row
-        bought_row = next((b for b in bought_data if int(b['ID']) == bought_id), None)
-
-        if bought_row is not None:  # If the bought row is found
-
-            profit += float(sold_row['SELL_PRICE']) - float(bought_row['BUY_PRICE'])  # Update the profit by subtracting the buy_price from the sell_price
-
-    # Create a pretty table with the profit data
-    table = PrettyTable()
-    table.field_names = ["Profit"]
-    table.add_row([f"${profit:.2f}"])
-
-    return profit, table
+    set_current_date(new_date)  # Write the new date to the file as the current date
 
 
-def set_time(new_date):
+def add_output_arguments(parser, default_format=None):
     """
-    Sets the current date to the given date.
+    Adds the --format, --limit and --offset options of the commands that
+    print many rows.
 
     Parameters:
     ----------
-    new_date : datetime.date
-        The date to set as the new current date.
+    parser : argparse.ArgumentParser
+        The parser of the command.
+    default_format : str, optional
+        The format used without --format.
 
     Returns:
     -------
     None
     """
-    set_current_date(new_date)  # Write the new date to the file as the current date
+    parser.add_argument('--format', choices=output.FORMATS, default=default_format, help='how to print the rows, csv, tsv and jsonl stream them for other tools')
+    parser.add_argument('--limit', type=int, help='print at most this many rows')
+    parser.add_argument('--offset', type=int, default=0, help='skip this many rows first')
 
 
-def main():
+def create_parser():
     """
-Main function of the SuperPy application.
-
-Returns:
--------
-None
-"""
+    Creates the argument parser with a subparser for each command.
 
+    Returns:
+    -------
+    argparse.ArgumentParser
+        The argument parser of the SuperPy application.
+    """
     # Create the argument parser and add subparsers for each command
     parser = argparse.ArgumentParser(description='SuperPy')
+    parser.add_argument('--backend', choices=['csv', 'sqlite', 'packed'], default='csv', help='the storage backend, csv (default), sqlite or packed (read-only)')
+    parser.add_argument('--database', default='superpy.db', help='Path to the SQLite database used by the sqlite backend')
+    parser.add_argument('--connect', metavar='SOCKET', help='send the command to a running `serve --socket SOCKET` process')
+    parser.add_argument('--verbose', action='store_true', help='print debug output to stderr')
+    parser.add_argument('--profile', action='store_true', help='print the time spent reading, joining, writing and rendering to stderr')
+    parser.add_argument('--profile-output', metavar='FILE', help='run the command under cProfile and dump the stats to FILE')
+    parser.add_argument('--metrics-json', action='store_true', help='print the timings and row counts as one line of JSON to stderr')
     subparsers = parser.add_subparsers(dest='command')
 
     # Define subparser for the 'buy' command
@@ -173,6 +172,7 @@ None
     buy_parser.add_argument('product_name', type=str, help='the name of the product')
     buy_parser.add_argument('price', type=float, help='the price of the product')
     buy_parser.add_argument('expiration_date', type=str, help='the expiration date of the product in format YYYY-MM-DD')
+    buy_parser.add_argument('--quantity', type=int, default=1, help='the number of units in the lot, default 1')
     buy_parser.add_argument("--bought_file", type=str, default="bought.csv", help="Path to the bought file.")
     buy_parser.set_defaults(func=buy)
 
@@ -180,10 +180,23 @@ None
     sell_parser = subparsers.add_parser('sell', help='sell a product')
     sell_parser.add_argument('product_name', type=str, help='the name of the product')
     sell_parser.add_argument('price', type=float, help='the price at which the product is sold')
+    sell_parser.add_argument('--quantity', type=int, default=1, help='the number of units to sell, default 1')
     sell_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
     sell_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
     sell_parser.set_defaults(func=sell)
 
+    # Define subparsers for buying and selling many products from a file
+    buy_batch_parser = subparsers.add_parser('buy_batch', aliases=['buy-batch'], help='buy many products from a CSV or JSON Lines file')
+    buy_batch_parser.add_argument('file', help="the file with product_name, price and expiration_date per line, '-' for stdin")
+    buy_batch_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    buy_batch_parser.set_defaults(func=buy_batch)
+
+    sell_batch_parser = subparsers.add_parser('sell_batch', aliases=['sell-batch'], help='sell many products from a CSV or JSON Lines file')
+    sell_batch_parser.add_argument('file', help="the file with product_name and price per line, '-' for stdin")
+    sell_batch_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    sell_batch_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    sell_batch_parser.set_defaults(func=sell_batch)
+
     # Define subparser for the 'list' command
     list_parser = subparsers.add_parser('list', help='list bought and sold products')
     list_parser.add_argument(
@@ -198,6 +211,7 @@ None
     )
     list_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
     list_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    add_output_arguments(list_parser, default_format='table')
     list_parser.set_defaults(func=list_products)
 
     # Define subparser for the 'revenue' command
@@ -206,20 +220,49 @@ None
     revenue_parser.add_argument('--end_date', type=str, help='the end date of the revenue period')
     revenue_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
     revenue_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    revenue_parser.add_argument('--engine', choices=['auto', 'numpy', 'python'], default='auto', help='how to sum the revenue, auto reads the daily rollups, numpy and python sum the sales')
+    revenue_parser.add_argument('--workers', type=int, default=1, help='the number of processes that sum the sales of the CSV files, 1 (default) reads them in this process')
+    add_output_arguments(revenue_parser)
     revenue_parser.set_defaults(func=get_revenue)
 
+    # Define subparser for the 'report' command
+    report_parser = subparsers.add_parser('report', help='sum revenue, cost, profit, units and spoilage per product and/or period')
+    report_parser.add_argument('--by', nargs='+', choices=report.GROUPS, default=['product'], help='the fields to group by, e.g. --by product month. Default is product')
+    report_parser.add_argument('--sort', choices=report.METRICS + ['group'], default='revenue', help='the total to sort on, highest first, or group to sort on the grouped fields. Default is revenue')
+    report_parser.add_argument('--start_date', type=str, help='the first sell date to include in format YYYY-MM-DD')
+    report_parser.add_argument('--end_date', type=str, help='the last sell date to include in format YYYY-MM-DD')
+    report_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    report_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    add_output_arguments(report_parser, default_format='table')
+    report_parser.set_defaults(func=show_report)
+
     # Define subparser for the 'plot' command
     plot_parser = subparsers.add_parser('plot', help='plot revenue over a period')
     plot_parser.add_argument('--start_date', type=str, help='the start date of the revenue period in format YYYY-MM-DD')
     plot_parser.add_argument('--end_date', type=str, help='the end date of the revenue period')
-    plot_parser.add_argument('--bought_file', default='bought.csv', help='Path to the sold file')
+    plot_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    plot_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    plot_parser.add_argument('--engine', choices=['auto', 'numpy', 'python'], default='auto', help='how to sum the revenue, auto reads the daily rollups, numpy and python sum the sales')
+    plot_parser.add_argument('--workers', type=int, default=1, help='the number of processes that sum the sales of the CSV files, 1 (default) reads them in this process')
+    plot_parser.add_argument('--output', help='save the plot to this file instead of showing it, e.g. revenue.png or revenue.svg')
+    plot_parser.add_argument('--bucket', choices=['daily', 'weekly', 'monthly'], default='daily', help='add up the revenue per day (default), week or month')
     plot_parser.set_defaults(func=plot_revenue)
 
     # Define subparser for the 'advance_time' command
     advance_time_parser = subparsers.add_parser('advance_time', help='advance the current date by a given number of days')
     advance_time_parser.add_argument('days', type=int, help='the number of days to advance the date by')
+    advance_time_parser.add_argument('--write_off', action='store_true', help='record the products that expire in the skipped days as written off')
+    advance_time_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    advance_time_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
     advance_time_parser.set_defaults(func=advance_time)
 
+    # Define subparser for the 'expiring' command
+    expiring_parser = subparsers.add_parser('expiring', help='list the products that expire within a number of days')
+    expiring_parser.add_argument('--within', type=int, default=7, help='the number of days to look ahead, default 7')
+    expiring_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    expiring_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    expiring_parser.set_defaults(func=expiring)
+
     # Define subparser for the 'set_time' command
     parser_set_time = subparsers.add_parser('set_time', help='Set the current date to a specific date.')
     parser_set_time.add_argument('new_date', type=str, help='The new date to set (format: YYYY-MM-DD).')
@@ -234,14 +277,111 @@ None
     # Create parser for deleting sold products
     delete_sold_parser = subparsers.add_parser('delete_sold', help='Delete a sold product from the sales record')
     delete_sold_parser.add_argument('id', type=int, help='ID of the sold product to delete')
+    delete_sold_parser.add_argument('--sold_file', default='sold.csv', help='The sold file to delete from.')
+    delete_sold_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
     delete_sold_parser.set_defaults(func=delete_sold)
 
-    # Parse the arguments and execute the appropriate command
-    args = parser.parse_args()
+    # Create parser for deleting many bought or sold products at once
+    delete_parser = subparsers.add_parser('delete', help='delete many bought or sold products at once')
+    delete_parser.add_argument('ledger', choices=['bought', 'sold'], help='the data to delete from')
+    delete_parser.add_argument('--ids', nargs='+', required=True, help="the ids to delete, e.g. 7 9,12 20-30, or '-' to read them from stdin")
+    delete_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    delete_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    delete_parser.set_defaults(func=delete)
+
+    # Create parser for rebuilding the daily rollups after editing the files by hand
+    rebuild_rollups_parser = subparsers.add_parser('rebuild_rollups', aliases=['rebuild-rollups'], help='rebuild the daily revenue and profit totals')
+    rebuild_rollups_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    rebuild_rollups_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    rebuild_rollups_parser.add_argument('--workers', type=int, default=1, help='the number of processes that sum the sales of the CSV files, 1 (default) reads them in this process')
+    rebuild_rollups_parser.set_defaults(func=rebuild_rollups)
+
+    # Create parser for compacting the data and writing a snapshot
+    compact_parser = subparsers.add_parser('compact', help='remove deleted rows and write a snapshot of the unsold products')
+    compact_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    compact_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    compact_parser.set_defaults(func=compact)
+
+    # Create parser for copying data between the CSV files and the SQLite database
+    migrate_parser = subparsers.add_parser('migrate', help='copy all data between the CSV files, the SQLite database and the packed files')
+    migrate_parser.add_argument('--to', choices=['sqlite', 'csv', 'packed'], required=True, help='the backend to copy the data to')
+    migrate_parser.add_argument('--from', dest='source', choices=['sqlite', 'csv', 'packed'], help='the backend to copy the data from, csv by default or sqlite when copying to csv')
+    migrate_parser.add_argument('--bought_file', default='bought.csv', help='Path to the bought file')
+    migrate_parser.add_argument('--sold_file', default='sold.csv', help='Path to the sold file')
+    migrate_parser.set_defaults(func=migrate)
+
+    # Create parser for running SuperPy as a long-lived process
+    serve_parser = subparsers.add_parser('serve', help='keep the data in memory and run commands from a REPL or a Unix socket')
+    serve_parser.add_argument('--socket', help='Path of the Unix socket to listen on, without it commands are read from stdin')
+    serve_parser.set_defaults(func=serve)
+
+    return parser
+
+
+def serve(args):
+    """
+    Runs SuperPy as a long-lived process that keeps the data in memory.
+
+    The bought and sold data, the inventory index and the database
+    connection are loaded once and reused by every command, which is
+    written through to storage as usual.
 
+    Parameters:
+    ----------
+    args : argparse.Namespace
+        The parsed command line arguments containing 'socket'.
+
+    Returns:
+    -------
+    None
+    """
+    # Only load the socket modules when serving
+    import server
+
+    enable_cache()
+    parser = create_parser()
+
+    def run(argv):
+        def command():
+            command_args = parser.parse_args(argv)
+            if getattr(command_args, 'func', None) is serve:
+                print("ERROR: already serving")
+            else:
+                run_command(parser, command_args)
+        return server.run_captured(command)
+
+    if args.socket:
+        server.serve_socket(args.socket, run)
+    else:
+        server.serve_repl(run)
+
+
+def run_command(parser, args):
+    """
+    Executes the command selected by the parsed arguments.
+
+    Parameters:
+    ----------
+    parser : argparse.ArgumentParser
+        The argument parser, used to print the help message.
+    args : argparse.Namespace
+        The parsed command line arguments.
+
+    Returns:
+    -------
+    None
+    """
     # Call the appropriate function based on the subparser
     if hasattr(args, 'func'):
-        args.func(args)
+        try:
+            if args.func in DATED_COMMANDS:
+                # Read the current date once and hand it to the command
+                args.func(args, get_current_date())
+            else:
+                args.func(args)
+        except RuntimeError as error:
+            # E.g. changing the read-only packed files, or a missing optional package
+            print(error)
     # Execute the appropriate function based on the user's command
     elif args.command == 'revenue':
 
@@ -270,22 +410,21 @@ None
         product_name = args.product_name
         price = args.price
 
-        # Get the current date and format it as a string in the format
-        # YYYY-MM-DD
-        sold_date = get_current_date().strftime('%Y-%m-%d')
+        # Get the current date as an ordinal
+        sold_date = get_current_date().toordinal()
 
         # Read the data of bought products
-        bought_data = read_bought()
+        bought_data = read_bought(args.bought_file)
 
         # Find the bought product with the matching name
         for bought_row in bought_data:
-            if bought_row['PRODUCT_NAME'] == product_name:
+            if bought_row.product_name == product_name:
 
                 # If a matching product is found, add a row to the sold data
                 # with the relevant information
-                sold_row = {'ID': bought_row['ID'], 'PRODUCT_NAME':
-                            product_name, 'SELL_PRICE': price, 'SELL_DATE': sold_date}
                 sold_data = read_sold()
+                sold_id = max((sale.id for sale in sold_data), default=0) + 1
+                sold_row = Sale(sold_id, bought_row.id, product_name, to_cents(price), sold_date)
                 sold_data.append(sold_row)
                 write_sold(sold_data)
                 print('OK')
@@ -365,6 +504,68 @@ None
     else:
         parser.print_help()
 
+
+def run_profiled(parser, args):
+    """
+    Executes a command while collecting metrics, and reports them as
+    requested by the --profile, --profile-output and --metrics-json options.
+
+    Parameters:
+    ----------
+    parser : argparse.ArgumentParser
+        The argument parser, used to print the help message.
+    args : argparse.Namespace
+        The parsed command line arguments.
+
+    Returns:
+    -------
+    None
+    """
+    metrics.enable()
+    try:
+        if args.profile_output:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(run_command, parser, args)
+            finally:
+                profiler.dump_stats(args.profile_output)
+        else:
+            run_command(parser, args)
+    finally:
+        metrics.disable()
+        if args.profile:
+            metrics.print_report()
+        if args.metrics_json:
+            metrics.write_json(args.command)
+
+
+def main():
+    """
+Main function of the SuperPy application.
+
+Returns:
+-------
+None
+"""
+    parser = create_parser()
+
+    # Parse the arguments and execute the appropriate command
+    args = parser.parse_args()
+
+    if args.connect and (args.profile or args.profile_output or args.metrics_json):
+        # The command runs in the server, so there is nothing to measure here
+        parser.error("--profile, --profile-output and --metrics-json cannot be used with --connect")
+    if args.connect:
+        import server
+
+        # Let the running server execute the command, it ignores --connect
+        sys.stdout.write(server.send_command(args.connect, sys.argv[1:]))
+    elif args.profile or args.profile_output or args.metrics_json:
+        run_profiled(parser, args)
+    else:
+        run_command(parser, args)
+
 # This line is used to ensure that the main function is only executed
 # when the script is run as the main program, and not when it is imported
 # as a module into another program
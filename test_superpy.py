@@ -15,3 +15,243 @@
 # python superpy.py advance_time 7
 
 # python superpy.py set_time 2023-04-01
+
+
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from data_operations import CsvBackend, SqliteBackend, parse_ids, write_bought, write_sold
+from inventory import Inventory
+from records import BoughtLot, Sale
+import report
+from rollups import Rollups
+
+SUPERPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'superpy.py')
+PRODUCTS = ['Apples', 'Oranges', 'Bananas', 'Pears']
+START_DATE = datetime.date(2023, 3, 1).toordinal()
+
+# The time SuperPy may take to start on top of the interpreter itself, the
+# same budget as in benchmarks/bench_startup.py, and the packages that must
+# only be imported by the commands that use them
+STARTUP_BUDGET_MS = 150
+HEAVY_MODULES = ['matplotlib', 'prettytable', 'numpy', 'sqlite3', 'socketserver', 'packed', 'hashlib']
+
+
+def run_superpy(directory, *arguments):
+    """Runs a SuperPy command in a directory and returns its output."""
+    result = subprocess.run([sys.executable, SUPERPY, *arguments], cwd=directory, capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    """
+    Writes a small ledger to a temporary directory: 40 lots of 1 to 4
+    units over 20 days, with some units of most lots sold, and sets the
+    current date to the last day. The rows are in ID order and in date
+    order, like in a ledger SuperPy appended to.
+    """
+    lots = [BoughtLot(number, PRODUCTS[number % len(PRODUCTS)], 40 + number, START_DATE + number + 10,
+                      START_DATE + number // 2, number % 4 + 1)
+            for number in range(1, 41)]
+    sold_lots = sorted((lot for lot in lots if lot.id % 5), key=lambda lot: (lot.buy_date + lot.id % 3, lot.id))
+    sales = [Sale(number, lot.id, lot.product_name, lot.buy_price * 3 // 2, lot.buy_date + lot.id % 3, lot.quantity - lot.id % 2)
+             for number, lot in enumerate(sold_lots, 1)]
+    write_bought(lots, str(tmp_path / 'bought.csv'))
+    write_sold(sales, str(tmp_path / 'sold.csv'))
+    (tmp_path / 'current_date.txt').write_text(datetime.date.fromordinal(START_DATE + 20).isoformat())
+    return tmp_path
+
+
+def test_parallel_rollups_match_serial(ledger):
+    backend = CsvBackend(str(ledger / 'bought.csv'), str(ledger / 'sold.csv'))
+    serial = Rollups.from_data(backend.iter_bought(), backend.iter_sold()).rows()
+    parallel = backend.parallel_rollups(2).rows()
+    assert [rollup.to_fields() for rollup in parallel] == [rollup.to_fields() for rollup in serial]
+
+
+def test_parallel_revenue_matches_serial(ledger):
+    for dates in ([], ['--start_date', '2023-03-05', '--end_date', '2023-03-15']):
+        serial = run_superpy(ledger, 'revenue', '--engine', 'python', *dates)
+        assert run_superpy(ledger, 'revenue', '--workers', '2', *dates) == serial
+
+
+def median_time(*arguments, runs=5):
+    """Returns the median wall-clock time of a Python process in milliseconds."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *arguments], capture_output=True, check=True)
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def test_startup_within_budget():
+    startup_ms = median_time(SUPERPY, '--help') - median_time('-c', 'pass')
+    assert startup_ms < STARTUP_BUDGET_MS
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', SUPERPY, '--help'], capture_output=True, text=True, check=True)
+    imported = {line.split('|')[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+    assert not imported & set(HEAVY_MODULES)
+
+
+def report_totals(directory):
+    """Sums the revenue, units and spoiled units of the report per product."""
+    rows = [json.loads(line) for line in run_superpy(directory, 'report', '--format', 'jsonl').splitlines()]
+    return (sum(float(row['revenue']) for row in rows), sum(row['units'] for row in rows),
+            sum(row['spoiled'] for row in rows))
+
+
+def test_write_offs_are_not_sales(ledger):
+    revenue = run_superpy(ledger, 'revenue')
+    sold_units = [row['units_sold'] for row in map(json.loads, run_superpy(ledger, 'list', '--format', 'jsonl').splitlines())]
+    total_revenue, units, spoiled = report_totals(ledger)
+
+    assert 'Wrote off' in run_superpy(ledger, 'advance_time', '5', '--write_off')
+    assert run_superpy(ledger, 'revenue') == revenue
+    assert [row['units_sold'] for row in map(json.loads, run_superpy(ledger, 'list', '--format', 'jsonl').splitlines())] == sold_units
+    new_revenue, new_units, new_spoiled = report_totals(ledger)
+    assert (new_revenue, new_units) == (total_revenue, units) and new_spoiled > spoiled
+
+
+def test_margin_leaves_out_sales_without_a_lot():
+    lots = [BoughtLot(1, 'Apples', 50, START_DATE + 10, START_DATE, 2)]
+    sales = [Sale(1, 1, 'Apples', 100, START_DATE + 1, 2), Sale(2, None, 'Apples', 300, START_DATE + 1)]
+    totals = report.aggregate(lots, sales, ['product'])[('Apples',)]
+    assert totals[report.REVENUE] == 500 and totals[report.PROFIT] == 100
+    assert report.margin(totals) == 0.5
+
+
+@pytest.mark.parametrize('in_id_order', [True, False])
+def test_delete_bought_updates_rollups(ledger, in_id_order):
+    backend = CsvBackend(str(ledger / 'bought.csv'), str(ledger / 'sold.csv'))
+    if not in_id_order:
+        # Rows are found without a binary search in a ledger that is out of ID order
+        backend.write_sold(backend.read_sold()[::-1])
+        backend.write_bought(backend.read_bought()[::-1])
+    backend.rebuild_rollups()
+    sold_lots = {sale.bought_id for sale in backend.read_sold()}
+    assert {1, 2} <= sold_lots
+
+    assert backend.delete_bought([1, 2]) == {1, 2}
+    # Sales appended after the index of the sales of every lot was written
+    lot = max(backend.read_bought(), key=lambda lot: lot.id)
+    backend.append_sold(Sale(backend.next_sold_id(), lot.id, lot.product_name, 100, START_DATE + 20), lot)
+    assert backend.delete_sold([3]) == {3}
+    assert backend.delete_bought([lot.id, 4]) == {lot.id, 4}
+
+    assert not {1, 2, 4, lot.id} & {row.id for row in backend.read_bought()}
+    assert 3 not in {sale.id for sale in backend.read_sold()}
+
+    rollups = Rollups.load(str(ledger / 'sold.csv.rollup')).rows()
+    expected = Rollups.from_data(backend.iter_bought(), backend.iter_sold()).rows()
+    assert [rollup.to_fields() for rollup in rollups] == [rollup.to_fields() for rollup in expected]
+
+
+@pytest.fixture
+def apple_lots(tmp_path):
+    """
+    Writes lots of apples to a temporary directory, out of expiration order
+    and with one lot that expired yesterday, and returns them.
+    """
+    lots = [BoughtLot(1, 'Apples', 50, START_DATE + 9, START_DATE - 5, 3),
+            BoughtLot(2, 'Apples', 50, START_DATE - 1, START_DATE - 5, 4),
+            BoughtLot(3, 'Apples', 50, START_DATE + 2, START_DATE - 5, 2),
+            BoughtLot(4, 'Pears', 50, START_DATE + 1, START_DATE - 5, 5),
+            BoughtLot(5, 'Apples', 50, START_DATE + 2, START_DATE - 4, 1),
+            BoughtLot(6, 'Apples', 50, START_DATE + 5, START_DATE - 4, 2)]
+    write_bought(lots, str(tmp_path / 'bought.csv'))
+    (tmp_path / 'current_date.txt').write_text(datetime.date.fromordinal(START_DATE).isoformat())
+    return lots
+
+
+def test_allocate_takes_lots_that_expire_first(tmp_path, apple_lots):
+    # The expired lot 2 and the pears are skipped, lots that expire on the same day go by ID
+    expected = [(3, 2), (5, 1), (6, 2), (1, 1)]
+    inventory = Inventory.from_data(apple_lots, [])
+    assert [(lot.id, units) for lot, units in inventory.allocate('Apples', START_DATE, 6)] == expected
+
+    csv_backend = CsvBackend(str(tmp_path / 'bought.csv'), str(tmp_path / 'sold.csv'))
+    sqlite_backend = SqliteBackend(str(tmp_path / 'superpy.db'))
+    sqlite_backend.write_bought(apple_lots)
+    for backend in (csv_backend, sqlite_backend):
+        assert [(lot.id, units) for lot, units in backend.allocate('Apples', START_DATE, 6)] == expected
+    sqlite_backend.close()
+
+    run_superpy(tmp_path, 'sell', 'Apples', '1.00', '--quantity', '6')
+    assert [(sale.bought_id, sale.quantity) for sale in csv_backend.read_sold()] == expected
+
+
+def test_sell_without_enough_stock_sells_nothing(tmp_path, apple_lots):
+    inventory = Inventory.from_data(apple_lots, [])
+    assert inventory.allocate('Apples', START_DATE, 9) == []
+    # The lots used up while trying are put back
+    assert [(lot.id, units) for lot, units in inventory.allocate('Apples', START_DATE, 8)] == [(3, 2), (5, 1), (6, 2), (1, 3)]
+
+    run_superpy(tmp_path, 'sell', 'Apples', '1.00', '--quantity', '5')
+    assert 'Cannot sell' in run_superpy(tmp_path, 'sell', 'Apples', '1.00', '--quantity', '4')
+    backend = CsvBackend(str(tmp_path / 'bought.csv'), str(tmp_path / 'sold.csv'))
+    assert [(sale.bought_id, sale.quantity) for sale in backend.read_sold()] == [(3, 2), (5, 1), (6, 2)]
+    assert sum(rollup.units for rollup in backend.read_rollups()) == 5
+
+
+def test_next_id_is_above_every_row(tmp_path):
+    # A sold file written by another program, with the ID column second and the rows in date order
+    (tmp_path / 'sold.csv').write_text('BOUGHT_ID;ID;PRODUCT_NAME;SELL_PRICE;SELL_DATE\n'
+                                       ';5;Apples;1.00;2023-03-01\n;9;Pears;1.00;2023-03-02\n;2;Apples;1.00;2023-03-03\n')
+    (tmp_path / 'current_date.txt').write_text('2023-03-04')
+    backend = CsvBackend(str(tmp_path / 'bought.csv'), str(tmp_path / 'sold.csv'))
+    assert backend.next_sold_id() == 10
+
+    run_superpy(tmp_path, 'buy', 'Apples', '0.50', '2023-03-10')
+    run_superpy(tmp_path, 'sell', 'Apples', '1.00')
+    assert [sale.id for sale in backend.read_sold()] == [5, 9, 2, 10]
+    assert backend.next_sold_id() == 11
+
+
+def test_id_ranges_stop_at_the_last_id():
+    assert parse_ids(['3', '5-1000000000', '1,2'], last_id=7) == {1, 2, 3, 5, 6, 7}
+
+
+def test_sale_during_rollup_rebuild_is_counted_once(ledger):
+    rollups_written = threading.Event()
+
+    class SlowSeller(CsvBackend):
+        def _record_rollups(self, changes, signature):
+            # Record the sale only after the rebuild wrote its file
+            rollups_written.wait(1)
+            super()._record_rollups(changes, signature)
+
+    class SlowReader(CsvBackend):
+        def iter_sold(self, start_date=None, end_date=None):
+            # Sell from another backend while the rebuild reads the sales
+            seller_thread.start()
+            seller_thread.join(0.2)
+            return super().iter_sold(start_date, end_date)
+
+        def _write_rollups(self, rollups, signature):
+            super()._write_rollups(rollups, signature)
+            rollups_written.set()
+
+    seller = SlowSeller(str(ledger / 'bought.csv'), str(ledger / 'sold.csv'))
+    lot = seller.read_bought()[-1]
+
+    def sell():
+        with seller.transaction():
+            seller.append_sold(Sale(seller.next_sold_id(), lot.id, lot.product_name, 100, START_DATE + 20), lot)
+
+    seller_thread = threading.Thread(target=sell)
+    SlowReader(str(ledger / 'bought.csv'), str(ledger / 'sold.csv')).read_rollups()
+    seller_thread.join()
+
+    expected = Rollups.from_data(seller.iter_bought(), seller.iter_sold()).rows()
+    rollups = Rollups.load(str(ledger / 'sold.csv.rollup')).rows()
+    assert [rollup.to_fields() for rollup in rollups] == [rollup.to_fields() for rollup in expected]
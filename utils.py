@@ -1,33 +1,86 @@
 import datetime
 import datetime as dt
-from prettytable import PrettyTable
 import os
 
 
+class CurrentDate:
+    """
+    Provides the simulated current date stored in a file.
+
+    The file is only read again when its modification time or size
+    changes, or when the date is set through this provider, so asking
+    for the date is cheap enough to do anywhere.
+    """
+
+    def __init__(self, file_name='current_date.txt'):
+        self.file_name = file_name
+        self._signature = None
+        self._date = None
+
+    def get(self):
+        """
+        Gets the current date as a datetime.date object.
+
+        Returns:
+        -------
+        datetime.date
+            The date in the file, or today's date if there is no file.
+        """
+        try:
+            stat = os.stat(self.file_name)
+        except FileNotFoundError:
+            # If the file does not exist, return today's date
+            self._signature = None
+            return datetime.date.today()
+
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            # Read the date string from the file and convert it to a date object
+            with open(self.file_name, 'r') as file:
+                self._date = datetime.datetime.strptime(file.read().strip(), '%Y-%m-%d').date()
+            self._signature = signature
+        return self._date
+
+    def set(self, new_date):
+        """
+        Sets the current date by writing it to the file.
+
+        Parameters:
+        ----------
+        new_date : datetime.date
+            The new date to set as the current date.
+
+        Returns:
+        -------
+        None
+        """
+        # Write the new date to the file as a string in the format YYYY-MM-DD
+        with open(self.file_name, 'w') as file:
+            file.write(new_date.strftime('%Y-%m-%d'))
+
+        stat = os.stat(self.file_name)
+        self._signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self._date = new_date
+
+
+# The process-wide provider of the current date
+current_date = CurrentDate()
+
+
 def get_current_date():
     """
     Gets the current date as a datetime.date object.
 
     If a current date is set in the `current_date.txt` file, return that date.
-    Otherwise, return today's date.
+    Otherwise, return today's date. The file is only read again after it
+    changed.
 
     Returns:
     -------
     datetime.date
         The current date.
     """
-    # Check if 'current_date.txt' file exists
-    if os.path.exists('current_date.txt'):
-        # Open the 'current_date.txt' file in read mode
-        with open('current_date.txt', 'r') as file:
-            # Read the date string from the file
-            date_str = file.read().strip()
-            # If the file is not empty, convert the date string to a date object using strptime
-            # and return it
-            return datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-    else:
-        # If 'current_date.txt' file does not exist or is empty, return today's date
-        return datetime.date.today()
+    return current_date.get()
 
 
 def set_current_date(new_date):
@@ -43,11 +96,7 @@ def set_current_date(new_date):
     -------
     None
     """
-    # Open the 'current_date.txt' file in write mode
-    # and write the new date to the file as a string
-    # in the format YYYY-MM-DD
-    with open('current_date.txt', 'w') as file:
-        file.write(new_date.strftime('%Y-%m-%d'))
+    current_date.set(new_date)
 
 
 def filter_data_by_date(data, start_date, end_date):
@@ -57,25 +106,29 @@ def filter_data_by_date(data, start_date, end_date):
     Parameters:
     -----------
     data: list
-        A list of dictionaries containing sales data.
+        A list of sales or bought lots.
 
-    start_date: str
-        The start date in 'YYYY-MM-DD' format.
+    start_date: datetime.date
+        The first date of the range.
 
-    end_date: str
-        The end date in 'YYYY-MM-DD' format.
+    end_date: datetime.date
+        The last date of the range.
 
     Returns:
     --------
     list
-        A list of dictionaries containing sales data filtered by the date range.
+        A list of the records filtered by the date range.
     """
+    start = start_date.toordinal()
+    end = end_date.toordinal()
+
     filtered_data = []
-    # Loop through each row of data and compare its date to the date range
-    for row in data:
-        sell_date = dt.strptime(row['SELL_DATE'], '%Y-%m-%d').date()
-        if start_date <= str(sell_date) <= end_date:
-            filtered_data.append(row.copy())
+    # Loop through each record and compare its date to the date range
+    for record in data:
+        # Sales are filtered on their sell date, bought lots on their buy date
+        date = record.sell_date if hasattr(record, 'sell_date') else record.buy_date
+        if start <= date <= end:
+            filtered_data.append(record)
     return filtered_data
 
 
@@ -99,8 +152,7 @@ def calculate_revenue(args):
     Raises:
     ------
     ValueError:
-        If the sold_data is empty or does not contain any
-        'sell_price' values.
+        If the sold_data is empty.
     """
     sold_data = args.sold_data
 
@@ -108,15 +160,8 @@ def calculate_revenue(args):
     if not sold_data:
         raise ValueError("No sold_data provided.")
 
-    # Initialize revenue to 0.0
-    revenue = 0.0
-
-    # Calculate the total revenue from the sold_data
-    for row in sold_data:
-        # Check if each row contains a 'sell_price' value
-        if 'sell_price' not in row:
-            raise ValueError("Missing sell_price value in sold_data.")
-        revenue += float(row['sell_price'])
+    # Calculate the total revenue in cents from the sold_data, without the write-offs
+    revenue = sum(sale.sell_price * sale.quantity for sale in sold_data if not sale.written_off) / 100
 
     # Create a PrettyTable object with the headers and data
     table = create_pretty_table([{"Total Revenue": f"${revenue:.2f}"}])
@@ -141,6 +186,8 @@ def create_pretty_table(data):
     PrettyTable
         A PrettyTable object with the given data.
     """
+    from prettytable import PrettyTable
+
     # create a PrettyTable object from the data
     table = PrettyTable()
     for row in data: